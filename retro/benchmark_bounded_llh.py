@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+
+"""
+Measure how often and how early `likelihood.get_neg_llh_bounded` aborts, and
+the resulting speedup over `likelihood.get_neg_llh_fused`, on a
+particle-swarm-like set of proposals: hypotheses drawn uniformly within a box
+around a reference hypothesis for each event, evaluated against a threshold
+a fixed amount above the reference hypothesis's negative log likelihood.
+
+Tables are loaded and stacked with the same hypo- and table-related arguments
+as `scan_neg_llh.py` (--fused is implied).
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = ['DFLT_SPREAD', 'get_proposals', 'benchmark_event', 'parse_args',
+           'main']
+
+__author__ = 'J.L. Lanfranchi'
+__license__ = '''Copyright 2017 Justin L. Lanfranchi
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.'''
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from os.path import abspath, dirname
+import pickle
+import sys
+import time
+
+import numpy as np
+
+if __name__ == '__main__' and __package__ is None:
+    RETRO_DIR = dirname(dirname(abspath(__file__)))
+    if RETRO_DIR not in sys.path:
+        sys.path.append(RETRO_DIR)
+from retro import HYPO_PARAMS_T
+from retro.likelihood import (
+    get_event_context, get_neg_llh_bounded, get_neg_llh_fused
+)
+from retro.scan_neg_llh import (
+    add_setup_args, photons_to_hits, setup_dom_tables, setup_hypo_handler
+)
+from retro.utils.misc import expand
+
+
+DFLT_SPREAD = HYPO_PARAMS_T(
+    t=200.0,
+    x=50.0,
+    y=50.0,
+    z=50.0,
+    track_zenith=0.5,
+    track_azimuth=1.0,
+    track_energy=20.0,
+    cascade_energy=20.0
+)
+"""Default half-width of the box around the reference hypothesis from which
+proposals are drawn (units of ns, m, rad, and GeV)"""
+
+
+def get_proposals(ref_hypo, spread, num_proposals, random_state):
+    """Draw hypotheses uniformly within a box around `ref_hypo`.
+
+    Parameters
+    ----------
+    ref_hypo, spread : HYPO_PARAMS_T
+    num_proposals : int
+    random_state : numpy.random.RandomState
+
+    Returns
+    -------
+    proposals : list of HYPO_PARAMS_T
+        Energies are clipped at zero
+
+    """
+    offsets = random_state.uniform(
+        -1, 1, size=(num_proposals, len(HYPO_PARAMS_T._fields))
+    ) * np.array(spread)
+    proposals = np.array(ref_hypo)[np.newaxis, :] + offsets
+    for param in ('track_energy', 'cascade_energy'):
+        idx = HYPO_PARAMS_T._fields.index(param)
+        proposals[:, idx] = np.clip(proposals[:, idx], 0, None)
+    return [HYPO_PARAMS_T(*proposal) for proposal in proposals.tolist()]
+
+
+def benchmark_event(proposals, threshold, metric_kw):
+    """Evaluate proposals for one event with `get_neg_llh_fused` and with
+    `get_neg_llh_bounded`.
+
+    Parameters
+    ----------
+    proposals : sequence of HYPO_PARAMS_T
+    threshold : float
+    metric_kw : mapping
+        Keyword arguments for the likelihood functions (other than `hypo`)
+
+    Returns
+    -------
+    info : OrderedDict
+        Keys are "abort_fraction", "dom_fraction" (mean fraction of DOMs
+        computed by `get_neg_llh_bounded`), "fused_time", and "bounded_time"
+        (seconds)
+
+    """
+    dom_hits_start = metric_kw['hits'].hits.dom_hits_start
+    if metric_kw['tdi_table'] is None:
+        num_doms = len(dom_hits_start) - 1
+    else:
+        # Only hit DOMs are computed when a TDI table is used
+        num_doms = np.count_nonzero(np.diff(dom_hits_start))
+
+    t0 = time.time()
+    for hypo in proposals:
+        get_neg_llh_fused(hypo, **metric_kw)
+    fused_time = time.time() - t0
+
+    num_aborted = 0
+    num_doms_computed = 0
+    t0 = time.time()
+    for hypo in proposals:
+        _, complete, n_doms = get_neg_llh_bounded(
+            hypo, threshold=threshold, **metric_kw
+        )
+        num_aborted += not complete
+        num_doms_computed += n_doms
+    bounded_time = time.time() - t0
+
+    return OrderedDict([
+        ('abort_fraction', num_aborted / len(proposals)),
+        ('dom_fraction', num_doms_computed / (len(proposals) * num_doms)),
+        ('fused_time', fused_time),
+        ('bounded_time', bounded_time)
+    ])
+
+
+def parse_args(description=__doc__):
+    """Parse command-line arguments"""
+    parser = ArgumentParser(description=description)
+    parser.add_argument(
+        '--hits', required=True,
+        help='''Pickle file containing a sequence of events' hits'''
+    )
+    parser.add_argument(
+        '--hits-are-photons', action='store_true',
+    )
+    parser.add_argument(
+        '--time-window', type=float, required=True,
+    )
+    parser.add_argument(
+        '--n-events', type=int, default=None
+    )
+    parser.add_argument(
+        '--start-event-idx', type=int, default=0
+    )
+    parser.add_argument(
+        '--ref-hypos', required=True,
+        help='''.npy file containing an array of shape (n_events, {}), one
+        reference hypothesis per event (starting with the first event in
+        --hits) with columns {}'''.format(
+            len(HYPO_PARAMS_T._fields), HYPO_PARAMS_T._fields
+        )
+    )
+    parser.add_argument(
+        '--n-proposals', type=int, default=200,
+        help='''Number of proposals per event'''
+    )
+    parser.add_argument(
+        '--spread', type=str, default=None,
+        help='''Comma-separated half-widths, one per hypothesis parameter,
+        of the box around each reference hypothesis from which proposals are
+        drawn; defaults to DFLT_SPREAD'''
+    )
+    parser.add_argument(
+        '--threshold-offset', type=float, default=100.0,
+        help='''Threshold is this much above the reference hypothesis's
+        negative log likelihood'''
+    )
+    parser.add_argument(
+        '--seed', type=int, default=0
+    )
+    add_setup_args(parser)
+    return parser.parse_args()
+
+
+def main():
+    """Script "main" function"""
+    kwargs = vars(parse_args())
+    time_window = kwargs.pop('time_window')
+    hits_are_photons = kwargs.pop('hits_are_photons')
+    kwargs.pop('fused')
+    num_threads = kwargs.pop('num_threads')
+    num_proposals = kwargs.pop('n_proposals')
+    threshold_offset = kwargs.pop('threshold_offset')
+    random_state = np.random.RandomState(kwargs.pop('seed'))
+    spread = kwargs.pop('spread')
+    if spread is None:
+        spread = DFLT_SPREAD
+    else:
+        spread = HYPO_PARAMS_T(*[float(s) for s in spread.split(',')])
+
+    ref_hypos = np.load(expand(kwargs.pop('ref_hypos')))
+    with open(expand(kwargs.pop('hits')), 'rb') as hits_file:
+        hits = pickle.load(hits_file)
+    start_event_idx = kwargs.pop('start_event_idx')
+    n_events = kwargs.pop('n_events')
+    stop_event_idx = None if n_events is None else start_event_idx + n_events
+
+    print('Loading hypo kernels and tables')
+    t0 = time.time()
+    hypo_handler = setup_hypo_handler(kwargs)
+    dom_tables, tdi_table = setup_dom_tables(kwargs)
+    dom_tables.stack_tables()
+    print('  -> {:.3f} s\n'.format(time.time() - t0))
+
+    totals = OrderedDict([
+        ('abort_fraction', 0.0),
+        ('dom_fraction', 0.0),
+        ('fused_time', 0.0),
+        ('bounded_time', 0.0)
+    ])
+    num_events = 0
+    for event_ofst, event_hits in enumerate(
+            hits[start_event_idx:stop_event_idx]
+        ):
+        event_idx = start_event_idx + event_ofst
+        if hits_are_photons:
+            event_hits = photons_to_hits(event_hits, dom_tables.angsens_poly)
+        metric_kw = dict(
+            hits=get_event_context(
+                hits=event_hits, time_window=time_window,
+                dom_tables=dom_tables
+            ),
+            time_window=time_window,
+            hypo_handler=hypo_handler,
+            dom_tables=dom_tables,
+            tdi_table=tdi_table,
+        )
+        ref_hypo = HYPO_PARAMS_T(*ref_hypos[event_idx])
+        threshold = (
+            get_neg_llh_fused(ref_hypo, num_threads=num_threads, **metric_kw)
+            + threshold_offset
+        )
+        proposals = get_proposals(
+            ref_hypo, spread, num_proposals, random_state
+        )
+        # Compile before timing
+        get_neg_llh_bounded(proposals[0], threshold=threshold, **metric_kw)
+
+        info = benchmark_event(proposals, threshold, metric_kw)
+        print('event {:d}: aborted {:.1%}, DOMs computed {:.1%},'
+              ' fused {:.3f} ms/pt, bounded {:.3f} ms/pt'.format(
+                  event_idx, info['abort_fraction'], info['dom_fraction'],
+                  info['fused_time'] / num_proposals * 1e3,
+                  info['bounded_time'] / num_proposals * 1e3
+              ))
+        for key in totals:
+            totals[key] += info[key]
+        num_events += 1
+
+    print('\nAll events: aborted {:.1%}, DOMs computed {:.1%}, speedup'
+          ' {:.2f}x'.format(
+              totals['abort_fraction'] / num_events,
+              totals['dom_fraction'] / num_events,
+              totals['fused_time'] / totals['bounded_time']
+          ))
+
+
+if __name__ == '__main__':
+    main()
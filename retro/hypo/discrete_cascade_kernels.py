@@ -8,7 +8,7 @@ hypo_kernels in discrete_hypo/DiscreteHypo class.
 
 from __future__ import absolute_import, division, print_function
 
-__all__ = ['point_cascade']
+__all__ = ['POINT_CASCADE_HYPO_PARAMS', 'point_cascade']
 
 __author__ = 'P. Eller, J.L. Lanfranchi'
 __license__ = '''Copyright 2017 Philipp Eller and Justin L. Lanfranchi
@@ -39,6 +39,10 @@ from retro.const import CASCADE_PHOTONS_PER_GEV
 from retro.hypo.discrete_hypo import SRC_DTYPE, SRC_OMNI
 
 
+POINT_CASCADE_HYPO_PARAMS = ('t', 'x', 'y', 'z', 'cascade_energy')
+"""Hypothesis parameters the `point_cascade` kernel depends on"""
+
+
 @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
 def point_cascade(hypo_params):
     """Point-like cascade.
@@ -11,6 +11,7 @@ __all__ = '''
     SRC_DTYPE
     SRC_OMNI
     SRC_CKV_BETA1
+    LRUCache
     DiscreteHypo
 '''.split()
 
@@ -29,7 +30,7 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.'''
 
-from collections import Mapping
+from collections import Mapping, OrderedDict
 from copy import deepcopy
 
 import numpy as np
@@ -58,6 +59,76 @@ SRC_CKV_BETA1 = np.uint32(1)
 """Source kind designator for a point emitting Cherenkov light with beta ~ 1"""
 
 
+class LRUCache(object):
+    """Mapping of bounded size that discards the least-recently-used item
+    when full, keeping count of lookups that hit and miss.
+
+    Parameters
+    ----------
+    max_size : int > 0
+
+    """
+    def __init__(self, max_size):
+        if max_size < 1:
+            raise ValueError('`max_size` must be >= 1; got {}'.format(max_size))
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        """Get the item stored under `key`, marking it most recently used.
+
+        Returns
+        -------
+        value : object or None
+            None if `key` is not in the cache
+
+        """
+        value = self.items.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.items[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store `value` under `key`, discarding the least-recently-used item
+        if the cache is full"""
+        self.items.pop(key, None)
+        if len(self.items) >= self.max_size:
+            self.items.popitem(last=False)
+        self.items[key] = value
+
+    def clear(self):
+        """Remove all items and reset hit/miss counts"""
+        self.items.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        """Get hit/miss statistics.
+
+        Returns
+        -------
+        stats : OrderedDict
+            Keys are 'hits', 'misses', 'hit_rate', 'size', and 'max_size'
+
+        """
+        num_lookups = self.hits + self.misses
+        return OrderedDict([
+            ('hits', self.hits),
+            ('misses', self.misses),
+            ('hit_rate', self.hits / num_lookups if num_lookups else 0.0),
+            ('size', len(self.items)),
+            ('max_size', self.max_size)
+        ])
+
+
 class DiscreteHypo(object):
     """Discretely-sampled event hypothesis.
 
@@ -77,8 +148,32 @@ class DiscreteHypo(object):
         kernel via **kwargs. An item in the iterable can be None for a kernel
         function that takes no additional kwargs.
 
+    cache_size : int >= 0
+        If nonzero, memoize the sources of up to this many hypotheses (and,
+        separately, of up to this many evaluations of each kernel) in
+        least-recently-used caches, so that revisited hypotheses or kernel
+        components cost nothing to regenerate. Cached arrays are returned
+        as-is, so they must not be modified by callers.
+
+    cache_quanta : None, float, or mapping, optional
+        Quantize hypothesis parameters by these amounts for the purposes of
+        cache lookups, such that hypotheses differing by less than the
+        quanta share (approximate) sources. A float applies to all
+        parameters; a mapping gives the quantum by parameter name, and
+        parameters not in the mapping are not quantized. If None, lookups
+        require parameters to match exactly.
+
+    kernel_params : None or iterable (len == len(`hypo_kernels`))
+        Names of the hypothesis parameters each kernel depends on (e.g.
+        `discrete_cascade_kernels.POINT_CASCADE_HYPO_PARAMS`); kernel caches
+        are keyed on just these. An item can be None for a kernel that
+        depends on all parameters.
+
     """
-    def __init__(self, hypo_kernels, kernel_kwargs=None):
+    def __init__(
+            self, hypo_kernels, kernel_kwargs=None, cache_size=0,
+            cache_quanta=None, kernel_params=None
+        ):
         # If a single kernel is passed, make it into a singleton list
         if callable(hypo_kernels):
             hypo_kernels = [hypo_kernels]
@@ -94,8 +189,84 @@ class DiscreteHypo(object):
         # Translate each None into an empty dict
         kernel_kwargs = [{} if kw is None else kw for kw in kernel_kwargs]
 
+        if kernel_params is None:
+            kernel_params = [None] * len(hypo_kernels)
+        assert len(kernel_params) == len(hypo_kernels)
+        kernel_params = [
+            None if params is None else tuple(params)
+            for params in kernel_params
+        ]
+
         self.hypo_kernels = hypo_kernels
         self.kernel_kwargs = kernel_kwargs
+        self.kernel_params = kernel_params
+        self.cache_quanta = cache_quanta
+
+        self.sources_cache = None
+        self.kernel_sources_caches = None
+        if cache_size > 0:
+            self.sources_cache = LRUCache(cache_size)
+            self.kernel_sources_caches = [
+                LRUCache(cache_size) for _ in hypo_kernels
+            ]
+
+    def get_cache_key(self, hypo_params, param_names=None):
+        """Get the key for looking up `hypo_params` in the caches.
+
+        Parameters
+        ----------
+        hypo_params : HYPO_PARAMS_T
+        param_names : None or sequence of strings
+            Only include these parameters in the key; None includes all
+
+        Returns
+        -------
+        key : tuple
+
+        """
+        if param_names is None:
+            param_names = hypo_params._fields
+        quanta = self.cache_quanta
+        if quanta is None:
+            return tuple(getattr(hypo_params, name) for name in param_names)
+        key = []
+        for name in param_names:
+            val = getattr(hypo_params, name)
+            if isinstance(quanta, Mapping):
+                quantum = quanta.get(name, None)
+            else:
+                quantum = quanta
+            if quantum:
+                val = int(np.round(val / quantum))
+            key.append(val)
+        return tuple(key)
+
+    def get_cache_stats(self):
+        """Get hit/miss statistics of the sources caches.
+
+        Returns
+        -------
+        stats : OrderedDict
+            Keys are 'sources' (whole-hypothesis cache) and 'kernel<i>' for
+            each kernel's cache; values are as returned by
+            `LRUCache.get_stats`. Empty if caching is disabled.
+
+        """
+        stats = OrderedDict()
+        if self.sources_cache is None:
+            return stats
+        stats['sources'] = self.sources_cache.get_stats()
+        for kernel_idx, cache in enumerate(self.kernel_sources_caches):
+            stats['kernel{}'.format(kernel_idx)] = cache.get_stats()
+        return stats
+
+    def clear_cache(self):
+        """Remove all cached sources and reset hit/miss counts"""
+        if self.sources_cache is None:
+            return
+        self.sources_cache.clear()
+        for cache in self.kernel_sources_caches:
+            cache.clear()
 
     def get_sources(self, hypo_params):
         """Evaluate the discrete hypothesis (all hypo kernels) given particular
@@ -114,7 +285,74 @@ class DiscreteHypo(object):
             Each row is a `SRC_DTYPE`.
 
         """
-        sources = []
-        for kernel, kwargs in zip(self.hypo_kernels, self.kernel_kwargs):
-            sources.append(kernel(hypo_params, **kwargs))
-        return np.concatenate(sources, axis=0)
+        if self.sources_cache is None:
+            return np.concatenate(self.get_kernel_sources(hypo_params), axis=0)
+
+        key = self.get_cache_key(hypo_params)
+        sources = self.sources_cache.get(key)
+        if sources is None:
+            sources = np.concatenate(
+                self.get_kernel_sources(hypo_params), axis=0
+            )
+            self.sources_cache.put(key, sources)
+        return sources
+
+    def get_kernel_sources(self, hypo_params):
+        """Evaluate each hypo kernel given particular parameters and return
+        the sources produced by each kernel separately.
+
+        Parameters
+        ----------
+        hypo_params : HYPO_PARAMS_T
+
+        Returns
+        -------
+        kernel_sources : list of shape (N_i,) numpy.ndarrays of dtype SRC_DTYPE
+            One array per kernel, in the order of `hypo_kernels`
+
+        """
+        if self.kernel_sources_caches is None:
+            return [
+                kernel(hypo_params, **kwargs)
+                for kernel, kwargs in zip(self.hypo_kernels, self.kernel_kwargs)
+            ]
+
+        kernel_sources = []
+        for kernel, kwargs, param_names, cache in zip(
+                self.hypo_kernels, self.kernel_kwargs, self.kernel_params,
+                self.kernel_sources_caches
+            ):
+            key = self.get_cache_key(hypo_params, param_names)
+            sources = cache.get(key)
+            if sources is None:
+                sources = kernel(hypo_params, **kwargs)
+                cache.put(key, sources)
+            kernel_sources.append(sources)
+        return kernel_sources
+
+    def get_sources_batch(self, hypos):
+        """Evaluate the discrete hypothesis for each of a batch of parameter
+        sets and return all sources in one array.
+
+        Parameters
+        ----------
+        hypos : iterable of HYPO_PARAMS_T
+
+        Returns
+        -------
+        sources : shape (N,) numpy.ndarray of dtype `SRC_DTYPE`
+            Sources of all hypotheses, concatenated in order
+
+        hypo_sources_start : shape (num_hypos + 1,) numpy.ndarray of int64
+            Sources of hypothesis `i` are
+            ``sources[hypo_sources_start[i]:hypo_sources_start[i+1]]``
+
+        """
+        sources = [self.get_sources(hypo_params) for hypo_params in hypos]
+        hypo_sources_start = np.zeros(len(sources) + 1, dtype=np.int64)
+        hypo_sources_start[1:] = np.cumsum([len(s) for s in sources])
+        if sources:
+            sources = np.concatenate(sources, axis=0)
+        else:
+            sources = np.empty(shape=0, dtype=SRC_DTYPE)
+        return sources, hypo_sources_start
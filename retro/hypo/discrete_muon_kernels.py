@@ -10,6 +10,7 @@ from __future__ import absolute_import, division, print_function
 
 __all__ = '''
     ALL_REALS
+    MUON_KERNEL_HYPO_PARAMS
     const_energy_loss_muon
     table_energy_loss_muon
 '''.split()
@@ -51,6 +52,11 @@ from retro.hypo.discrete_hypo import SRC_DTYPE, SRC_CKV_BETA1
 
 ALL_REALS = (-np.inf, np.inf)
 
+MUON_KERNEL_HYPO_PARAMS = (
+    't', 'x', 'y', 'z', 'track_zenith', 'track_azimuth', 'track_energy'
+)
+"""Hypothesis parameters the muon kernels depend on"""
+
 
 # Create spline (for table_energy_loss_muon)
 with open(join(RETRO_DIR, 'data', 'dedx_total_e.csv'), 'rb') as csvfile:
@@ -8,7 +8,27 @@ have generated.
 
 from __future__ import absolute_import, division, print_function
 
-__all__ = ['get_neg_llh']
+__all__ = [
+    'prepare_hits',
+    'coarsen_hits',
+    'get_event_context',
+    'get_hit_doms',
+    'get_neg_llh',
+    'get_neg_llh_fused',
+    'get_neg_llh_batch',
+    'get_neg_llh_bounded',
+    'get_energy_basis',
+    'get_neg_llh_from_energy_basis',
+    'profile_cascade_energy',
+    'GRADIENT_BINS_PER_STEP',
+    'GRADIENT_TRACK_ENERGY_STEP',
+    'get_gradient_step_sizes',
+    'get_neg_llh_gradient',
+    'INCREMENTAL_REFRESH_INTERVAL',
+    'INCREMENTAL_MAX_CHANGED_FRACTION',
+    'IncrementalNegLLH',
+    'LLHStats'
+]
 
 __author__ = 'P. Eller, J.L. Lanfranchi'
 __license__ = '''Copyright 2017 Philipp Eller and Justin L. Lanfranchi
@@ -25,9 +45,11 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.'''
 
+from collections import OrderedDict
 from itertools import product
 from os.path import abspath, dirname
 import sys
+import time
 
 import numpy as np
 
@@ -35,6 +57,10 @@ if __name__ == '__main__' and __package__ is None:
     RETRO_DIR = dirname(dirname(abspath(__file__)))
     if RETRO_DIR not in sys.path:
         sys.path.append(RETRO_DIR)
+from retro import HYPO_PARAMS_T
+from retro.hypo.discrete_hypo import SRC_DTYPE
+from retro.retro_types import EnergyBasis, EventContext, EventHits
+from retro.tables.pexp_5d import PEXP_COUNTERS
 
 
 DC_STRS = [79, 80, 81, 82, 83, 84, 85, 86]
@@ -58,9 +84,434 @@ ALL_STRS_DOMS = list(product(ALL_STRS, ALL_DOMS))
 #)
 EMPTY_HITS = np.empty(shape=(2, 0), dtype=np.float32)
 
+DC_STRING_IDX_MIN = min(DC_STRS) - 1
+"""Zero-based string indices at or above this are DeepCore strings"""
+
+INCREMENTAL_REFRESH_INTERVAL = 20
+"""Number of incremental updates of a hypo kernel's contribution in
+`IncrementalNegLLH` after which it is recomputed in full, bounding the
+rounding error accumulated by repeatedly subtracting and adding
+contributions"""
+
+INCREMENTAL_MAX_CHANGED_FRACTION = 0.5
+"""`IncrementalNegLLH` recomputes a hypo kernel's contribution in full
+rather than incrementally if more than this fraction of its sources
+changed"""
+
+GRADIENT_BINS_PER_STEP = 2
+"""Number of table bins spanned by each default finite-difference step in
+`get_neg_llh_gradient` (see `get_gradient_step_sizes`)"""
+
+GRADIENT_TRACK_ENERGY_STEP = 1.0
+"""Default finite-difference step in track energy (GeV), which is not binned
+in the tables"""
+
+
+class LLHStats(object):
+    """Work counters and timing accumulated over likelihood evaluations,
+    kept separately for IceCube (``'ic'``) and DeepCore (``'dc'``) DOMs.
+
+    Pass an instance as `stats` to `get_neg_llh` or `get_neg_llh_fused`;
+    each call adds to the totals. Counters are those in
+    `tables.pexp_5d.PEXP_COUNTERS`; times are wall-clock seconds spent
+    computing expectations for each DOM class.
+
+    """
+    DOM_CLASSES = ('ic', 'dc')
+
+    def __init__(self):
+        self.num_llh = 0
+        self.num_sources = 0
+        self.counters = None
+        self.time = None
+        self.reset()
+
+    def reset(self):
+        """Zero all counters and timers"""
+        self.num_llh = 0
+        self.num_sources = 0
+        self.counters = OrderedDict(
+            (dom_class, np.zeros(shape=len(PEXP_COUNTERS), dtype=np.int64))
+            for dom_class in self.DOM_CLASSES
+        )
+        self.time = OrderedDict(
+            (dom_class, 0.0) for dom_class in self.DOM_CLASSES
+        )
+
+    def as_dict(self):
+        """Flatten the statistics into an OrderedDict, e.g. for logging.
+
+        Returns
+        -------
+        stats : OrderedDict
+            Keys are 'num_llh', 'num_sources', and '<dom_class>_<counter>' and
+            '<dom_class>_time' for each DOM class
+
+        """
+        stats = OrderedDict()
+        stats['num_llh'] = self.num_llh
+        stats['num_sources'] = self.num_sources
+        for dom_class in self.DOM_CLASSES:
+            for name, count in zip(PEXP_COUNTERS, self.counters[dom_class]):
+                stats['{}_{}'.format(dom_class, name)] = int(count)
+            stats['{}_time'.format(dom_class)] = self.time[dom_class]
+        return stats
+
+    def __str__(self):
+        return '\n'.join(
+            '{:<32s} {}'.format(key, val) for key, val in self.as_dict().items()
+        )
+
+
+def get_dom_class_hits(hits):
+    """Split an event's hits into those at IceCube and at DeepCore DOMs.
+
+    Parameters
+    ----------
+    hits : retro_types.EventHits
+
+    Returns
+    -------
+    dom_class_hits : OrderedDict
+        Keys are `LLHStats.DOM_CLASSES` and values are EventHits containing
+        just the DOMs of that class (in their original order)
+
+    """
+    is_dc = hits.str_dom_idxs[:, 0] >= DC_STRING_IDX_MIN
+    dom_num_hits = np.diff(hits.dom_hits_start)
+    hit_is_dc = np.repeat(is_dc, dom_num_hits)
+
+    dom_class_hits = OrderedDict()
+    for dom_class, dom_mask, hit_mask in [('ic', ~is_dc, ~hit_is_dc),
+                                          ('dc', is_dc, hit_is_dc)]:
+        dom_hits_start = np.zeros(
+            shape=np.count_nonzero(dom_mask) + 1, dtype=hits.dom_hits_start.dtype
+        )
+        dom_hits_start[1:] = np.cumsum(dom_num_hits[dom_mask])
+        dom_class_hits[dom_class] = EventHits(
+            str_dom_idxs=hits.str_dom_idxs[dom_mask],
+            dom_hits_start=dom_hits_start,
+            times=hits.times[hit_mask],
+            charges=hits.charges[hit_mask]
+        )
+    return dom_class_hits
+
+
+def prepare_hits(hits, strs_doms=None):
+    """Convert an event's hits into the flat layout consumed by the likelihood
+    functions. Do this once per event, not once per hypothesis.
+
+    Parameters
+    ----------
+    hits : mapping, retro_types.Event, or retro_types.Pulses
+        If a mapping, keys are (string, dom) tuples and values are arrays of
+        shape (2, n_dom_hits_i), where ``val[0, :]`` are hit times and
+        ``val[1, :]`` are charges. If an `Event` (e.g. an entry from
+        `events.Events`), its `pulses` are used.
+
+    strs_doms : sequence of (string, dom) tuples, optional
+        DOMs to be included in the likelihood (whether or not they were hit),
+        in the order they are to be evaluated. Hits in any other DOMs are
+        ignored. Defaults to `DC_ALL_SUBDUST_STRS_DOMS`.
+
+    Returns
+    -------
+    event_hits : retro_types.EventHits
+
+    """
+    if strs_doms is None:
+        strs_doms = DC_ALL_SUBDUST_STRS_DOMS
+
+    if hasattr(hits, 'pulses'):
+        hits = hits.pulses
+
+    if isinstance(hits, EventHits):
+        return hits
+
+    if hasattr(hits, 'oms'):
+        pulses = hits
+        # `strings` are 1-indexed while `oms` are 0-indexed
+        pulse_keys = (
+            (np.asarray(pulses.strings, dtype=np.int64) - 1) * 60
+            + np.asarray(pulses.oms, dtype=np.int64)
+        )
+        order = np.argsort(pulse_keys, kind='mergesort')
+        sorted_keys = pulse_keys[order]
+        times = np.asarray(pulses.times)[order]
+        charges = np.asarray(pulses.charges)[order]
+        hits = {}
+        for string, dom in strs_doms:
+            key = (string - 1) * 60 + (dom - 1)
+            start, stop = np.searchsorted(sorted_keys, [key, key + 1])
+            if stop > start:
+                hits[(string, dom)] = np.array(
+                    [times[start:stop], charges[start:stop]], dtype=np.float32
+                )
+
+    # Likelihood kernels require each DOM's hits to be sorted in time
+    dom_hits = []
+    for str_dom in strs_doms:
+        dom_hits_ = hits.get(str_dom, EMPTY_HITS)
+        dom_hits.append(
+            dom_hits_[:, np.argsort(dom_hits_[0, :], kind='mergesort')]
+        )
+
+    dom_hits_start = np.zeros(shape=len(dom_hits) + 1, dtype=np.int64)
+    dom_hits_start[1:] = np.cumsum([h.shape[1] for h in dom_hits])
+    all_hits = np.concatenate(dom_hits, axis=1)
+
+    event_hits = EventHits(
+        str_dom_idxs=np.array(strs_doms, dtype=np.int32).reshape(-1, 2) - 1,
+        dom_hits_start=dom_hits_start,
+        times=np.ascontiguousarray(all_hits[0, :], dtype=np.float32),
+        charges=np.ascontiguousarray(all_hits[1, :], dtype=np.float32)
+    )
+
+    return event_hits
+
+
+def coarsen_hits(hits, binning_info):
+    """Merge each DOM's hits that fall within the same table time bin into a
+    single hit, so that the cost of computing expectations scales with the
+    number of occupied time bins rather than the number of pulses.
+
+    Time bins have the width of the tables' time bins and start at each DOM's
+    first hit. Merged hits have the summed charge and the charge-weighted
+    mean time of their constituents.
+
+    Parameters
+    ----------
+    hits : retro_types.EventHits or anything accepted by `prepare_hits`
+
+    binning_info : mapping
+        Must contain keys 't_min', 't_max', and 'n_t_bins', e.g.
+        ``Retro5DTables.pexp_meta['binning_info']``
+
+    Returns
+    -------
+    coarse_hits : retro_types.EventHits
+
+    num_merged : int
+        Number of hits removed by merging
+
+    """
+    if not isinstance(hits, EventHits):
+        hits = prepare_hits(hits)
+
+    t_bin_width = (
+        (binning_info['t_max'] - binning_info['t_min'])
+        / binning_info['n_t_bins']
+    )
+
+    num_hits = len(hits.times)
+    if num_hits == 0:
+        return hits, 0
+
+    num_doms = len(hits.str_dom_idxs)
+    dom_num_hits = np.diff(hits.dom_hits_start)
+    hit_dom = np.repeat(np.arange(num_doms), dom_num_hits)
+    times = hits.times.astype(np.float64)
+    charges = hits.charges.astype(np.float64)
+
+    # Hits are sorted in time within each DOM, so each DOM's first hit is its
+    # earliest
+    dom_first_time = times[np.minimum(hits.dom_hits_start[:-1], num_hits - 1)]
+    time_bin = np.floor(
+        (times - np.repeat(dom_first_time, dom_num_hits)) / t_bin_width
+    ).astype(np.int64)
+
+    starts_merged_hit = np.ones(shape=num_hits, dtype=bool)
+    starts_merged_hit[1:] = (
+        (hit_dom[1:] != hit_dom[:-1]) | (time_bin[1:] != time_bin[:-1])
+    )
+    merged_hit_idx = np.cumsum(starts_merged_hit) - 1
+    num_merged_hits = merged_hit_idx[-1] + 1
+
+    merged_charges = np.bincount(merged_hit_idx, weights=charges)
+    sum_weighted_times = np.bincount(merged_hit_idx, weights=charges*times)
+    # Fall back to the plain mean time where charges sum to zero
+    num_constituents = np.bincount(merged_hit_idx)
+    sum_times = np.bincount(merged_hit_idx, weights=times)
+    has_charge = merged_charges > 0
+    merged_times = np.where(
+        has_charge,
+        sum_weighted_times / np.where(has_charge, merged_charges, 1),
+        sum_times / num_constituents
+    )
+
+    dom_hits_start = np.zeros(shape=num_doms + 1, dtype=np.int64)
+    dom_hits_start[1:] = np.cumsum(
+        np.bincount(hit_dom[starts_merged_hit], minlength=num_doms)
+    )
+
+    coarse_hits = EventHits(
+        str_dom_idxs=hits.str_dom_idxs,
+        dom_hits_start=dom_hits_start,
+        times=merged_times.astype(np.float32),
+        charges=merged_charges.astype(np.float32)
+    )
+
+    return coarse_hits, num_hits - num_merged_hits
+
+
+def get_event_context(hits, time_window, dom_tables):
+    """Compute the constants the likelihood needs for an event that do not
+    depend on the hypothesis. Do this once per event, not once per
+    hypothesis.
+
+    Parameters
+    ----------
+    hits
+        Anything accepted by `prepare_hits`
+
+    time_window : float
+        Time window pertinent to the event's reconstruction, in ns
+
+    dom_tables : tables.retro_5d_tables.Retro5DTables
+        Tables (all loaded) that will be used with the event context
+
+    Returns
+    -------
+    event_ctx : retro_types.EventContext
+        Can be passed in place of `hits` to the likelihood functions
+
+    """
+    hits = prepare_hits(hits)
+    string_idxs = hits.str_dom_idxs[:, 0]
+    dom_idxs = hits.str_dom_idxs[:, 1]
+
+    dom_operational = np.asarray(
+        dom_tables.operational_doms[string_idxs, dom_idxs], dtype=bool
+    )
+    dom_coords = np.ascontiguousarray(
+        dom_tables.geom[string_idxs, dom_idxs], dtype=np.float64
+    )
+    dom_quantum_efficiency = np.ma.filled(
+        dom_tables.quantum_efficiency[string_idxs, dom_idxs], 0
+    ).astype(np.float64)
+    dom_noise_rate_per_ns = np.ma.filled(
+        dom_tables.noise_rate_per_ns[string_idxs, dom_idxs], 0
+    ).astype(np.float64)
+    dom_noise_exp = dom_noise_rate_per_ns * time_window
+
+    dom_table_tups = []
+    for string_idx, dom_idx, operational in zip(
+            string_idxs.tolist(), dom_idxs.tolist(), dom_operational.tolist()
+        ):
+        if operational:
+            dom_table_tups.append(
+                dom_tables.tables[
+                    dom_tables.get_table_key(
+                        string=string_idx + 1, dom=dom_idx + 1
+                    )
+                ]
+            )
+        else:
+            dom_table_tups.append(None)
+
+    return EventContext(
+        hits=hits,
+        time_window=time_window,
+        dom_operational=dom_operational,
+        dom_coords=dom_coords,
+        dom_quantum_efficiency=dom_quantum_efficiency,
+        dom_noise_rate_per_ns=dom_noise_rate_per_ns,
+        dom_noise_exp=dom_noise_exp,
+        dom_table_tups=dom_table_tups
+    )
+
+
+def get_hit_doms(hits):
+    """Restrict an event to the DOMs that recorded at least one hit.
+
+    With a time- and DOM-independent (TDI) table providing the total charge
+    expected in the detector, unhit DOMs contribute nothing else to the
+    likelihood, so only the hit DOMs need per-DOM table lookups.
+
+    Parameters
+    ----------
+    hits : retro_types.EventHits or retro_types.EventContext
+
+    Returns
+    -------
+    hit_dom_hits : retro_types.EventHits or retro_types.EventContext
+        Same type as `hits`, with just the hit DOMs (in their original order)
+
+    """
+    if isinstance(hits, EventContext):
+        dom_mask = np.diff(hits.hits.dom_hits_start) > 0
+        return hits._replace(
+            hits=get_hit_doms(hits.hits),
+            dom_operational=hits.dom_operational[dom_mask],
+            dom_coords=hits.dom_coords[dom_mask],
+            dom_quantum_efficiency=hits.dom_quantum_efficiency[dom_mask],
+            dom_noise_rate_per_ns=hits.dom_noise_rate_per_ns[dom_mask],
+            dom_noise_exp=hits.dom_noise_exp[dom_mask],
+            dom_table_tups=[
+                tup for tup, hit in zip(hits.dom_table_tups, dom_mask) if hit
+            ]
+        )
+
+    dom_num_hits = np.diff(hits.dom_hits_start)
+    dom_mask = dom_num_hits > 0
+    dom_hits_start = np.zeros(
+        shape=np.count_nonzero(dom_mask) + 1, dtype=hits.dom_hits_start.dtype
+    )
+    dom_hits_start[1:] = np.cumsum(dom_num_hits[dom_mask])
+    return hits._replace(
+        str_dom_idxs=hits.str_dom_idxs[dom_mask],
+        dom_hits_start=dom_hits_start
+    )
+
+
+def _unpack_hits(hits, time_window):
+    """Get `EventHits` (and the `EventContext`, if one was passed) from the
+    `hits` argument of the likelihood functions"""
+    if isinstance(hits, EventContext):
+        if time_window != hits.time_window:
+            raise ValueError(
+                '`time_window` {} differs from that of the event context, {}'
+                .format(time_window, hits.time_window)
+            )
+        return hits.hits, hits
+    if not isinstance(hits, EventHits):
+        hits = prepare_hits(hits)
+    return hits, None
+
+
+def _warn_if_no_t_indep_exp(dom_tables):
+    """Warn that the expectation at all times will be missing from the
+    likelihood if neither `dom_tables` nor a TDI table provide it"""
+    if not dom_tables.compute_t_indep_exp:
+        print('*'*79)
+        print('WARNING! Time-independent expectation will not be computed')
+        print('*'*79)
+
+
+def _unpack_tdi_hits(hits, time_window, dom_tables):
+    """Like `_unpack_hits`, but for use with a TDI table: restrict the event
+    to its hit DOMs (see `get_hit_doms`) and also return the noise expected
+    over `time_window` in all of the event's operational DOMs, which the TDI
+    table does not account for"""
+    hits, event_ctx = _unpack_hits(hits, time_window)
+    if event_ctx is None:
+        string_idxs = hits.str_dom_idxs[:, 0]
+        dom_idxs = hits.str_dom_idxs[:, 1]
+        noise_rate_per_ns = np.ma.filled(
+            dom_tables.noise_rate_per_ns[string_idxs, dom_idxs], 0
+        )
+        operational = dom_tables.operational_doms[string_idxs, dom_idxs]
+        noise_exp = np.sum(noise_rate_per_ns * operational) * time_window
+        return get_hit_doms(hits), None, np.float64(noise_exp)
+
+    noise_exp = np.sum(event_ctx.dom_noise_exp * event_ctx.dom_operational)
+    event_ctx = get_hit_doms(event_ctx)
+    return event_ctx.hits, event_ctx, np.float64(noise_exp)
+
 
 def get_neg_llh(
-        hypo, hits, time_window, hypo_handler, dom_tables, tdi_table=None
+        hypo, hits, time_window, hypo_handler, dom_tables, tdi_table=None,
+        stats=None
     ):
     """Get the negative of the log likelihood of `event` having come from
     hypothesis `hypo` (whose light detection expectation is computed by
@@ -71,10 +522,12 @@ def get_neg_llh(
     hypo : HYPO_PARAMS_T
         Hypothesized event parameters
 
-    hits : mapping
-        Keys are (string, dom) tuples, values are `retro_types.Hits`
-        namedtuples, where ``val.times`` and ``val.charges`` are arrays of
-        shape (n_dom_hits_i,).
+    hits : retro_types.EventHits or retro_types.EventContext
+        Hits as returned by `prepare_hits`; the DOMs in ``hits.str_dom_idxs``
+        are the DOMs included in the likelihood. Anything else accepted by
+        `prepare_hits` is converted on each call (which is slow). Pass the
+        event context returned by `get_event_context` to also avoid looking up
+        per-DOM constants on each call.
 
     time_window : float
         Time window pertinent to the event's reconstruction. Used for
@@ -90,57 +543,779 @@ def get_neg_llh(
 
     tdi_table : tables.tdi_table.TDITable, optional
         If provided, this is used to compute total expected hits, independent
-        of time _and_ DOM. Instantiate the `dom_tables` object with
-        `compute_t_indep_exp=False` to avoid unnecessary computations. If
+        of time _and_ DOM. Only DOMs with hits are then evaluated using
+        `dom_tables` (see `get_hit_doms`), and noise expected in all of the
+        event's DOMs is added to the total. Instantiate the `dom_tables`
+        object with `compute_t_indep_exp=False` to avoid unnecessary
+        computations. If
         `tdi_table` is not provided, then the time-independent
         expecations must be computed for each DOM in the detector individually
         using the `dom_tables` object; be sure to instantiate this with
         `compute_t_indep_exp=True`.
 
+    stats : LLHStats, optional
+        If provided, work counters and per-DOM-class timing of this call are
+        added to `stats`
+
     Returns
     -------
     neg_llh : float
         Negative of the log likelihood
 
     """
+    if tdi_table is None:
+        hits, event_ctx = _unpack_hits(hits, time_window)
+    else:
+        hits, event_ctx, noise_exp = _unpack_tdi_hits(
+            hits, time_window, dom_tables
+        )
+
     hypo_light_sources = hypo_handler.get_sources(hypo)
 
+    if stats is not None:
+        stats.num_llh += 1
+        stats.num_sources += len(hypo_light_sources)
+
     sum_at_all_times_computed = False
     if tdi_table is None:
-        if not dom_tables.compute_t_indep_exp:
-            print('*'*79)
-            print('WARNING! Time-independent expectation will not be computed')
-            print('*'*79)
+        _warn_if_no_t_indep_exp(dom_tables)
         sum_at_all_times = 0.0
     else:
-        sum_at_all_times = tdi_table.get_expected_det(
+        sum_at_all_times = noise_exp + tdi_table.get_expected_det(
             sources=hypo_light_sources
         )
         sum_at_all_times_computed = True
 
     sum_log_at_hit_times = np.float64(0.0)
-    for str_dom in DC_ALL_SUBDUST_STRS_DOMS:
-        string = str_dom[0]
-        dom = str_dom[1]
+    for i, (string_idx, dom_idx) in enumerate(hits.str_dom_idxs.tolist()):
+        start = hits.dom_hits_start[i]
+        stop = hits.dom_hits_start[i + 1]
 
-        this_hits = hits.get((string, dom), EMPTY_HITS)
+        if stats is not None:
+            dom_class = 'dc' if string_idx >= DC_STRING_IDX_MIN else 'ic'
+            t0 = time.time()
 
-        exp_p_at_all_times, exp_p_at_hit_times = dom_tables.get_expected_det(
-            sources=hypo_light_sources,
-            hit_times=this_hits[0, :].astype(np.float32),
-            string=string,
-            dom=dom,
-            include_noise=True,
-            time_window=time_window
-        )
+        counters = None if stats is None else stats.counters[dom_class]
+        if event_ctx is None:
+            exp_p_at_all_times, exp_p_at_hit_times = (
+                dom_tables.get_expected_det(
+                    sources=hypo_light_sources,
+                    hit_times=hits.times[start:stop],
+                    string=string_idx + 1,
+                    dom=dom_idx + 1,
+                    include_noise=True,
+                    time_window=time_window,
+                    counters=counters
+                )
+            )
+        elif event_ctx.dom_operational[i]:
+            exp_p_at_all_times, exp_p_at_hit_times = (
+                dom_tables.get_expected_det_dom(
+                    sources=hypo_light_sources,
+                    hit_times=hits.times[start:stop],
+                    dom_coord=event_ctx.dom_coords[i],
+                    dom_quantum_efficiency=event_ctx.dom_quantum_efficiency[i],
+                    table_tup=event_ctx.dom_table_tups[i],
+                    counters=counters
+                )
+            )
+            exp_p_at_hit_times += event_ctx.dom_noise_rate_per_ns[i]
+            exp_p_at_all_times += event_ctx.dom_noise_exp[i]
+        else:
+            exp_p_at_all_times = np.float64(0.0)
+            exp_p_at_hit_times = np.zeros(stop - start, dtype=np.float64)
+
+        if stats is not None:
+            stats.time[dom_class] += time.time() - t0
 
         if not sum_at_all_times_computed:
             sum_at_all_times += exp_p_at_all_times
 
         sum_log_at_hit_times += np.sum(
-            this_hits[1, :] * np.log(exp_p_at_hit_times)
+            hits.charges[start:stop] * np.log(exp_p_at_hit_times)
+        )
+
+    neg_llh = sum_at_all_times - sum_log_at_hit_times
+
+    return neg_llh
+
+
+def get_neg_llh_fused(
+        hypo, hits, time_window, hypo_handler, dom_tables, tdi_table=None,
+        num_threads=1, stats=None
+    ):
+    """Get the negative of the log likelihood of `event` having come from
+    hypothesis `hypo`, computing the expectations at all DOMs in a single call
+    to compiled code.
+
+    Arguments and return value are the same as for `get_neg_llh`, except
+    `dom_tables` must be a `Retro5DTables` object on which `stack_tables` has
+    been called, and
+
+    num_threads : int >= 1
+        Number of threads across which the DOMs' expectations are computed.
+        The result does not depend on `num_threads`.
+
+    stats : LLHStats, optional
+        If provided, work counters and per-DOM-class timing are added to
+        `stats`. IceCube and DeepCore DOMs are then computed in separate calls
+        (in order to time them separately), which changes the order of
+        summation and hence the result at the level of floating-point
+        round-off.
+
+    """
+    if tdi_table is None:
+        hits, _ = _unpack_hits(hits, time_window)
+    else:
+        hits, _, noise_exp = _unpack_tdi_hits(hits, time_window, dom_tables)
+
+    hypo_light_sources = hypo_handler.get_sources(hypo)
+
+    if stats is None:
+        exp_p_at_all_times, exp_p_at_hit_times = (
+            dom_tables.get_expected_det_all_doms(
+                sources=hypo_light_sources,
+                hits=hits,
+                time_window=time_window,
+                num_threads=num_threads
+            )
+        )
+    else:
+        stats.num_llh += 1
+        stats.num_sources += len(hypo_light_sources)
+        all_times_parts = []
+        hit_times_parts = []
+        charges_parts = []
+        for dom_class, class_hits in get_dom_class_hits(hits).items():
+            t0 = time.time()
+            class_exp_p = dom_tables.get_expected_det_all_doms(
+                sources=hypo_light_sources,
+                hits=class_hits,
+                time_window=time_window,
+                num_threads=num_threads,
+                counters=stats.counters[dom_class]
+            )
+            stats.time[dom_class] += time.time() - t0
+            all_times_parts.append(class_exp_p[0])
+            hit_times_parts.append(class_exp_p[1])
+            charges_parts.append(class_hits.charges)
+        exp_p_at_all_times = np.concatenate(all_times_parts)
+        exp_p_at_hit_times = np.concatenate(hit_times_parts)
+        hits = hits._replace(charges=np.concatenate(charges_parts))
+
+    if tdi_table is None:
+        _warn_if_no_t_indep_exp(dom_tables)
+        sum_at_all_times = np.sum(exp_p_at_all_times)
+    else:
+        sum_at_all_times = noise_exp + tdi_table.get_expected_det(
+            sources=hypo_light_sources
         )
 
+    sum_log_at_hit_times = np.sum(hits.charges * np.log(exp_p_at_hit_times))
+
     neg_llh = sum_at_all_times - sum_log_at_hit_times
 
     return neg_llh
+
+
+def get_neg_llh_batch(
+        hypos, hits, time_window, hypo_handler, dom_tables, tdi_table=None,
+        num_threads=1
+    ):
+    """Get the negative of the log likelihood of `event` having come from
+    each of a batch of hypotheses, computing the expectations for all
+    hypotheses and DOMs in a single call to compiled code.
+
+    Arguments are the same as for `get_neg_llh_fused`, except
+
+    hypos : iterable of HYPO_PARAMS_T or shape (num_hypos, len(HYPO_PARAMS_T)) array
+        Rows are interpreted as ``HYPO_PARAMS_T(*row)``
+
+    num_threads : int >= 1
+        Number of threads across which the hypotheses are computed. The result
+        does not depend on `num_threads`.
+
+    Returns
+    -------
+    neg_llh : shape (num_hypos,) array of float64
+        Negative of the log likelihood of each hypothesis
+
+    """
+    if tdi_table is None:
+        hits, _ = _unpack_hits(hits, time_window)
+    else:
+        hits, _, noise_exp = _unpack_tdi_hits(hits, time_window, dom_tables)
+
+    hypos = [
+        h if isinstance(h, HYPO_PARAMS_T) else HYPO_PARAMS_T(*h) for h in hypos
+    ]
+
+    sources, hypo_sources_start = hypo_handler.get_sources_batch(hypos)
+
+    sum_at_all_times, sum_log_at_hit_times = dom_tables.get_expected_det_batch(
+        sources=sources,
+        hypo_sources_start=hypo_sources_start,
+        hits=hits,
+        time_window=time_window,
+        num_threads=num_threads
+    )
+
+    if tdi_table is None:
+        _warn_if_no_t_indep_exp(dom_tables)
+    else:
+        sum_at_all_times = noise_exp + np.array(
+            [
+                tdi_table.get_expected_det(
+                    sources=sources[hypo_sources_start[i]:
+                                    hypo_sources_start[i + 1]]
+                )
+                for i in range(len(hypos))
+            ],
+            dtype=np.float64
+        )
+
+    neg_llh = sum_at_all_times - sum_log_at_hit_times
+
+    return neg_llh
+
+
+def get_neg_llh_bounded(
+        hypo, hits, time_window, hypo_handler, dom_tables, threshold,
+        tdi_table=None
+    ):
+    """Get the negative of the log likelihood of `event` having come from
+    hypothesis `hypo`, unless it is guaranteed to exceed `threshold`, in which
+    case computation stops early.
+
+    Hit DOMs are computed first, nearest to the photon-weighted center of the
+    sources first, followed by the remaining DOMs (likewise ordered). After
+    each DOM, a lower bound on the final value is formed from the DOMs
+    computed so far plus the smallest contribution possible from each
+    remaining DOM.
+
+    Arguments are the same as for `get_neg_llh_fused`, plus
+
+    threshold : float
+        E.g. the worst value a minimizer would still accept
+
+    Returns
+    -------
+    neg_llh : float64
+        Negative of the log likelihood if `complete`, otherwise a lower bound
+        on it which exceeds `threshold`
+
+    complete : bool
+
+    num_doms_computed : int
+        Number of the event's DOMs whose expectations were computed before
+        stopping
+
+    """
+    if tdi_table is None:
+        hits, _ = _unpack_hits(hits, time_window)
+    else:
+        hits, _, noise_exp = _unpack_tdi_hits(hits, time_window, dom_tables)
+
+    hypo_light_sources = hypo_handler.get_sources(hypo)
+
+    if tdi_table is None:
+        _warn_if_no_t_indep_exp(dom_tables)
+        neg_llh_offset = 0.0
+    else:
+        neg_llh_offset = noise_exp + tdi_table.get_expected_det(
+            sources=hypo_light_sources
+        )
+
+    photons = hypo_light_sources['photons'].astype(np.float64)
+    if np.sum(photons) > 0:
+        center = [
+            np.average(hypo_light_sources[dim], weights=photons)
+            for dim in ('x', 'y', 'z')
+        ]
+    else:
+        center = [hypo.x, hypo.y, hypo.z]
+    dom_coords = dom_tables.geom[
+        hits.str_dom_idxs[:, 0], hits.str_dom_idxs[:, 1]
+    ]
+    distances = np.sqrt(np.sum(np.square(dom_coords - center), axis=1))
+    is_unhit = np.diff(hits.dom_hits_start) == 0
+    dom_order = np.lexsort((distances, is_unhit))
+
+    return dom_tables.get_neg_llh_bounded(
+        sources=hypo_light_sources,
+        hits=hits,
+        time_window=time_window,
+        dom_order=dom_order,
+        threshold=threshold,
+        neg_llh_offset=neg_llh_offset,
+        count_exp_p_at_all_times=tdi_table is None
+    )
+
+
+def get_energy_basis(
+        hypo, hits, time_window, hypo_handler, dom_tables, tdi_table=None,
+        num_threads=1
+    ):
+    """Compute photon expectations for hypothesis `hypo` split into a part
+    independent of cascade energy and a part per GeV of cascade energy, from
+    which the likelihood for any cascade energy can be computed without
+    further table lookups (see `get_neg_llh_from_energy_basis` and
+    `profile_cascade_energy`).
+
+    This relies on cascade hypo kernels (e.g. `point_cascade`) producing light
+    linear in ``hypo.cascade_energy`` and on all other kernels producing no
+    light when ``hypo.track_energy`` is 0. ``hypo.cascade_energy`` is ignored.
+
+    Arguments are the same as for `get_neg_llh_fused`.
+
+    Returns
+    -------
+    energy_basis : retro_types.EnergyBasis
+
+    """
+    if tdi_table is None:
+        hits, _ = _unpack_hits(hits, time_window)
+    else:
+        hits, _, noise_exp = _unpack_tdi_hits(hits, time_window, dom_tables)
+
+    fixed_sources = hypo_handler.get_sources(hypo._replace(cascade_energy=0.))
+    per_gev_sources = hypo_handler.get_sources(
+        hypo._replace(track_energy=0., cascade_energy=1.)
+    )
+
+    fixed_at_all_times, fixed_at_hit_times = (
+        dom_tables.get_expected_det_all_doms(
+            sources=fixed_sources,
+            hits=hits,
+            time_window=time_window,
+            num_threads=num_threads
+        )
+    )
+    per_gev_at_all_times, per_gev_at_hit_times = (
+        dom_tables.get_expected_det_all_doms(
+            sources=per_gev_sources,
+            hits=hits,
+            time_window=time_window,
+            num_threads=num_threads,
+            include_noise=False
+        )
+    )
+
+    if tdi_table is None:
+        _warn_if_no_t_indep_exp(dom_tables)
+        sum_fixed = np.sum(fixed_at_all_times)
+        sum_per_gev = np.sum(per_gev_at_all_times)
+    else:
+        sum_fixed = noise_exp + tdi_table.get_expected_det(
+            sources=fixed_sources
+        )
+        sum_per_gev = tdi_table.get_expected_det(sources=per_gev_sources)
+
+    return EnergyBasis(
+        sum_exp_p_fixed=np.float64(sum_fixed),
+        sum_exp_p_per_cascade_gev=np.float64(sum_per_gev),
+        exp_p_fixed_at_hit_times=fixed_at_hit_times,
+        exp_p_per_cascade_gev_at_hit_times=per_gev_at_hit_times,
+        charges=hits.charges.astype(np.float64)
+    )
+
+
+def get_neg_llh_from_energy_basis(energy_basis, cascade_energies):
+    """Get the negative of the log likelihood for each of a set of cascade
+    energies, with all other hypothesis parameters as used to compute
+    `energy_basis`.
+
+    Parameters
+    ----------
+    energy_basis : retro_types.EnergyBasis
+        As returned by `get_energy_basis`
+
+    cascade_energies : scalar or array of float, units of GeV
+
+    Returns
+    -------
+    neg_llh : float64 or array of float64 (same shape as `cascade_energies`)
+
+    """
+    cascade_energies = np.asarray(cascade_energies, dtype=np.float64)
+    energies = cascade_energies.reshape(-1, 1)
+
+    sum_at_all_times = (
+        energy_basis.sum_exp_p_fixed
+        + energies[:, 0] * energy_basis.sum_exp_p_per_cascade_gev
+    )
+    sum_log_at_hit_times = np.sum(
+        energy_basis.charges * np.log(
+            energy_basis.exp_p_fixed_at_hit_times
+            + energies * energy_basis.exp_p_per_cascade_gev_at_hit_times
+        ),
+        axis=1
+    )
+
+    neg_llh = sum_at_all_times - sum_log_at_hit_times
+
+    return neg_llh.reshape(cascade_energies.shape)[()]
+
+
+def profile_cascade_energy(energy_basis, rtol=1e-10, max_iter=100):
+    """Find the cascade energy minimizing the negative log likelihood, with
+    all other hypothesis parameters as used to compute `energy_basis`.
+
+    The negative log likelihood is convex in cascade energy `E`, so its
+    derivative
+        ``sum_per_gev - sum(charges * per_gev / (fixed + E * per_gev))``
+    is increasing and concave; Newton's method started from ``E = 0`` hence
+    approaches its root monotonically from below.
+
+    Parameters
+    ----------
+    energy_basis : retro_types.EnergyBasis
+        As returned by `get_energy_basis`
+
+    rtol : float
+        Stop once the Newton step is smaller than `rtol` times the energy
+
+    max_iter : int
+
+    Returns
+    -------
+    cascade_energy : float64, units of GeV
+
+    neg_llh : float64
+
+    """
+    fixed = energy_basis.exp_p_fixed_at_hit_times
+    per_gev = energy_basis.exp_p_per_cascade_gev_at_hit_times
+    charges = energy_basis.charges
+    sum_per_gev = energy_basis.sum_exp_p_per_cascade_gev
+
+    # Start just above zero if any hit would otherwise have zero expectation
+    if np.all(fixed[charges > 0] > 0):
+        cascade_energy = 0.0
+    else:
+        cascade_energy = np.finfo(np.float64).tiny
+
+    for _ in range(max_iter):
+        ratio = per_gev / (fixed + cascade_energy * per_gev)
+        gradient = sum_per_gev - np.sum(charges * ratio)
+        if gradient >= 0:
+            break
+        step = -gradient / np.sum(charges * ratio * ratio)
+        cascade_energy += step
+        if step <= rtol * cascade_energy:
+            break
+
+    neg_llh = get_neg_llh_from_energy_basis(energy_basis, cascade_energy)
+
+    return np.float64(cascade_energy), neg_llh
+
+
+def get_gradient_step_sizes(
+        binning_info, bins_per_step=GRADIENT_BINS_PER_STEP,
+        track_energy_step=GRADIENT_TRACK_ENERGY_STEP
+    ):
+    """Get finite-difference steps for `get_neg_llh_gradient` sized from the
+    tables' binning.
+
+    Expectations come from binned tables and so are piecewise constant in
+    time, position, and direction; a step smaller than a bin often gives a
+    derivative of exactly zero (or a spike where a bin edge is crossed). Each
+    step therefore spans `bins_per_step` bins of the corresponding table
+    dimension: the time bin width for t, the mean radial bin width for x, y,
+    and z, and the coarser of the two directional bin widths (in radians) for
+    the track angles.
+
+    Parameters
+    ----------
+    binning_info : mapping
+        As in ``Retro5DTables.pexp_meta['binning_info']``
+    bins_per_step : float > 0
+    track_energy_step : float > 0
+        Step in track energy (GeV)
+
+    Returns
+    -------
+    step_sizes : HYPO_PARAMS_T
+        ``cascade_energy`` is None
+
+    """
+    dt = (
+        (binning_info['t_max'] - binning_info['t_min'])
+        / binning_info['n_t_bins']
+    )
+    dr = (
+        (binning_info['r_max'] - binning_info['r_min'])
+        / binning_info['n_r_bins']
+    )
+    dangle = max(
+        2 / binning_info['n_costhetadir_bins'],
+        np.pi / binning_info['n_deltaphidir_bins']
+    )
+    return HYPO_PARAMS_T(
+        t=bins_per_step * dt,
+        x=bins_per_step * dr,
+        y=bins_per_step * dr,
+        z=bins_per_step * dr,
+        track_zenith=bins_per_step * dangle,
+        track_azimuth=bins_per_step * dangle,
+        track_energy=track_energy_step,
+        cascade_energy=None
+    )
+
+
+def get_neg_llh_gradient(
+        hypo, hits, time_window, hypo_handler, dom_tables, tdi_table=None,
+        step_sizes=None, num_threads=1
+    ):
+    """Get the negative of the log likelihood of `event` having come from
+    hypothesis `hypo` along with its derivatives with respect to the
+    hypothesis parameters, e.g. for use with a gradient-based minimizer such
+    as ``scipy.optimize.minimize(..., jac=True)`` to refine a hypothesis.
+
+    The derivative with respect to cascade energy is exact, from the energy
+    basis of `hypo` (see `get_energy_basis`, whose assumptions about the hypo
+    kernels apply). Derivatives with respect to all other parameters are
+    plain finite differences of the whole likelihood: central differences
+    over `step_sizes` (forward differences if the lower point would have a
+    negative energy). This costs 14 likelihood evaluations beyond the one at
+    `hypo`, all done in one call to `get_neg_llh_batch`.
+
+    Arguments are the same as for `get_neg_llh_fused`, except
+
+    step_sizes : HYPO_PARAMS_T, optional
+        Finite-difference step for each parameter; ``cascade_energy`` is
+        ignored. Defaults to `get_gradient_step_sizes` applied to the binning
+        of `dom_tables`.
+
+    Returns
+    -------
+    neg_llh : float64
+        Negative of the log likelihood
+
+    gradient : HYPO_PARAMS_T of float64
+        Derivative of `neg_llh` with respect to each hypothesis parameter
+
+    """
+    if step_sizes is None:
+        step_sizes = get_gradient_step_sizes(
+            dom_tables.pexp_meta['binning_info']
+        )
+
+    metric_kw = dict(
+        hits=hits,
+        time_window=time_window,
+        hypo_handler=hypo_handler,
+        dom_tables=dom_tables,
+        tdi_table=tdi_table,
+        num_threads=num_threads
+    )
+
+    energy_basis = get_energy_basis(hypo=hypo, **metric_kw)
+    neg_llh = get_neg_llh_from_energy_basis(
+        energy_basis, hypo.cascade_energy
+    )
+    exp_p_per_cascade_gev = energy_basis.exp_p_per_cascade_gev_at_hit_times
+    exp_p_at_hit_times = (
+        energy_basis.exp_p_fixed_at_hit_times
+        + hypo.cascade_energy * exp_p_per_cascade_gev
+    )
+    d_cascade_energy = energy_basis.sum_exp_p_per_cascade_gev - np.sum(
+        energy_basis.charges * exp_p_per_cascade_gev / exp_p_at_hit_times
+    )
+
+    fd_params = [p for p in HYPO_PARAMS_T._fields if p != 'cascade_energy']
+    fd_hypos = []
+    fd_steps = []
+    for param in fd_params:
+        value = getattr(hypo, param)
+        upper = value + getattr(step_sizes, param)
+        lower = value - getattr(step_sizes, param)
+        if param == 'track_energy' and lower < 0:
+            lower = value
+        fd_hypos.append(hypo._replace(**{param: upper}))
+        fd_hypos.append(hypo._replace(**{param: lower}))
+        fd_steps.append(upper - lower)
+
+    fd_neg_llhs = get_neg_llh_batch(hypos=fd_hypos, **metric_kw)
+    derivs = (fd_neg_llhs[0::2] - fd_neg_llhs[1::2]) / np.array(fd_steps)
+
+    gradient = dict(zip(fd_params, derivs))
+    gradient['cascade_energy'] = d_cascade_energy
+
+    return neg_llh, HYPO_PARAMS_T(**gradient)
+
+
+class IncrementalNegLLH(object):
+    """Negative log likelihood of one event, reusing the expectations computed
+    for the previous hypothesis where possible.
+
+    Expectations are linear in the sources, so the (noise-free) contribution
+    of each hypo kernel is kept separately. On each call, a kernel whose
+    sources did not change (e.g. the cascade while scanning track energy)
+    reuses its contribution, and a kernel whose sources changed only after a
+    common prefix (e.g. a longer or shorter muon from
+    `table_energy_loss_muon`) only has the differing sources recomputed.
+
+    Parameters
+    ----------
+    hits, time_window, dom_tables, tdi_table, num_threads
+        See `get_neg_llh_fused`
+
+    hypo_handler : hypo.discrete_hypo.DiscreteHypo
+        Must have method `get_kernel_sources`
+
+    refresh_interval : int >= 1
+        Recompute a kernel's contribution in full after this many incremental
+        updates
+
+    max_changed_fraction : float in [0, 1]
+        Recompute a kernel's contribution in full if more than this fraction
+        of its sources changed
+
+    """
+    def __init__(
+            self, hits, time_window, hypo_handler, dom_tables, tdi_table=None,
+            num_threads=1, refresh_interval=INCREMENTAL_REFRESH_INTERVAL,
+            max_changed_fraction=INCREMENTAL_MAX_CHANGED_FRACTION
+        ):
+        if tdi_table is None:
+            hits, _ = _unpack_hits(hits, time_window)
+            noise_exp = None
+        else:
+            hits, _, noise_exp = _unpack_tdi_hits(
+                hits, time_window, dom_tables
+            )
+
+        if tdi_table is None:
+            _warn_if_no_t_indep_exp(dom_tables)
+
+        self.hits = hits
+        self.time_window = time_window
+        self.hypo_handler = hypo_handler
+        self.dom_tables = dom_tables
+        self.tdi_table = tdi_table
+        self.tdi_noise_exp = noise_exp
+        self.num_threads = num_threads
+        self.refresh_interval = refresh_interval
+        self.max_changed_fraction = max_changed_fraction
+
+        # With no sources, all DOMs are culled and only noise is expected
+        self.noise_at_all_times, self.noise_at_hit_times = (
+            dom_tables.get_expected_det_all_doms(
+                sources=np.empty(shape=0, dtype=SRC_DTYPE),
+                hits=hits,
+                time_window=time_window,
+                num_threads=num_threads
+            )
+        )
+
+        num_kernels = len(hypo_handler.hypo_kernels)
+        self.kernel_sources = [None] * num_kernels
+        self.kernel_contributions = [None] * num_kernels
+        self.kernel_num_updates = [0] * num_kernels
+
+    def get_contribution(self, sources):
+        """Get the noise-free expectations due to `sources`.
+
+        Parameters
+        ----------
+        sources : shape (num_sources,) array of dtype SRC_DTYPE
+
+        Returns
+        -------
+        contribution : list
+            ``[exp_p_at_all_times, exp_p_at_hit_times, tdi_exp_p]``, where
+            `tdi_exp_p` is 0 if no `tdi_table` is used
+
+        """
+        exp_p_at_all_times, exp_p_at_hit_times = (
+            self.dom_tables.get_expected_det_all_doms(
+                sources=sources,
+                hits=self.hits,
+                time_window=self.time_window,
+                num_threads=self.num_threads,
+                include_noise=False
+            )
+        )
+        if self.tdi_table is None:
+            tdi_exp_p = 0.0
+        else:
+            tdi_exp_p = self.tdi_table.get_expected_det(sources=sources)
+        return [exp_p_at_all_times, exp_p_at_hit_times, tdi_exp_p]
+
+    def update_kernel(self, kernel_idx, sources):
+        """Update the stored contribution of one hypo kernel given the
+        `sources` it now produces."""
+        prev_sources = self.kernel_sources[kernel_idx]
+        self.kernel_sources[kernel_idx] = sources
+
+        if prev_sources is not None:
+            num_common = min(len(prev_sources), len(sources))
+            mismatches = np.flatnonzero(
+                prev_sources[:num_common] != sources[:num_common]
+            )
+            if len(mismatches) > 0:
+                num_common = mismatches[0]
+            num_changed = len(prev_sources) + len(sources) - 2*num_common
+            if num_changed == 0:
+                return
+
+        if (
+                prev_sources is None
+                or num_changed > self.max_changed_fraction * len(sources)
+                or self.kernel_num_updates[kernel_idx] >= self.refresh_interval
+            ):
+            self.kernel_contributions[kernel_idx] = self.get_contribution(
+                sources
+            )
+            self.kernel_num_updates[kernel_idx] = 0
+            return
+
+        # Replace the contribution of the previous sources after the common
+        # prefix by that of the new ones. Rounding can leave values slightly
+        # off (even slightly negative where they should be zero); the
+        # periodic full recomputation keeps this from accumulating.
+        contribution = self.kernel_contributions[kernel_idx]
+        removed = self.get_contribution(prev_sources[num_common:])
+        added = self.get_contribution(sources[num_common:])
+        for idx in range(3):
+            contribution[idx] = contribution[idx] - removed[idx] + added[idx]
+        self.kernel_num_updates[kernel_idx] += 1
+
+    def get_neg_llh(self, hypo):
+        """Get the negative of the log likelihood of the event having come
+        from hypothesis `hypo`.
+
+        Parameters
+        ----------
+        hypo : HYPO_PARAMS_T
+
+        Returns
+        -------
+        neg_llh : float
+
+        """
+        kernel_sources = self.hypo_handler.get_kernel_sources(hypo)
+        for kernel_idx, sources in enumerate(kernel_sources):
+            self.update_kernel(kernel_idx, sources)
+
+        exp_p_at_all_times = self.noise_at_all_times.copy()
+        exp_p_at_hit_times = self.noise_at_hit_times.copy()
+        tdi_exp_p = 0.0
+        for contribution in self.kernel_contributions:
+            exp_p_at_all_times += contribution[0]
+            exp_p_at_hit_times += contribution[1]
+            tdi_exp_p += contribution[2]
+
+        if self.tdi_table is None:
+            sum_at_all_times = np.sum(exp_p_at_all_times)
+        else:
+            sum_at_all_times = self.tdi_noise_exp + tdi_exp_p
+
+        sum_log_at_hit_times = np.sum(
+            self.hits.charges * np.log(exp_p_at_hit_times)
+        )
+
+        neg_llh = sum_at_all_times - sum_log_at_hit_times
+
+        return neg_llh
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+
+"""
+Thin client for a likelihood server (see `retro.llh_server`) that holds Retro
+tables resident in memory, so that table load time is paid once per node
+rather than once per event.
+
+The client needs only numpy and the standard library; requests and replies
+are pickled over a `multiprocessing.connection` socket. Since the server
+unpickles whatever authenticated clients send it, it listens by default on a
+Unix domain socket accessible only to its owner and requires an authkey that
+is either given explicitly or generated (and printed) at startup.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = [
+    'DEFAULT_ADDRESS',
+    'generate_authkey',
+    'to_authkey',
+    'parse_address',
+    'LLHClient'
+]
+
+__author__ = 'J.L. Lanfranchi'
+__license__ = '''Copyright 2017 Justin L. Lanfranchi
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.'''
+
+import binascii
+from multiprocessing.connection import Client
+import os
+from os.path import join
+from tempfile import gettempdir
+
+import numpy as np
+
+
+DEFAULT_ADDRESS = join(gettempdir(), 'retro_llh_{}.sock'.format(os.getuid()))
+"""Unix domain socket the likelihood server listens on if no address is
+specified (one per user)"""
+
+
+def generate_authkey():
+    """Generate a random key for authenticating connections to a likelihood
+    server.
+
+    Returns
+    -------
+    authkey : string
+        32 hexadecimal digits
+
+    """
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+def to_authkey(authkey):
+    """Encode `authkey` as bytes, as required by `multiprocessing.connection`
+    (e.g. if it comes from the command line)"""
+    if isinstance(authkey, bytes):
+        return authkey
+    return authkey.encode('utf-8')
+
+
+def parse_address(address):
+    """Convert an address string to the form used by
+    `multiprocessing.connection`.
+
+    Parameters
+    ----------
+    address : string or tuple
+        "host:port" for a TCP socket, otherwise the path to a Unix domain
+        socket. A tuple is returned unchanged.
+
+    Returns
+    -------
+    address : (string, int) tuple or string
+
+    """
+    if isinstance(address, tuple):
+        return address
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address
+
+
+class LLHClient(object):
+    """Connection to a likelihood server.
+
+    Set the event via `set_event`, then use `get_neg_llh` or
+    `get_neg_llh_batch` as the `metric` passed to `retro.scan.scan` (with
+    `batch_size` set for the latter) or to a minimizer.
+
+    Parameters
+    ----------
+    address : string or tuple
+        See `parse_address`
+    authkey : string or bytes
+        The key given to (or printed by) the server
+
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        if authkey is None:
+            raise ValueError(
+                'An authkey is required to connect to a likelihood server'
+            )
+        self.address = parse_address(address)
+        self.conn = Client(self.address, authkey=to_authkey(authkey))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the connection; the server remains running"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def request(self, command, **kwargs):
+        """Send a command to the server and return its result.
+
+        Parameters
+        ----------
+        command : string
+            One of "info", "set_event", "neg_llh", or "shutdown"
+        **kwargs
+            Arguments for `command`
+
+        Returns
+        -------
+        result
+
+        Raises
+        ------
+        ValueError
+            If the server failed to process the request; the message includes
+            the server's traceback
+
+        """
+        self.conn.send((command, kwargs))
+        status, result = self.conn.recv()
+        if status != 'ok':
+            raise ValueError(
+                'Likelihood server failed to process "{}":\n{}'
+                .format(command, result)
+            )
+        return result
+
+    def get_info(self):
+        """Retrieve the server's configuration.
+
+        Returns
+        -------
+        info : OrderedDict
+
+        """
+        return self.request('info')
+
+    def set_event(
+            self, hits, time_window, hits_are_photons=False, coarsen=False
+        ):
+        """Set the event against which subsequent hypotheses are evaluated.
+
+        Parameters
+        ----------
+        hits : mapping or retro_types.EventHits
+            Anything accepted by `retro.likelihood.prepare_hits`
+        time_window : float
+        hits_are_photons : bool
+            Convert photons to hits by weighting with the server tables'
+            angular sensitivity model
+        coarsen : bool
+            Apply `retro.likelihood.coarsen_hits` to the event's hits
+
+        Returns
+        -------
+        info : OrderedDict
+            Number of DOMs and hits in the event as it is evaluated by the
+            server
+
+        """
+        return self.request(
+            'set_event',
+            hits=hits,
+            time_window=time_window,
+            hits_are_photons=hits_are_photons,
+            coarsen=coarsen
+        )
+
+    def get_neg_llh_batch(self, hypos):
+        """Get the negative log likelihoods of the current event for several
+        hypotheses with a single request.
+
+        Parameters
+        ----------
+        hypos : sequence of HYPO_PARAMS_T
+
+        Returns
+        -------
+        neg_llh : shape (len(hypos),) array of float64
+
+        """
+        hypos = np.array(hypos, dtype=np.float64, ndmin=2)
+        return self.request('neg_llh', hypos=hypos)
+
+    def get_neg_llh(self, hypo):
+        """Get the negative log likelihood of the current event for `hypo`.
+
+        Parameters
+        ----------
+        hypo : HYPO_PARAMS_T
+
+        Returns
+        -------
+        neg_llh : float
+
+        """
+        return self.get_neg_llh_batch([hypo])[0]
+
+    def shutdown_server(self):
+        """Ask the server to exit, then close the connection"""
+        self.request('shutdown')
+        self.close()
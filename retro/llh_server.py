@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+
+"""
+Long-running likelihood server that loads Retro tables once and then
+evaluates negative log-likelihoods for events and hypotheses sent to it by
+clients (see `retro.llh_client.LLHClient`) over a local socket.
+
+Start the server with the same hypo- and table-related arguments as
+`scan_neg_llh.py`, e.g.::
+
+    llh_server.py --address /tmp/retro_llh.sock --fused <table args>
+
+and then run e.g. ``scan_neg_llh.py --server /tmp/retro_llh.sock --authkey
+<key> ...`` as many times as needed, where <key> is the one given to the
+server with --authkey or else the one it generates and prints at startup. One
+client is served at a time.
+
+Requests are unpickled by the server, so anyone able to connect can run code
+as the server's owner: Unix domain sockets are created accessible only to the
+owner, and TCP addresses should only be used on trusted networks.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = ['LLHServer', 'parse_args', 'main']
+
+__author__ = 'J.L. Lanfranchi'
+__license__ = '''Copyright 2017 Justin L. Lanfranchi
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.'''
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from multiprocessing.connection import Listener
+import os
+from os.path import abspath, dirname
+import sys
+import time
+import traceback
+
+import numpy as np
+
+if __name__ == '__main__' and __package__ is None:
+    RETRO_DIR = dirname(dirname(abspath(__file__)))
+    if RETRO_DIR not in sys.path:
+        sys.path.append(RETRO_DIR)
+from retro import HYPO_PARAMS_T
+from retro.likelihood import (
+    coarsen_hits, get_event_context, get_neg_llh, get_neg_llh_batch,
+    prepare_hits
+)
+from retro.llh_client import (
+    DEFAULT_ADDRESS, generate_authkey, parse_address, to_authkey
+)
+from retro.scan_neg_llh import (
+    add_setup_args, photons_to_hits, setup_dom_tables, setup_hypo_handler
+)
+
+
+class LLHServer(object):
+    """Evaluate negative log-likelihoods on behalf of clients, keeping the
+    tables resident in memory between events.
+
+    Parameters
+    ----------
+    hypo_handler : hypo.discrete_hypo.DiscreteHypo
+    dom_tables : tables.retro_5d_tables.Retro5DTables
+        If `stack_tables` has been called on `dom_tables`, hypotheses are
+        evaluated with `get_neg_llh_batch`, otherwise one at a time with
+        `get_neg_llh`
+    tdi_table : optional
+    num_threads : int >= 1
+        Threads used by `get_neg_llh_batch`
+
+    """
+    def __init__(self, hypo_handler, dom_tables, tdi_table=None, num_threads=1):
+        self.hypo_handler = hypo_handler
+        self.dom_tables = dom_tables
+        self.tdi_table = tdi_table
+        self.num_threads = num_threads
+        self.fused = dom_tables.table_stack is not None
+        self.hits = None
+        self.time_window = None
+
+    def get_info(self):
+        """Server configuration.
+
+        Returns
+        -------
+        info : OrderedDict
+
+        """
+        return OrderedDict([
+            ('table_kind', self.dom_tables.table_kind),
+            ('norm_version', self.dom_tables.norm_version),
+            ('precision', self.dom_tables.precision),
+            ('use_directionality', self.dom_tables.use_directionality),
+            ('fused', self.fused),
+            ('num_threads', self.num_threads),
+            ('hypo_params', HYPO_PARAMS_T._fields)
+        ])
+
+    def set_event(
+            self, hits, time_window, hits_are_photons=False, coarsen=False
+        ):
+        """Set the event used by subsequent calls to `get_neg_llh`; see
+        `LLHClient.set_event` for arguments"""
+        if hits_are_photons:
+            hits = photons_to_hits(hits, self.dom_tables.angsens_poly)
+        hits = prepare_hits(hits)
+        num_merged = 0
+        if coarsen:
+            hits, num_merged = coarsen_hits(
+                hits=hits,
+                binning_info=self.dom_tables.pexp_meta['binning_info']
+            )
+        self.hits = get_event_context(
+            hits=hits, time_window=time_window, dom_tables=self.dom_tables
+        )
+        self.time_window = time_window
+        return OrderedDict([
+            ('num_doms', len(hits.str_dom_idxs)),
+            ('num_hits', len(hits.times)),
+            ('num_merged', num_merged)
+        ])
+
+    def get_neg_llh(self, hypos):
+        """Evaluate the current event for each hypothesis.
+
+        Parameters
+        ----------
+        hypos : shape (n_hypos, len(HYPO_PARAMS_T)) array
+
+        Returns
+        -------
+        neg_llh : shape (n_hypos,) array of float64
+
+        """
+        if self.hits is None:
+            raise ValueError('Event must be set before evaluating hypotheses')
+        hypos = [HYPO_PARAMS_T(*hypo) for hypo in np.asarray(hypos).tolist()]
+        metric_kw = dict(
+            hits=self.hits,
+            time_window=self.time_window,
+            hypo_handler=self.hypo_handler,
+            dom_tables=self.dom_tables,
+            tdi_table=self.tdi_table
+        )
+        if self.fused:
+            return get_neg_llh_batch(
+                hypos, num_threads=self.num_threads, **metric_kw
+            )
+        return np.array(
+            [get_neg_llh(hypo, **metric_kw) for hypo in hypos],
+            dtype=np.float64
+        )
+
+    def serve(self, address=DEFAULT_ADDRESS, authkey=None):
+        """Accept clients one at a time and process their requests until a
+        client sends "shutdown".
+
+        Parameters
+        ----------
+        address : string or tuple
+            See `llh_client.parse_address`. A Unix domain socket is created
+            with permissions 0600.
+        authkey : string or bytes, optional
+            If not specified, a random key is generated and printed
+
+        """
+        handlers = {
+            'info': self.get_info,
+            'set_event': self.set_event,
+            'neg_llh': self.get_neg_llh
+        }
+        if authkey is None:
+            authkey = generate_authkey()
+            print('Generated authkey: {}'.format(authkey))
+        address = parse_address(address)
+        if isinstance(address, tuple):
+            listener = Listener(address, authkey=to_authkey(authkey))
+        else:
+            # Create the socket accessible only to its owner
+            old_umask = os.umask(0o177)
+            try:
+                listener = Listener(address, authkey=to_authkey(authkey))
+            finally:
+                os.umask(old_umask)
+        print('Likelihood server listening at {}'.format(listener.address))
+        sys.stdout.flush()
+        try:
+            while True:
+                conn = listener.accept()
+                self.hits = None
+                self.time_window = None
+                shutdown = False
+                try:
+                    while True:
+                        try:
+                            command, kwargs = conn.recv()
+                        except EOFError:
+                            break
+                        if command == 'shutdown':
+                            conn.send(('ok', None))
+                            shutdown = True
+                            break
+                        try:
+                            if command not in handlers:
+                                raise ValueError(
+                                    'Unknown command "{}"'.format(command)
+                                )
+                            result = handlers[command](**kwargs)
+                        except Exception: # pylint: disable=broad-except
+                            conn.send(('error', traceback.format_exc()))
+                        else:
+                            conn.send(('ok', result))
+                finally:
+                    conn.close()
+                if shutdown:
+                    break
+        finally:
+            listener.close()
+        print('Likelihood server shut down')
+
+
+def parse_args(description=__doc__):
+    """Parse command-line arguments"""
+    parser = ArgumentParser(description=description)
+    parser.add_argument(
+        '--address', default=DEFAULT_ADDRESS,
+        help='''Address to listen on: "host:port" for a TCP socket or else
+        the path to a Unix domain socket (created with permissions 0600)'''
+    )
+    parser.add_argument(
+        '--authkey', default=None,
+        help='''Key clients must present to connect; if not specified, a
+        random key is generated and printed'''
+    )
+    add_setup_args(parser)
+    return parser.parse_args()
+
+
+def main():
+    """Script "main" function"""
+    kwargs = vars(parse_args())
+    address = kwargs.pop('address')
+    authkey = kwargs.pop('authkey')
+    fused = kwargs.pop('fused')
+    num_threads = kwargs.pop('num_threads')
+
+    print('Loading hypo kernels and tables')
+    t0 = time.time()
+    hypo_handler = setup_hypo_handler(kwargs)
+    dom_tables, tdi_table = setup_dom_tables(kwargs)
+    if fused:
+        dom_tables.stack_tables()
+    print('  -> {:.3f} s\n'.format(time.time() - t0))
+
+    server = LLHServer(
+        hypo_handler=hypo_handler,
+        dom_tables=dom_tables,
+        tdi_table=tdi_table,
+        num_threads=num_threads
+    )
+    server.serve(address=address, authkey=authkey)
+
+
+if __name__ == '__main__':
+    main()
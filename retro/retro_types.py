@@ -13,7 +13,11 @@ __all__ = [
     'TrackParams',
     'Hit',
     'Photon',
+    'Pulses',
     'Event',
+    'EventHits',
+    'EventContext',
+    'EnergyBasis',
     'RetroPhotonInfo',
     'HypoPhotonInfo',
     'Cart2DCoord',
@@ -73,6 +77,58 @@ Event = namedtuple( # pylint: disable=invalid-name
                  'neutrino', 'track', 'cascade', 'ml_reco', 'spe_reco')
 )
 
+Pulses = namedtuple( # pylint: disable=invalid-name
+    typename='Pulses',
+    field_names=('strings', 'oms', 'times', 'charges')
+)
+"""Pulses of an event as parallel arrays. `strings` are 1-indexed and `oms`
+are 0-indexed (i.e., depth indices)"""
+
+EventHits = namedtuple( # pylint: disable=invalid-name
+    typename='EventHits',
+    field_names=('str_dom_idxs', 'dom_hits_start', 'times', 'charges')
+)
+"""Hits of an event in flat (compressed sparse row) layout. Hits for the DOM
+with zero-based (string_idx, dom_idx) ``str_dom_idxs[i]`` are
+``times[dom_hits_start[i]:dom_hits_start[i+1]]`` (and likewise for
+`charges`), sorted in time. Units are: times/ns, charges/photoelectrons"""
+
+EventContext = namedtuple( # pylint: disable=invalid-name
+    typename='EventContext',
+    field_names=(
+        'hits',
+        'time_window',
+        'dom_operational',
+        'dom_coords',
+        'dom_quantum_efficiency',
+        'dom_noise_rate_per_ns',
+        'dom_noise_exp',
+        'dom_table_tups'
+    )
+)
+"""Per-event constants for the likelihood, computed once per event (see
+`likelihood.get_event_context`). `hits` is an `EventHits` and `time_window` is
+in ns; the `dom_*` fields are per DOM in ``hits.str_dom_idxs`` order: whether
+it is operational, its coordinates (m), quantum efficiency, noise rate (per
+ns), expected noise over `time_window`, and its table tuple (None for
+non-operational DOMs)"""
+
+EnergyBasis = namedtuple( # pylint: disable=invalid-name
+    typename='EnergyBasis',
+    field_names=(
+        'sum_exp_p_fixed',
+        'sum_exp_p_per_cascade_gev',
+        'exp_p_fixed_at_hit_times',
+        'exp_p_per_cascade_gev_at_hit_times',
+        'charges'
+    )
+)
+"""Photon expectations for an event split into a part that does not depend on
+cascade energy (noise and track) and a part per GeV of cascade energy, such
+that the expectation for cascade energy `E` is ``fixed + E * per_cascade_gev``.
+`sum_*` are summed over all DOMs and times, `*_at_hit_times` and `charges` are
+per hit (in `EventHits` order)"""
+
 Hit = namedtuple(
     typename='Hit',
     field_names=('time', 'charge', 'width')
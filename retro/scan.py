@@ -40,7 +40,7 @@ if __name__ == '__main__' and __package__ is None:
 from retro import FTYPE, HYPO_PARAMS_T
 
 
-def scan(scan_values, metric, metric_kw=None):
+def scan(scan_values, metric, metric_kw=None, batch_size=None):
     """Scan a metric (e.g., neg_llh) for hypotheses with a set of parameter
     values.
 
@@ -67,6 +67,15 @@ def scan(scan_values, metric, metric_kw=None):
     metric_kw : mapping, optional
         Keyword arguments to pass to `get_neg_llh` function
 
+    batch_size : int, optional
+        If specified, `metric` is instead called with a list of up to
+        `batch_size` hypotheses at a time, i.e.::
+
+            metric([HYPO_PARAMS_T(*hypo_params), ...], **metric_kw)
+
+        and must return a sequence of as many values (e.g.,
+        `get_neg_llh_batch`)
+
     Returns
     -------
     metric_vals : shape (len(scan_values[0]), len(scan_values[1]), ...) array of FTYPE
@@ -105,16 +114,33 @@ def scan(scan_values, metric, metric_kw=None):
 
     total_points = np.product(shape)
 
+    # Times at which progress was reported, and number of points evaluated by
+    # each of those times
     times = [time.time()]
+    num_evaluated = [0]
     metric_vals = []
+    batch = []
+    report_n = 500
     for n, param_values in enumerate(product(*scan_sequences)):
         param_values = HYPO_PARAMS_T(*param_values)
-        metric_val = metric(param_values, **metric_kw)
-        metric_vals.append(metric_val)
-        if n > 0 and n % 500 == 0:
+        if batch_size is None:
+            metric_val = metric(param_values, **metric_kw)
+            metric_vals.append(metric_val)
+        else:
+            batch.append(param_values)
+            if len(batch) == batch_size or n == total_points - 1:
+                metric_vals.extend(metric(batch, **metric_kw))
+                batch = []
+        if n > 0 and len(metric_vals) >= report_n:
+            # A batch can span several multiples of 500 points
+            report_n = (len(metric_vals) // 500 + 1) * 500
             times.append(time.time())
-            avg = np.mean(np.diff(times[-5:])) / 500
-            remaining = avg * (total_points - n - 1)
+            num_evaluated.append(len(metric_vals))
+            avg = (
+                (times[-1] - times[-5:][0])
+                / (num_evaluated[-1] - num_evaluated[-5:][0])
+            )
+            remaining = avg * (total_points - len(metric_vals))
             print('Elapsed: {} s, avg: {:.3f} ms/pt; remaining ~ {} s'
                   .format(int(np.round(times[-1] - times[0])),
                           avg * 1000,
@@ -8,7 +8,14 @@ Instantiate Retro tables and scan the negative log-likelihood space.
 
 from __future__ import absolute_import, division, print_function
 
-__all__ = ['scan_neg_llh', 'parse_args']
+__all__ = [
+    'add_setup_args',
+    'setup_hypo_handler',
+    'setup_dom_tables',
+    'photons_to_hits',
+    'scan_neg_llh',
+    'parse_args'
+]
 
 __author__ = 'J.L. Lanfranchi'
 __license__ = '''Copyright 2017 Justin L. Lanfranchi
@@ -46,73 +53,63 @@ from retro import HYPO_PARAMS_T
 from retro.utils.misc import expand, mkdir
 from retro.hypo.discrete_hypo import DiscreteHypo
 from retro.hypo.discrete_cascade_kernels import (
-    point_cascade
+    POINT_CASCADE_HYPO_PARAMS, point_cascade
 )
 from retro.hypo.discrete_muon_kernels import (
-    const_energy_loss_muon, table_energy_loss_muon
+    MUON_KERNEL_HYPO_PARAMS, const_energy_loss_muon, table_energy_loss_muon
 )
 from retro.i3info.extract_gcd import extract_gcd
-from retro.likelihood import get_neg_llh
+from retro.likelihood import (
+    IncrementalNegLLH, coarsen_hits, get_event_context, get_neg_llh,
+    get_neg_llh_batch, get_neg_llh_fused, prepare_hits
+)
+from retro.llh_client import LLHClient
 from retro.scan import scan
+from retro.tables.pexp_5d import PRECISIONS
 from retro.tables.retro_5d_tables import (
     NORM_VERSIONS, TABLE_KINDS, Retro5DTables
 )
+from retro.tables.tdi_cart_tables import TDICartTable
 
 
-def parse_args(description=__doc__):
-    """Parse command-line arguments"""
-    parser = ArgumentParser(description=description)
-
-    parser.add_argument(
-        '--outdir', required=True
-    )
-    parser.add_argument(
-        '--n-events', type=int, default=None
-    )
-    parser.add_argument(
-        '--start-event-idx', type=int, default=0
-    )
+def add_setup_args(parser, required=True):
+    """Add to `parser` the arguments used by `setup_hypo_handler` and
+    `setup_dom_tables`.
 
-    for dim in HYPO_PARAMS_T._fields:
-        parser.add_argument(
-            '--{}'.format(dim.replace('_', '-')), nargs='+', required=True,
-            help='''Hypothses will take this(these) value(s) for dimension
-            {dim_hr}. Specify a single value to not scan over this dimension;
-            specify a human-readable string of values, e.g. '0, 0.5, 1-10:0.2'
-            scans 0, 0.5, and from 1 to 10 (inclusive of both endpoints) with
-            stepsize of 0.2.'''.format(dim_hr=dim.replace('_', ' '))
-        )
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+    required : bool
+        Whether the arguments needed to load tables are required; if False,
+        the caller must check for them itself
 
-    parser.add_argument(
-        '--hits', required=True,
-    )
-    parser.add_argument(
-        '--hits-are-photons', action='store_true',
-    )
-    parser.add_argument(
-        '--time-window', type=float, required=True,
-    )
+    """
     parser.add_argument(
         '--angsens-model',
         choices='nominal  h1-100cm  h2-50cm  h3-30cm'.split()
     )
 
     parser.add_argument(
-        '--cascade-kernel', choices=['point', 'one_dim'], required=True,
+        '--cascade-kernel', choices=['point', 'one_dim'], required=required,
     )
     parser.add_argument(
         '--cascade-samples', type=int, default=1,
     )
     parser.add_argument(
-        '--track-kernel', required=True,
+        '--track-kernel', required=required,
         choices=['const_e_loss', 'nonconst_e_loss'],
     )
     parser.add_argument(
-        '--track-time-step', type=float, required=True,
+        '--track-time-step', type=float, required=required,
+    )
+    parser.add_argument(
+        '--hypo-cache-size', type=int, default=0,
+        help='''Memoize the light sources of up to this many hypotheses (and
+        hypo kernel evaluations); 0 disables caching'''
     )
 
     parser.add_argument(
-        '--dom-tables-fname-proto', required=True,
+        '--dom-tables-fname-proto', required=required,
         help='''Must have one of the brace-enclosed fields "{string}" or
         "{subdet}", and must have one of "{dom}" or "{depth_idx}". E.g.:
         "my_tables_{subdet}_{depth_idx}"'''
@@ -127,16 +124,16 @@ def parse_args(description=__doc__):
         sensible default is chosen for the type of tables being used.'''
     )
     parser.add_argument(
-        '--dom-table-kind', choices=TABLE_KINDS, required=True,
+        '--dom-table-kind', choices=TABLE_KINDS, required=required,
         help='''Kind of single-DOM table to use.'''
     )
     parser.add_argument(
-        '--gcd', required=True,
+        '--gcd', required=required,
         help='''IceCube GCD file; can either specify an i3 file, or the
         extracted pkl file used in Retro.'''
     )
     parser.add_argument(
-        '--norm-version', choices=NORM_VERSIONS, required=True,
+        '--norm-version', choices=NORM_VERSIONS, required=required,
         help='''Norm version.'''
     )
     parser.add_argument(
@@ -150,39 +147,166 @@ def parse_args(description=__doc__):
         '--ckv-sigma-deg', type=float, default=None,
     )
     parser.add_argument(
-        '--tdi-table', default=None
+        '--cone-lookup', action='store_true',
+        help='''With raw tables, precompute the Cherenkov cone map for each
+        directional bin when loading tables rather than sampling the cone for
+        every source and hit'''
+    )
+    parser.add_argument(
+        '--cone-lookup-oversample', type=int, default=1,
+        help='''Cone axes per dimension averaged within each directional bin
+        when generating the cone lookup'''
+    )
+    parser.add_argument(
+        '--dir-avg', action='store_true',
+        help='''Precompute direction-averaged (uncompressed) tables when
+        loading tables, used for isotropic sources'''
+    )
+    parser.add_argument(
+        '--tdi-table', default=None,
+        help='''Directory containing a time- and DOM-independent (TDI) table;
+        if specified, only hit DOMs are evaluated with the single-DOM tables
+        and the total expected charge comes from the TDI table'''
+    )
+    parser.add_argument(
+        '--tdi-proto-tile-hash', default=None,
+        help='''Hash identifying the TDI table's tiles; required with
+        --tdi-table'''
+    )
+    parser.add_argument(
+        '--pyramid-level', type=int, default=0,
+        help='''Use this level of the tables' coarse-to-fine pyramid (see
+        retro/tables/table_pyramid.py); 0 is full resolution'''
+    )
+    parser.add_argument(
+        '--precision', choices=PRECISIONS, default='double',
+        help='''Floating-point precision of expectation and likelihood-sum
+        arithmetic; check "single" against "double" with
+        retro/validate_precision.py'''
+    )
+    parser.add_argument(
+        '--fused', action='store_true',
+        help='''Stack the loaded tables and compute expectations for all DOMs
+        in a single call to compiled code. Note that this reads
+        memory-mapped tables into memory.'''
+    )
+    parser.add_argument(
+        '--num-threads', type=int, default=1,
+        help='''Number of threads used to compute DOM expectations (only
+        applies with --fused)'''
     )
 
-    return parser.parse_args()
 
+SETUP_REQUIRED_ARGS = (
+    'cascade_kernel', 'track_kernel', 'track_time_step',
+    'dom_tables_fname_proto', 'dom_table_kind', 'gcd', 'norm_version'
+)
+"""Arguments that `add_setup_args` adds with ``required=True``"""
 
-def scan_neg_llh():
-    """Script "main" function"""
-    t00 = time.time()
 
-    args = parse_args()
-    kwargs = vars(args)
-    orig_kwargs = deepcopy(kwargs)
+def parse_args(description=__doc__):
+    """Parse command-line arguments"""
+    parser = ArgumentParser(description=description)
+
+    parser.add_argument(
+        '--outdir', required=True
+    )
+    parser.add_argument(
+        '--n-events', type=int, default=None
+    )
+    parser.add_argument(
+        '--start-event-idx', type=int, default=0
+    )
 
-    scan_values = []
     for dim in HYPO_PARAMS_T._fields:
-        val_str = ''.join(kwargs.pop(dim))
-        val_str.replace('pi', format(np.pi, '.17e'))
-        val_str.replace('e', format(np.exp(1), '.17e'))
-        scan_values.append(hrlist2list(val_str))
+        parser.add_argument(
+            '--{}'.format(dim.replace('_', '-')), nargs='+', required=True,
+            help='''Hypothses will take this(these) value(s) for dimension
+            {dim_hr}. Specify a single value to not scan over this dimension;
+            specify a human-readable string of values, e.g. '0, 0.5, 1-10:0.2'
+            scans 0, 0.5, and from 1 to 10 (inclusive of both endpoints) with
+            stepsize of 0.2.'''.format(dim_hr=dim.replace('_', ' '))
+        )
 
-    # -- Instantiate hypo class with kernels -- #
-    print('Instantiating hypo object & kernels')
-    t0 = time.time()
+    parser.add_argument(
+        '--hits', required=True,
+    )
+    parser.add_argument(
+        '--hits-are-photons', action='store_true',
+    )
+    parser.add_argument(
+        '--time-window', type=float, required=True,
+    )
+
+    add_setup_args(parser, required=False)
 
+    parser.add_argument(
+        '--coarsen-hits', action='store_true',
+        help='''Merge each DOM's hits falling within the same table time bin
+        into one charge-weighted hit'''
+    )
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='''Reuse expectations of hypo kernels whose sources are unchanged
+        from the previous scan point (only applies with --fused; ignores
+        --batch-size)'''
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=None,
+        help='''Evaluate this many hypotheses per call to compiled code (only
+        applies with --fused or --server)'''
+    )
+    parser.add_argument(
+        '--server', default=None,
+        help='''Address ("host:port" or Unix socket path) of a running
+        likelihood server (see retro/llh_server.py) to evaluate the likelihood
+        with; tables are then not loaded by this script and the hypo- and
+        table-related arguments are ignored'''
+    )
+    parser.add_argument(
+        '--authkey', default=None,
+        help='''Authentication key of the likelihood server (required with
+        --server)'''
+    )
+
+    args = parser.parse_args()
+
+    if args.server is None:
+        for arg_name in SETUP_REQUIRED_ARGS:
+            if getattr(args, arg_name) is None:
+                parser.error(
+                    'argument --{} is required unless --server is specified'
+                    .format(arg_name.replace('_', '-'))
+                )
+    elif args.authkey is None:
+        parser.error('argument --authkey is required with --server')
+
+    return args
+
+
+def setup_hypo_handler(kwargs):
+    """Instantiate the hypo handler and its kernels.
+
+    Parameters
+    ----------
+    kwargs : mutable mapping
+        Parsed arguments (see `add_setup_args`); those used are popped
+
+    Returns
+    -------
+    hypo_handler : DiscreteHypo
+
+    """
     hypo_kernels = []
     kernel_kwargs = []
+    kernel_params = []
 
     cascade_kernel = kwargs.pop('cascade_kernel')
-    cascade_samples = kwargs.pop('cascade_samples')
+    cascade_samples = kwargs.pop('cascade_samples') # pylint: disable=unused-variable
     if cascade_kernel == 'point':
         hypo_kernels.append(point_cascade)
         kernel_kwargs.append(dict())
+        kernel_params.append(POINT_CASCADE_HYPO_PARAMS)
     else:
         raise NotImplementedError('{} cascade not implemented yet.'
                                   .format(cascade_kernel))
@@ -195,25 +319,44 @@ def scan_neg_llh():
     else:
         hypo_kernels.append(table_energy_loss_muon)
     kernel_kwargs.append(dict(dt=kwargs.pop('track_time_step')))
+    kernel_params.append(MUON_KERNEL_HYPO_PARAMS)
 
     hypo_handler = DiscreteHypo(
         hypo_kernels=hypo_kernels,
-        kernel_kwargs=kernel_kwargs
+        kernel_kwargs=kernel_kwargs,
+        cache_size=kwargs.pop('hypo_cache_size'),
+        kernel_params=kernel_params
     )
 
-    print('  -> {:.3f} s\n'.format(time.time() - t0))
+    return hypo_handler
 
-    # -- Instantiate tables class and load tables -- #
-    print('Instantiating tables object')
-    t0 = time.time()
 
+def setup_dom_tables(kwargs):
+    """Instantiate the single-DOM tables object and load the tables.
+
+    Parameters
+    ----------
+    kwargs : mutable mapping
+        Parsed arguments (see `add_setup_args`); those used are popped, except
+        for --fused and --num-threads
+
+    Returns
+    -------
+    dom_tables : Retro5DTables
+    tdi_table : TDICartTable or None
+
+    """
     dom_table_kind = kwargs.pop('dom_table_kind')
     angsens_model = kwargs.pop('angsens_model')
     norm_version = kwargs.pop('norm_version')
     num_phi_samples = kwargs.pop('num_phi_samples')
     ckv_sigma_deg = kwargs.pop('ckv_sigma_deg')
+    cone_lookup = kwargs.pop('cone_lookup')
+    cone_lookup_oversample = kwargs.pop('cone_lookup_oversample')
+    dir_avg = kwargs.pop('dir_avg')
+    pyramid_level = kwargs.pop('pyramid_level')
+    precision = kwargs.pop('precision')
     dom_tables_fname_proto = kwargs.pop('dom_tables_fname_proto')
-    time_window = kwargs.pop('time_window')
     step_length = kwargs.pop('step_length')
     force_no_mmap = kwargs.pop('force_no_mmap')
     if force_no_mmap:
@@ -224,8 +367,17 @@ def scan_neg_llh():
     use_directionality = not kwargs.pop('no_dir')
 
     tdi_table = kwargs.pop('tdi_table')
+    tdi_proto_tile_hash = kwargs.pop('tdi_proto_tile_hash')
     if tdi_table is not None:
-        raise NotImplementedError('TDI table not handled yet')
+        if tdi_proto_tile_hash is None:
+            raise ValueError(
+                '--tdi-proto-tile-hash is required with --tdi-table'
+            )
+        tdi_table = TDICartTable(
+            tables_dir=tdi_table,
+            proto_tile_hash=tdi_proto_tile_hash,
+            use_directionality=use_directionality
+        )
 
     compute_t_indep_exp = tdi_table is None
 
@@ -242,15 +394,15 @@ def scan_neg_llh():
         use_directionality=use_directionality,
         norm_version=norm_version,
         num_phi_samples=num_phi_samples,
-        ckv_sigma_deg=ckv_sigma_deg
+        ckv_sigma_deg=ckv_sigma_deg,
+        pyramid_level=pyramid_level,
+        precision=precision,
+        cone_lookup=cone_lookup,
+        cone_lookup_oversample=cone_lookup_oversample,
+        dir_avg=dir_avg
     )
 
-    print('  -> {:.3f} s\n'.format(time.time() - t0))
-
     # Load single-DOM tables
-    print('Loading single-DOM tables')
-    t0 = time.time()
-
     common_kw = dict(step_length=step_length, mmap=mmap)
 
     if '{subdet' in dom_tables_fname_proto:
@@ -282,6 +434,102 @@ def scan_neg_llh():
                 **common_kw
             )
 
+    return dom_tables, tdi_table
+
+
+def photons_to_hits(event_photons, angsens_poly):
+    """Convert an event's photons to hits, assigning each photon a "charge"
+    from its weight according to the angular sensitivity model.
+
+    Parameters
+    ----------
+    event_photons : mapping
+        Keys are (string, dom) and values are photon info arrays with time in
+        row 0 and coszen in row 4
+    angsens_poly : callable
+        E.g. `Retro5DTables.angsens_poly`
+
+    Returns
+    -------
+    event_hits : OrderedDict
+
+    """
+    event_hits = OrderedDict()
+    for str_dom, pinfo in event_photons.items():
+        t = pinfo[0, :]
+        coszen = pinfo[4, :]
+        weight = np.float32(angsens_poly(coszen))
+        event_hits[str_dom] = np.concatenate(
+            (t[np.newaxis, :], weight[np.newaxis, :]),
+            axis=0
+        )
+    return event_hits
+
+
+def scan_neg_llh():
+    """Script "main" function"""
+    t00 = time.time()
+
+    args = parse_args()
+    kwargs = vars(args)
+    orig_kwargs = deepcopy(kwargs)
+
+    scan_values = []
+    for dim in HYPO_PARAMS_T._fields:
+        val_str = ''.join(kwargs.pop(dim))
+        val_str.replace('pi', format(np.pi, '.17e'))
+        val_str.replace('e', format(np.exp(1), '.17e'))
+        scan_values.append(hrlist2list(val_str))
+
+    time_window = kwargs.pop('time_window')
+    fused = kwargs.pop('fused')
+    num_threads = kwargs.pop('num_threads')
+    batch_size = kwargs.pop('batch_size')
+    incremental = kwargs.pop('incremental')
+    do_coarsen_hits = kwargs.pop('coarsen_hits')
+    server = kwargs.pop('server')
+    authkey = kwargs.pop('authkey')
+
+    llh_client = None
+    if server is not None:
+        # Tables are resident in the server; nothing to load here
+        print('Connecting to likelihood server at "{}"'.format(server))
+        t0 = time.time()
+        llh_client = LLHClient(address=server, authkey=authkey)
+        hypo_handler, dom_tables, tdi_table = None, None, None
+        metric = None # set per event below
+        incremental = False
+
+    else:
+        # -- Instantiate hypo class with kernels -- #
+        print('Instantiating hypo object & kernels')
+        t0 = time.time()
+
+        hypo_handler = setup_hypo_handler(kwargs)
+
+        print('  -> {:.3f} s\n'.format(time.time() - t0))
+
+        # -- Instantiate tables class and load tables -- #
+        print('Instantiating tables object and loading single-DOM tables')
+        t0 = time.time()
+
+        dom_tables, tdi_table = setup_dom_tables(kwargs)
+
+        if fused:
+            print('Stacking tables')
+            dom_tables.stack_tables()
+            if incremental:
+                metric = None # set per event below
+                batch_size = None
+            elif batch_size is None:
+                metric = get_neg_llh_fused
+            else:
+                metric = get_neg_llh_batch
+        else:
+            metric = get_neg_llh
+            batch_size = None
+            incremental = False
+
     print('  -> {:.3f} s\n'.format(time.time() - t0))
 
     # -- Load hits -- #
@@ -302,13 +550,15 @@ def scan_neg_llh():
     stop_event_idx = None if n_events is None else start_event_idx + n_events
     events_slice = slice(start_event_idx, stop_event_idx)
 
-    # Keyword args for the `metric` callable (get_neg_llh)
+    # Keyword args for the `metric` callable (get_neg_llh*)
     metric_kw = dict(
         time_window=time_window,
         hypo_handler=hypo_handler,
         dom_tables=dom_tables,
         tdi_table=tdi_table
     )
+    if fused:
+        metric_kw['num_threads'] = num_threads
 
     print('  -> {:.3f} s\n'.format(time.time() - t0))
 
@@ -319,28 +569,64 @@ def scan_neg_llh():
     for event_ofst, event_hits in enumerate(hits[events_slice]):
         event_idx = start_event_idx + event_ofst
         t1 = time.time()
-        if hits_are_photons:
-            # For photons, we assign a "charge" from their weight, which comes
-            # from angsens model.
-            event_photons = event_hits
-            event_hits = OrderedDict()
-            for str_dom, pinfo in event_photons.items():
-                t = pinfo[0, :]
-                coszen = pinfo[4, :]
-                weight = np.float32(dom_tables.angsens_poly(coszen))
-                event_hits[str_dom] = np.concatenate(
-                    (t[np.newaxis, :], weight[np.newaxis, :]),
-                    axis=0
+        if llh_client is not None:
+            # Photon conversion and hit coarsening happen in the server
+            event_info = llh_client.set_event(
+                hits=event_hits,
+                time_window=time_window,
+                hits_are_photons=hits_are_photons,
+                coarsen=do_coarsen_hits
+            )
+            if do_coarsen_hits:
+                print('  merged {:d} hits'.format(event_info['num_merged']))
+            if batch_size is None:
+                metric = llh_client.get_neg_llh
+            else:
+                metric = llh_client.get_neg_llh_batch
+            metric_vals = scan(
+                scan_values=scan_values,
+                metric=metric,
+                batch_size=batch_size
+            )
+
+        else:
+            if hits_are_photons:
+                # For photons, we assign a "charge" from their weight, which
+                # comes from angsens model.
+                event_hits = photons_to_hits(
+                    event_hits, dom_tables.angsens_poly
                 )
 
-        metric_kw['hits'] = event_hits
+            # Convert hits to flat arrays once per event (not per hypothesis)
+            metric_kw['hits'] = prepare_hits(event_hits)
+            if do_coarsen_hits:
+                metric_kw['hits'], num_merged = coarsen_hits(
+                    hits=metric_kw['hits'],
+                    binning_info=dom_tables.pexp_meta['binning_info']
+                )
+                print('  merged {:d} hits'.format(num_merged))
 
-        # Perform the actual scan
-        metric_vals = scan(
-            scan_values=scan_values,
-            metric=get_neg_llh,
-            metric_kw=metric_kw
-        )
+            # Look up per-DOM constants once per event
+            metric_kw['hits'] = get_event_context(
+                hits=metric_kw['hits'],
+                time_window=time_window,
+                dom_tables=dom_tables
+            )
+
+            # Perform the actual scan
+            if incremental:
+                incremental_neg_llh = IncrementalNegLLH(**metric_kw)
+                metric_vals = scan(
+                    scan_values=scan_values,
+                    metric=incremental_neg_llh.get_neg_llh
+                )
+            else:
+                metric_vals = scan(
+                    scan_values=scan_values,
+                    metric=metric,
+                    metric_kw=metric_kw,
+                    batch_size=batch_size
+                )
 
         metrics.append(metric_vals)
 
@@ -348,6 +634,13 @@ def scan_neg_llh():
         n_points = metric_vals.size
         print('  ---> {:.3f} s, {:d} points ({:.3f} ms per LLH)'
               .format(dt, n_points, dt/n_points*1e3))
+        if hypo_handler is not None:
+            for cache_name, stats in hypo_handler.get_cache_stats().items():
+                print('  {} cache: {:d} hits, {:d} misses'
+                      .format(cache_name, stats['hits'], stats['misses']))
+
+    if llh_client is not None:
+        llh_client.close()
 
     kwargs.pop('hits')
     info = OrderedDict([
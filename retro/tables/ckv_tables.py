@@ -30,6 +30,7 @@ See the License for the specific language governing permissions and
 limitations under the License.'''
 
 from collections import OrderedDict
+import json
 from os.path import abspath, basename, dirname, isfile, join
 import sys
 from time import time
@@ -42,6 +43,7 @@ if __name__ == '__main__' and __package__ is None:
         sys.path.append(RETRO_DIR)
 from retro import DEBUG
 from retro.utils.misc import expand, wstderr
+from retro.utils.quant import QUANT_INFO_FNAME
 
 
 CKV_TABLE_KEYS = [
@@ -77,6 +79,10 @@ def load_ckv_table(fpath, mmap):
         - 'deltaphidir_bin_edges' :
         - 'ckv_table' : np.ndarray
         - 't_indep_ckv_table' : np.ndarray (if available)
+        - 'table_layout' : str (if recorded; see
+          `retro.tables.pexp_5d.TABLE_LAYOUTS`)
+        - 'quantization' : OrderedDict (if the tables hold codes written by
+          `retro/tables/quantize_table.py`; see `retro.utils.quant`)
 
     """
     fpath = expand(fpath)
@@ -119,6 +125,17 @@ def load_ckv_table(fpath, mmap):
         if DEBUG:
             wstderr(' ({} ms)\n'.format(np.round((time() - t1)*1e3, 3)))
 
+    # Tables transformed to a non-default axis order record their layout
+    fpath = join(indir, 'table_layout.npy')
+    if isfile(fpath):
+        table['table_layout'] = str(np.load(fpath))
+
+    # Quantized tables record their encoding and per-table scales
+    fpath = join(indir, QUANT_INFO_FNAME)
+    if isfile(fpath):
+        with open(fpath, 'r') as fobj:
+            table['quantization'] = json.load(fobj, object_pairs_hook=OrderedDict)
+
     if DEBUG:
         wstderr('  Total time to load: {} s\n'.format(np.round(time() - t0, 3)))
 
@@ -223,6 +223,8 @@ def load_clsim_table_minimal(fpath, step_length=None, mmap=False):
         - 't_bin_edges' :
         - 'costhetadir_bin_edges' :
         - 'deltaphidir_bin_edges' :
+        - 'table_layout' : str (if recorded; see
+          `retro.tables.pexp_5d.TABLE_LAYOUTS`)
 
     """
     table = OrderedDict()
@@ -253,6 +255,10 @@ def load_clsim_table_minimal(fpath, step_length=None, mmap=False):
                 )
             if DEBUG:
                 wstderr(' ({} ms)\n'.format(np.round((time() - t1)*1e3, 3)))
+        # Tables transformed to a non-default axis order record their layout
+        fpath = join(indir, 'table_layout.npy')
+        if isfile(fpath):
+            table['table_layout'] = str(np.load(fpath))
         if step_length is not None and 'step_length' in table:
             assert step_length == table['step_length']
         if DEBUG:
@@ -10,7 +10,21 @@ from __future__ import absolute_import, division, print_function
 
 __all__ = '''
     MACHINE_EPS
+    CONE_LOOKUP_CKV_TOL
+    PEXP_COUNTERS
+    PRECISIONS
+    TABLE_LAYOUTS
+    DFLT_TABLE_LAYOUT
+    SRC_GEOM_DTYPE
+    T_HIST_MIN_HITS
+    T_HIST_MIN_HITS_PER_CLUSTER
+    kahan_add
     generate_pexp_5d_function
+    generate_src_geometry_function
+    generate_pexp_5d_dom_functions
+    generate_pexp_5d_all_doms_function
+    generate_neg_llh_bounded_function
+    generate_pexp_5d_batch_function
 '''.split()
 
 __author__ = 'P. Eller, J.L. Lanfranchi'
@@ -40,19 +54,110 @@ if __name__ == '__main__' and __package__ is None:
     if RETRO_DIR not in sys.path:
         sys.path.append(RETRO_DIR)
 from retro import DFLT_NUMBA_JIT_KWARGS, numba_jit
-from retro.const import PI
+from retro.const import COS_CKV, PI
 from retro.utils.ckv import (
-    survival_prob_from_cone, survival_prob_from_smeared_cone
+    get_cone_lookup, survival_prob_from_cone, survival_prob_from_smeared_cone
 )
 from retro.utils.geom import infer_power
+from retro.utils.quant import get_dequant_lut
 
 
 MACHINE_EPS = 1e-16
 
+CONE_LOOKUP_CKV_TOL = 1e-5
+"""Sources whose Cherenkov cosine (the length of their direction vector)
+differs by more than this from the one the cone lookup was generated for fall
+back to sampling the cone for each lookup"""
+
+PEXP_COUNTERS = (
+    'src_dom_pairs_computed',
+    'src_dom_pairs_culled',
+    'table_lookups',
+    'hits_evaluated',
+)
+"""Names of the work counters the pexp functions optionally accumulate, in
+order of their index in a `counters` array: source-DOM pairs within the
+table's radial range, source-DOM pairs skipped as out of range, table lookups
+(time-dependent and time-independent), and source-hit pairs within the
+table's time range"""
+
+(
+    CNT_SRC_DOM_PAIRS_COMPUTED, CNT_SRC_DOM_PAIRS_CULLED, CNT_TABLE_LOOKUPS,
+    CNT_HITS_EVALUATED
+) = range(len(PEXP_COUNTERS))
+
+T_HIST_MIN_HITS = 8
+"""Minimum hits in a DOM to consider the time-histogram strategy"""
+
+T_HIST_MIN_HITS_PER_CLUSTER = 2
+"""Minimum average hits per cluster (hits within a table time bin of one
+another) to use the time-histogram strategy"""
+
+PRECISIONS = ('double', 'single')
+"""Floating-point precisions the pexp functions can compute in. In "single"
+mode, source-DOM geometry, bin-index arithmetic, and accumulation are done in
+float32, with sums accumulated via Kahan compensated summation to limit the
+loss of precision; results are still returned as float64."""
+
+TABLE_LAYOUTS = OrderedDict([
+    ('dir_innermost', ('r', 'costheta', 't', 'costhetadir', 'deltaphidir')),
+    ('t_innermost', ('r', 'costheta', 'costhetadir', 'deltaphidir', 't')),
+])
+"""Axis orders of uncompressed time-dependent tables the pexp functions can
+index into. With "t_innermost", the table entries looked up for a source at
+successive hit times are adjacent in memory. Time-independent tables have no
+time axis and are unaffected. See `retro/tables/transform_table_layout.py`."""
+
+DFLT_TABLE_LAYOUT = 'dir_innermost'
+"""Layout of tables as generated; assumed for tables not recording one"""
+
+SRC_GEOM_DTYPE = np.dtype(
+    [
+        ('rhosquared', np.float64),
+        ('cosdeltaphi', np.float64),
+        ('sindeltaphi', np.float64),
+        ('costhetadir_bin_idx', np.int32),
+        ('deltaphidir_bin_idx', np.int32)
+    ]
+)
+"""Geometry of each source relative to a vertical line through a DOM (shared
+by all DOMs with the same x and y coordinates, e.g. those on a string): the
+squared distance in the (x, y) plane and the source direction's (cosine and
+sine of) azimuth relative to the line and its table bin indices. See
+`generate_src_geometry_function`."""
+
+
+@numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+def kahan_add(total, compensation, value):
+    """Add `value` to the running sum `total` using Kahan compensated
+    summation.
+
+    Parameters
+    ----------
+    total : float
+    compensation : float
+        Low-order part lost from `total` in previous additions; start at 0
+    value : float
+        Must have the same precision as `total` and `compensation`
+
+    Returns
+    -------
+    total : float
+    compensation : float
+
+    """
+    y = value - compensation
+    new_total = total + y
+    compensation = (new_total - total) - y
+    return new_total, compensation
+
 
 def generate_pexp_5d_function(
         table, table_kind, compute_t_indep_exp, use_directionality,
-        num_phi_samples=None, ckv_sigma_deg=None
+        num_phi_samples=None, ckv_sigma_deg=None, precision='double',
+        cone_lookup=False, cone_lookup_oversample=1,
+        table_layout=DFLT_TABLE_LAYOUT, quant_encoding=None,
+        quant_dynamic_range=None
     ):
     """Generate a numba-compiled function for computing expected photon counts
     at a DOM, where the table's binning info is used to pre-compute various
@@ -81,6 +186,35 @@ def generate_pexp_5d_function(
         `use_directionality` is False or if you use a Cherenkov table, which
         already has this parameter integrated into it.)
 
+    precision : str in PRECISIONS
+        Precision of the arithmetic within the returned function; if
+        "single", the table norms must be float32 as well
+
+    cone_lookup : bool
+        Precompute the Cherenkov cone's (costhetadir, deltaphidir) bins and
+        weights for cone axes in each directional bin, and look these up for
+        each source rather than sampling the cone for every lookup into a raw
+        table. Note that this approximates each source's direction by its
+        bin. (Irrelevant if `use_directionality` is False or if you use a
+        Cherenkov table.)
+
+    cone_lookup_oversample : int > 0
+        Number of cone axes per dimension averaged within each directional
+        bin when generating the cone lookup
+
+    table_layout : str in TABLE_LAYOUTS
+        Axis order of the (uncompressed) time-dependent table passed to the
+        returned function
+
+    quant_encoding : str in retro.utils.quant.QUANT_ENCODINGS, optional
+        If the (Cherenkov) tables passed to the returned function hold codes
+        produced by `retro/tables/quantize_table.py`, the encoding used;
+        entries are then decoded on lookup. The tables' scales must already
+        be applied to the table norms.
+
+    quant_dynamic_range : float, optional
+        Dynamic range of the quantized tables' encoding
+
     Returns
     -------
     pexp_5d : callable
@@ -101,14 +235,49 @@ def generate_pexp_5d_function(
     tbl_is_templ_compr = table_kind in ['raw_templ_compr', 'ckv_templ_compr']
     assert tbl_is_raw or tbl_is_ckv
 
+    if precision == 'double':
+        ftype = np.float64
+        compensate = False
+    elif precision == 'single':
+        ftype = np.float32
+        compensate = True
+    else:
+        raise ValueError('Unhandled precision "{}"; must be one of {}'
+                         .format(precision, PRECISIONS))
+
     meta = OrderedDict(
         table_kind=table_kind,
         compute_t_indep_exp=compute_t_indep_exp,
         use_directionality=use_directionality,
         num_phi_samples=None if tbl_is_ckv or not use_directionality else num_phi_samples,
         ckv_sigma_deg=None if tbl_is_ckv or not use_directionality else ckv_sigma_deg,
+        precision=precision,
+    )
+    use_cone_lookup = tbl_is_raw and use_directionality and cone_lookup
+    meta['cone_lookup'] = use_cone_lookup
+    meta['cone_lookup_oversample'] = (
+        cone_lookup_oversample if use_cone_lookup else None
     )
 
+    if table_layout not in TABLE_LAYOUTS:
+        raise ValueError('Unhandled table layout "{}"; must be one of {}'
+                         .format(table_layout, list(TABLE_LAYOUTS.keys())))
+    if tbl_is_templ_compr and table_layout != DFLT_TABLE_LAYOUT:
+        raise NotImplementedError(
+            'Template-compressed tables only support table layout "{}"'
+            .format(DFLT_TABLE_LAYOUT)
+        )
+    t_innermost = table_layout == 't_innermost'
+    meta['table_layout'] = table_layout
+
+    quantized = quant_encoding is not None
+    if quantized and table_kind != 'ckv_uncompr':
+        raise NotImplementedError(
+            'Only uncompressed Cherenkov tables can be quantized'
+        )
+    meta['quant_encoding'] = quant_encoding
+    meta['quant_dynamic_range'] = quant_dynamic_range
+
     if num_phi_samples is None:
         num_phi_samples = 0
     if ckv_sigma_deg is None:
@@ -126,9 +295,11 @@ def generate_pexp_5d_function(
     inv_r_power = 1 / r_power
     n_r_bins = len(table['r_bin_edges']) - 1
     table_dr_pwr = (r_max - r_min)**inv_r_power / n_r_bins
+    last_r_bin_idx = n_r_bins - 1
 
     n_costheta_bins = len(table['costheta_bin_edges']) - 1
     table_dcostheta = 2 / n_costheta_bins
+    last_costheta_bin_idx = n_costheta_bins - 1
 
     t_min = np.min(table['t_bin_edges'])
 
@@ -139,6 +310,9 @@ def generate_pexp_5d_function(
     t_max = np.max(table['t_bin_edges'])
     n_t_bins = len(table['t_bin_edges']) - 1
     table_dt = (t_max - t_min) / n_t_bins
+    # Widen the hit-time search window slightly so it can never exclude a hit
+    # that passes the (exact) `dt >= t_max` check due to rounding
+    t_max_window = t_max * (1 + 1e-6)
 
     assert table['costhetadir_bin_edges'][0] == -1
     assert table['costhetadir_bin_edges'][-1] == 1
@@ -164,6 +338,18 @@ def generate_pexp_5d_function(
     )
     meta['binning_info'] = binning_info
 
+    # Constants entering arithmetic with source coordinates take the compute
+    # precision, so as not to promote single-precision operands to double
+    zero = ftype(0)
+    one = ftype(1)
+    nan = ftype(np.nan)
+    rsquared_max = ftype(rsquared_max)
+    inv_r_power = ftype(inv_r_power)
+    table_dr_pwr = ftype(table_dr_pwr)
+    table_dcostheta = ftype(table_dcostheta)
+    table_dcosthetadir = ftype(table_dcosthetadir)
+    table_dphidir = ftype(table_dphidir)
+
     random_delta_thetas = np.array([])
     if tbl_is_raw and use_directionality and ckv_sigma_deg > 0:
         rand = np.random.RandomState(0)
@@ -173,9 +359,64 @@ def generate_pexp_5d_function(
             size=num_phi_samples
         )
 
+    if use_cone_lookup:
+        cone_offsets, cone_costhetadir_idx, cone_deltaphidir_idx, cone_weights = (
+            get_cone_lookup(
+                ckv_costheta=COS_CKV,
+                num_phi=num_phi_samples,
+                num_costheta_bins=n_costhetadir_bins,
+                num_deltaphi_bins=n_deltaphidir_bins,
+                oversample=cone_lookup_oversample,
+                delta_thetas=random_delta_thetas if ckv_sigma_deg > 0 else None
+            )
+        )
+        cone_weights = cone_weights.astype(ftype)
+    else:
+        cone_offsets = np.zeros(shape=1, dtype=np.int64)
+        cone_costhetadir_idx = np.zeros(shape=0, dtype=np.uint32)
+        cone_deltaphidir_idx = np.zeros(shape=0, dtype=np.uint32)
+        cone_weights = np.zeros(shape=0, dtype=ftype)
+    cone_ckv_costheta = ftype(COS_CKV)
+    cone_lookup_ckv_tol = ftype(CONE_LOOKUP_CKV_TOL)
+
+    # Table entries are decoded via a lookup table if quantized
+    if quantized:
+        dequant_lut = get_dequant_lut(quant_encoding, quant_dynamic_range)
+
+        @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+        def dequant(value):
+            """Decode a quantized table entry"""
+            return dequant_lut[value]
+
+        @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+        def dir_mean(dir_table):
+            """Mean of a (costhetadir, deltaphidir) slice of a quantized
+            table"""
+            total = 0.0
+            for costhetadir_idx in range(dir_table.shape[0]):
+                for deltaphidir_idx in range(dir_table.shape[1]):
+                    total += dequant_lut[
+                        dir_table[costhetadir_idx, deltaphidir_idx]
+                    ]
+            return ftype(total / (dir_table.shape[0] * dir_table.shape[1]))
+
+    else:
+        @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+        def dequant(value):
+            """Table entries are not quantized"""
+            return value
+
+        @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+        def dir_mean(dir_table):
+            """Mean of a (costhetadir, deltaphidir) slice of a table"""
+            return np.mean(dir_table)
+
     empty_1d_array = np.array([], dtype=np.float32).reshape((0,))
     empty_2d_array = np.array([], dtype=np.float32).reshape((0,)*2)
+    empty_3d_array = np.array([], dtype=np.float32).reshape((0,)*3)
     empty_4d_array = np.array([], dtype=np.float32).reshape((0,)*4)
+    empty_counters = np.zeros(shape=0, dtype=np.int64)
+    empty_src_geom = np.zeros(shape=0, dtype=SRC_GEOM_DTYPE)
 
     docstr = """For a set of generated photons `sources`, compute the expected
         photons in a particular DOM at `hit_time` and the total expected
@@ -197,7 +438,8 @@ def generate_pexp_5d_function(
 
         hit_times : shape (num_hits,) array of dtype float64, units of ns
             Time at which the DOM recorded a hit (or multiple simultaneous
-            hits). Use np.nan to indicate no hit occurred.
+            hits), sorted in ascending order. Use np.nan (which must sort to
+            the end) to indicate no hit occurred.
 
         dom_coord : shape (3,) array
             DOM (x, y, z) coordinate in meters (in terms of the IceCube
@@ -211,15 +453,21 @@ def generate_pexp_5d_function(
             Time-dependent photon survival probability table. If using an
             uncompressed table, this will have shape
                 (n_r, n_costheta, n_t, n_costhetadir, n_deltaphidir)
-            while if you use a template-compressed table, this will have shape
+            (or axes ordered otherwise as per `table_layout`) while if you use
+            a template-compressed table, this will have shape
                 (n_templates, n_costhetadir, n_deltaphidir)
 
         table_norm : shape (n_r, n_t) array
             Normalization to apply to `table`, which is assumed to depend on
             both r- and t-dimensions and therefore is an array.
 
-        table_map : shape (n_templates, n_costhetadir, n_deltaphidir) array, optional
-            Only used if `table_kind` is template-compressed
+        table_map : array, optional
+            If `table_kind` is template-compressed, the map from (r, costheta,
+            t) bins to templates. If uncompressed, either an empty array or
+            the table averaged over directions, of shape
+                (n_r, n_costheta, n_t)
+            which is then used for isotropic sources (the template weights
+            serve this purpose for template-compressed tables).
 
         t_indep_table : array, optional
             Time-independent photon survival probability table. If using an
@@ -232,7 +480,13 @@ def generate_pexp_5d_function(
             already have been applied to generate the t_indep_table).
 
         t_indep_table_map : array, optional
-            Only used if `table_kind` is template-compressed.
+            If `table_kind` is template-compressed, the map from (r, costheta)
+            bins to templates. If uncompressed, either an empty array or
+            `t_indep_table` averaged over directions, of shape
+                (n_r, n_costheta)
+
+        counters : shape (len(PEXP_COUNTERS),) array of int64, optional
+            If provided, work done is added to these counters
 
         Returns
         -------
@@ -247,6 +501,26 @@ def generate_pexp_5d_function(
 
         """
 
+    @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+    def use_time_histogram(sources, hit_times):
+        """Choose the strategy for computing expectations at the hit times.
+
+        The per-hit strategy does one table lookup per source per hit. The
+        time-histogram strategy does one lookup per source per occupied time
+        bin, accumulating each onto a per-DOM histogram over the (sorted)
+        hits from which all hits' expectations are gathered at the end. The
+        latter pays off for DOMs whose hits cluster within a table time bin.
+
+        """
+        num_hits = hit_times.shape[0]
+        if num_hits < T_HIST_MIN_HITS or sources.shape[0] < 2:
+            return False
+        num_clusters = 1
+        for hit_t_idx in range(1, num_hits):
+            if hit_times[hit_t_idx] - hit_times[hit_t_idx - 1] >= table_dt:
+                num_clusters += 1
+        return num_hits >= T_HIST_MIN_HITS_PER_CLUSTER * num_clusters
+
     @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
     def pexp_5d_uncompr(
             sources,
@@ -255,55 +529,109 @@ def generate_pexp_5d_function(
             quantum_efficiency,
             table,
             table_norm,
+            table_map=empty_3d_array,
             t_indep_table=empty_4d_array,
             t_indep_table_norm=empty_1d_array,
+            t_indep_table_map=empty_2d_array,
+            counters=empty_counters,
+            src_geom=empty_src_geom
         ):
-        # Initialize accumulators (using double precision)
-        exp_p_at_all_times = np.float64(0.0)
-        exp_p_at_hit_times = np.zeros_like(hit_times, dtype=np.float64)
+        # Initialize accumulators (in the compute precision), along with the
+        # running compensations used for Kahan summation in single precision
+        exp_p_at_all_times = zero
+        comp_at_all_times = zero
+        exp_p_at_hit_times = np.zeros(shape=hit_times.shape, dtype=ftype)
+        if compensate:
+            comp_at_hit_times = np.zeros(shape=hit_times.shape, dtype=ftype)
+        else:
+            comp_at_hit_times = np.zeros(shape=0, dtype=ftype)
+
+        # Work counters
+        num_pairs_computed = 0
+        num_pairs_culled = 0
+        num_lookups = 0
+        num_hits_evaluated = 0
+
+        use_t_hist = use_time_histogram(sources, hit_times)
+        num_hits = hit_times.shape[0]
+        # The histogram is kept in double precision regardless of `ftype`:
+        # contributions are added at one hit and subtracted at a later one,
+        # and in single precision the residual left by a large early
+        # contribution can swamp (or turn negative) the small expectations
+        # at later hits
+        if use_t_hist:
+            t_hist_diff = np.zeros(shape=num_hits + 1, dtype=np.float64)
+        else:
+            t_hist_diff = np.zeros(shape=0, dtype=np.float64)
 
         # Initialize "prev_*" vars
         prev_r_bin_idx = -1
         prev_costheta_bin_idx = -1
 
-        pdir_rhosquared = np.nan
-        pdir_rho = np.nan
-        pdir_rsquared = np.nan
-        pdir_r = np.nan
+        pdir_rhosquared = nan
+        pdir_rho = nan
+        pdir_rsquared = nan
+        pdir_r = nan
 
         if use_directionality:
-            prev_pdir_rsquared = np.nan
+            prev_pdir_rsquared = nan
         else:
             new_pdir_r = False
 
+        # Direction-averaged tables, if provided, give isotropic sources'
+        # survival probabilities with a single lookup
+        use_dir_avg = table_map.shape[0] > 0
+        use_t_indep_dir_avg = t_indep_table_map.shape[0] > 0
+
         # Initialize cached values to nan since it's a bug if these are not
         # computed at least the first time through and this will help ensure
         # that such a bug shows itself
-        r_t_bin_norm = np.nan
+        r_t_bin_norm = nan
 
         # Extract the components of the DOM coordinate
-        dom_x = dom_coord[0]
-        dom_y = dom_coord[1]
-        dom_z = dom_coord[2]
+        dom_x = ftype(dom_coord[0])
+        dom_y = ftype(dom_coord[1])
+        dom_z = ftype(dom_coord[2])
+
+        # Geometry relative to the DOM's string can be passed in, having been
+        # computed once for all DOMs on the string
+        use_src_geom = src_geom.shape[0] > 0
+        dx = zero
+        dy = zero
 
         # Loop over the entries (one per row)
-        for source in sources:
-            dx = dom_x - source.x
-            dy = dom_y - source.y
+        for src_idx in range(sources.shape[0]):
+            source = sources[src_idx]
+            if use_src_geom:
+                rhosquared = ftype(src_geom[src_idx].rhosquared)
+            else:
+                dx = dom_x - source.x
+                dy = dom_y - source.y
+                rhosquared = dx*dx + dy*dy
             dz = dom_z - source.z
-
-            rhosquared = dx*dx + dy*dy
             rsquared = rhosquared + dz*dz
 
             # Continue if photon is outside the radial binning limits
             if rsquared >= rsquared_max:
+                num_pairs_culled += 1
                 continue
 
+            num_pairs_computed += 1
+            if compute_t_indep_exp:
+                num_lookups += 1
+
             source_photons = source.photons
+            src_uses_cone_lookup = False
 
             r = math.sqrt(rsquared)
+            # Rounding (especially in single precision) can put sources just
+            # inside r_max or at costheta = -1 past the last bin
             r_bin_idx = int(r**inv_r_power / table_dr_pwr)
-            costheta_bin_idx = int((1 - dz/r) / table_dcostheta)
+            if r_bin_idx > last_r_bin_idx:
+                r_bin_idx = last_r_bin_idx
+            costheta_bin_idx = int((one - dz/r) / table_dcostheta)
+            if costheta_bin_idx > last_costheta_bin_idx:
+                costheta_bin_idx = last_costheta_bin_idx
 
             if r_bin_idx == prev_r_bin_idx:
                 new_r_bin = False
@@ -334,9 +662,14 @@ def generate_pexp_5d_function(
 
             if pdir_rsquared == 0.0: # isotropic emitter
                 if compute_t_indep_exp and (new_pdir_r or new_r_bin or new_costheta_bin):
-                    t_indep_surv_prob = np.mean(
-                        t_indep_table[r_bin_idx, costheta_bin_idx, :, :]
-                    )
+                    if use_t_indep_dir_avg:
+                        t_indep_surv_prob = (
+                            t_indep_table_map[r_bin_idx, costheta_bin_idx]
+                        )
+                    else:
+                        t_indep_surv_prob = dir_mean(
+                            t_indep_table[r_bin_idx, costheta_bin_idx, :, :]
+                        )
 
             elif pdir_rsquared < 1.0: # Cherenkov emitter
                 # Note that for these tables, we have to invert the photon
@@ -348,31 +681,76 @@ def generate_pexp_5d_function(
                 # Zenith angle is indep. of photon position relative to DOM
                 pdir_costheta = pdir_z / pdir_r
 
-                rho = math.sqrt(rhosquared)
-
-                # \Delta\phi depends on photon position relative to the DOM...
-
-                # Below is the projection of pdir into the (x, y) plane and the
-                # projection of that onto the vector in that plane connecting
-                # the photon source to the DOM. We get the cosine of the angle
-                # between these vectors by solving the identity
-                #   `a dot b = |a| |b| cos(deltaphi)`
-                # for cos(deltaphi).
-                #
-                if pdir_rho <= MACHINE_EPS or rho <= MACHINE_EPS:
-                    pdir_cosdeltaphi = 1.0
-                    pdir_sindeltaphi = 0.0
+                if use_src_geom:
+                    pdir_cosdeltaphi = ftype(src_geom[src_idx].cosdeltaphi)
+                    pdir_sindeltaphi = ftype(src_geom[src_idx].sindeltaphi)
                 else:
-                    pdir_cosdeltaphi = (
-                        pdir_x/pdir_rho * dx/rho + pdir_y/pdir_rho * dy/rho
+                    rho = math.sqrt(rhosquared)
+
+                    # \Delta\phi depends on photon position relative to the DOM...
+
+                    # Below is the projection of pdir into the (x, y) plane and the
+                    # projection of that onto the vector in that plane connecting
+                    # the photon source to the DOM. We get the cosine of the angle
+                    # between these vectors by solving the identity
+                    #   `a dot b = |a| |b| cos(deltaphi)`
+                    # for cos(deltaphi).
+                    #
+                    if pdir_rho <= MACHINE_EPS or rho <= MACHINE_EPS:
+                        pdir_cosdeltaphi = one
+                        pdir_sindeltaphi = zero
+                    else:
+                        pdir_cosdeltaphi = (
+                            pdir_x/pdir_rho * dx/rho + pdir_y/pdir_rho * dy/rho
+                        )
+                        # Note that the max and min here here in case numerical
+                        # precision issues cause the dot product to blow up.
+                        pdir_cosdeltaphi = min(one, max(-one, pdir_cosdeltaphi))
+                        if tbl_is_raw:
+                            pdir_sindeltaphi = math.sqrt(one - pdir_cosdeltaphi*pdir_cosdeltaphi)
+
+                if use_cone_lookup:
+                    src_uses_cone_lookup = (
+                        abs(pdir_r - cone_ckv_costheta) <= cone_lookup_ckv_tol
                     )
-                    # Note that the max and min here here in case numerical
-                    # precision issues cause the dot product to blow up.
-                    pdir_cosdeltaphi = min(1, max(-1, pdir_cosdeltaphi))
-                    if tbl_is_raw:
-                        pdir_sindeltaphi = math.sqrt(1 - pdir_cosdeltaphi*pdir_cosdeltaphi)
 
-                if tbl_is_raw:
+                if tbl_is_ckv or src_uses_cone_lookup:
+                    if use_src_geom:
+                        costhetadir_bin_idx = src_geom[src_idx].costhetadir_bin_idx
+                        deltaphidir_bin_idx = src_geom[src_idx].deltaphidir_bin_idx
+                    else:
+                        costhetadir_bin_idx = int((pdir_costheta + one) / table_dcosthetadir)
+
+                        # Make upper edge inclusive
+                        if costhetadir_bin_idx > last_costhetadir_bin_idx:
+                            costhetadir_bin_idx = last_costhetadir_bin_idx
+
+                        pdir_deltaphi = math.acos(pdir_cosdeltaphi)
+                        deltaphidir_bin_idx = int(pdir_deltaphi / table_dphidir)
+
+                        # Make upper edge inclusive
+                        if deltaphidir_bin_idx > last_deltaphidir_bin_idx:
+                            deltaphidir_bin_idx = last_deltaphidir_bin_idx
+
+                if src_uses_cone_lookup:
+                    # Bins and weights sampling the cone about this axis bin
+                    cone_axis_idx = (
+                        costhetadir_bin_idx * n_deltaphidir_bins
+                        + deltaphidir_bin_idx
+                    )
+                    cone_start = cone_offsets[cone_axis_idx]
+                    cone_stop = cone_offsets[cone_axis_idx + 1]
+                    if compute_t_indep_exp:
+                        t_indep_surv_prob = zero
+                        for cone_idx in range(cone_start, cone_stop):
+                            t_indep_surv_prob += cone_weights[cone_idx] * t_indep_table[
+                                r_bin_idx,
+                                costheta_bin_idx,
+                                cone_costhetadir_idx[cone_idx],
+                                cone_deltaphidir_idx[cone_idx]
+                            ]
+
+                elif tbl_is_raw:
                     pdir_sintheta = pdir_rho / pdir_r
 
                     # Cherenkov angle is encoded as the projection of a
@@ -399,7 +777,7 @@ def generate_pexp_5d_function(
                                 random_delta_thetas=random_delta_thetas
                             )
                     else:
-                        ckv_sintheta = math.sqrt(1 - ckv_costheta*ckv_costheta)
+                        ckv_sintheta = math.sqrt(one - ckv_costheta*ckv_costheta)
                         if compute_t_indep_exp:
                             t_indep_surv_prob, _a, _b = survival_prob_from_cone( # pylint: disable=unused-variable, invalid-name
                                 costheta=ckv_costheta,
@@ -417,25 +795,12 @@ def generate_pexp_5d_function(
                             )
 
                 else: # tbl_is_ckv
-                    costhetadir_bin_idx = int((pdir_costheta + 1.0) / table_dcosthetadir)
-
-                    # Make upper edge inclusive
-                    if costhetadir_bin_idx > last_costhetadir_bin_idx:
-                        costhetadir_bin_idx = last_costhetadir_bin_idx
-
-                    pdir_deltaphi = math.acos(pdir_cosdeltaphi)
-                    deltaphidir_bin_idx = int(pdir_deltaphi / table_dphidir)
-
-                    # Make upper edge inclusive
-                    if deltaphidir_bin_idx > last_deltaphidir_bin_idx:
-                        deltaphidir_bin_idx = last_deltaphidir_bin_idx
-
-                    t_indep_surv_prob = t_indep_table[
+                    t_indep_surv_prob = dequant(t_indep_table[
                         r_bin_idx,
                         costheta_bin_idx,
                         costhetadir_bin_idx,
                         deltaphidir_bin_idx
-                    ]
+                    ])
 
             elif pdir_rsquared == 1.0:
                 if tbl_is_raw:
@@ -450,14 +815,34 @@ def generate_pexp_5d_function(
                     raise ValueError('Gaussian emitter cannot be computed with ckv table')
 
             if compute_t_indep_exp:
-                exp_p_at_all_times += (
+                exp_p = ftype(
                     source_photons * t_indep_table_norm[r_bin_idx] * t_indep_surv_prob
                 )
+                if compensate:
+                    exp_p_at_all_times, comp_at_all_times = kahan_add(
+                        exp_p_at_all_times, comp_at_all_times, exp_p
+                    )
+                else:
+                    exp_p_at_all_times += exp_p
+
+            # Hits are sorted in time, so only visit those in the window
+            # [source_t, source_t + t_max] (NaN hit times sort to the end)
+            source_t = source.t
+            hit_start = np.searchsorted(hit_times, source_t)
+            hit_stop = np.searchsorted(
+                hit_times, source_t + t_max_window, side='right'
+            )
+            group_stop = hit_start
+            for hit_t_idx in range(hit_start, hit_stop):
+                # In time-histogram mode, skip hits already accounted for as
+                # sharing a time bin with an earlier hit
+                if hit_t_idx < group_stop:
+                    continue
+
+                hit_t = hit_times[hit_t_idx]
 
-            for hit_t_idx, hit_t in enumerate(hit_times):
                 # Causally impossible? (Note the comparison is written such that it
                 # will evaluate to True if hit_time is NaN.)
-                source_t = source.t
                 if not source_t <= hit_t:
                     continue
 
@@ -473,15 +858,67 @@ def generate_pexp_5d_function(
 
                 t_bin_idx = int(dt / table_dt)
 
+                # All hits in the same time bin (relative to the source) get
+                # the same expectation
+                if use_t_hist:
+                    group_stop = hit_t_idx + np.searchsorted(
+                        hit_times[hit_t_idx:hit_stop],
+                        source_t + (t_bin_idx + 1) * table_dt
+                    )
+                    group_stop = max(group_stop, hit_t_idx + 1)
+                    num_hits_evaluated += group_stop - hit_t_idx
+                else:
+                    num_hits_evaluated += 1
+                num_lookups += 1
+
                 r_t_bin_norm = table_norm[r_bin_idx, t_bin_idx]
 
                 if pdir_r == 0.0: # isotropic emitter
-                    surv_prob_at_hit_t = np.mean(
-                        table[r_bin_idx, costheta_bin_idx, t_bin_idx, :, :]
-                    )
+                    if use_dir_avg:
+                        surv_prob_at_hit_t = (
+                            table_map[r_bin_idx, costheta_bin_idx, t_bin_idx]
+                        )
+                    elif t_innermost:
+                        surv_prob_at_hit_t = dir_mean(
+                            table[r_bin_idx, costheta_bin_idx, :, :, t_bin_idx]
+                        )
+                    else:
+                        surv_prob_at_hit_t = dir_mean(
+                            table[r_bin_idx, costheta_bin_idx, t_bin_idx, :, :]
+                        )
 
                 elif pdir_r < 1.0: # Cherenkov emitter
-                    if tbl_is_raw:
+                    if src_uses_cone_lookup and t_innermost:
+                        surv_prob_at_hit_t = zero
+                        for cone_idx in range(cone_start, cone_stop):
+                            surv_prob_at_hit_t += cone_weights[cone_idx] * table[
+                                r_bin_idx,
+                                costheta_bin_idx,
+                                cone_costhetadir_idx[cone_idx],
+                                cone_deltaphidir_idx[cone_idx],
+                                t_bin_idx
+                            ]
+
+                    elif src_uses_cone_lookup:
+                        surv_prob_at_hit_t = zero
+                        for cone_idx in range(cone_start, cone_stop):
+                            surv_prob_at_hit_t += cone_weights[cone_idx] * table[
+                                r_bin_idx,
+                                costheta_bin_idx,
+                                t_bin_idx,
+                                cone_costhetadir_idx[cone_idx],
+                                cone_deltaphidir_idx[cone_idx]
+                            ]
+
+                    elif tbl_is_raw:
+                        if t_innermost:
+                            dir_survival_prob = (
+                                table[r_bin_idx, costheta_bin_idx, :, :, t_bin_idx]
+                            )
+                        else:
+                            dir_survival_prob = (
+                                table[r_bin_idx, costheta_bin_idx, t_bin_idx, :, :]
+                            )
                         if ckv_sigma_deg > 0:
                             surv_prob_at_hit_t, _c, _d = survival_prob_from_smeared_cone( # pylint: disable=unused-variable, invalid-name
                                 theta=ckv_theta,
@@ -490,9 +927,7 @@ def generate_pexp_5d_function(
                                 rot_sintheta=pdir_sintheta,
                                 rot_cosphi=pdir_cosdeltaphi,
                                 rot_sinphi=pdir_sindeltaphi,
-                                directional_survival_prob=(
-                                    table[r_bin_idx, costheta_bin_idx, t_bin_idx, :, :]
-                                ),
+                                directional_survival_prob=dir_survival_prob,
                                 num_costheta_bins=n_costhetadir_bins,
                                 num_deltaphi_bins=n_deltaphidir_bins,
                                 random_delta_thetas=random_delta_thetas
@@ -506,21 +941,28 @@ def generate_pexp_5d_function(
                                 rot_sintheta=pdir_sintheta,
                                 rot_cosphi=pdir_cosdeltaphi,
                                 rot_sinphi=pdir_sindeltaphi,
-                                directional_survival_prob=(
-                                    table[r_bin_idx, costheta_bin_idx, t_bin_idx, :, :]
-                                ),
+                                directional_survival_prob=dir_survival_prob,
                                 num_costheta_bins=n_costhetadir_bins,
                                 num_deltaphi_bins=n_deltaphidir_bins,
                             )
 
+                    elif t_innermost: # tbl_is_ckv
+                        surv_prob_at_hit_t = dequant(table[
+                            r_bin_idx,
+                            costheta_bin_idx,
+                            costhetadir_bin_idx,
+                            deltaphidir_bin_idx,
+                            t_bin_idx
+                        ])
+
                     else: # tbl_is_ckv
-                        surv_prob_at_hit_t = table[
+                        surv_prob_at_hit_t = dequant(table[
                             r_bin_idx,
                             costheta_bin_idx,
                             t_bin_idx,
                             costhetadir_bin_idx,
                             deltaphidir_bin_idx
-                        ]
+                        ])
 
                 elif pdir_r == 1.0:
                     if tbl_is_raw:
@@ -542,14 +984,44 @@ def generate_pexp_5d_function(
                             'Gaussian emitter cannot be computed with ckv table'
                         )
 
-                exp_p_at_hit_times[hit_t_idx] += (
+                exp_p_at_t_bin = ftype(
                     source_photons * r_t_bin_norm * surv_prob_at_hit_t
                 )
+                if use_t_hist:
+                    t_hist_diff[hit_t_idx] += exp_p_at_t_bin
+                    t_hist_diff[group_stop] -= exp_p_at_t_bin
+                elif compensate:
+                    exp_p_at_hit_times[hit_t_idx], comp_at_hit_times[hit_t_idx] = kahan_add(
+                        exp_p_at_hit_times[hit_t_idx],
+                        comp_at_hit_times[hit_t_idx],
+                        exp_p_at_t_bin
+                    )
+                else:
+                    exp_p_at_hit_times[hit_t_idx] += exp_p_at_t_bin
+
+        if use_t_hist:
+            exp_p_at_t_hist = 0.0
+            for hit_t_idx in range(num_hits):
+                exp_p_at_t_hist += t_hist_diff[hit_t_idx]
+                # A sum of non-negative contributions; clamp away the
+                # rounding residual of contributions that have ended
+                exp_p_at_hit_times[hit_t_idx] = ftype(max(exp_p_at_t_hist, 0.0))
+
+        # Results are returned in double precision regardless
+        qe_exp_p_at_hit_times = (
+            quantum_efficiency * exp_p_at_hit_times.astype(np.float64)
+        )
+        qe_exp_p_at_all_times = (
+            quantum_efficiency * np.float64(exp_p_at_all_times)
+        )
 
-        exp_p_at_hit_times = quantum_efficiency * exp_p_at_hit_times
-        exp_p_at_all_times = quantum_efficiency * exp_p_at_all_times
+        if counters.shape[0] > 0:
+            counters[CNT_SRC_DOM_PAIRS_COMPUTED] += num_pairs_computed
+            counters[CNT_SRC_DOM_PAIRS_CULLED] += num_pairs_culled
+            counters[CNT_TABLE_LOOKUPS] += num_lookups
+            counters[CNT_HITS_EVALUATED] += num_hits_evaluated
 
-        return exp_p_at_all_times, exp_p_at_hit_times
+        return qe_exp_p_at_all_times, qe_exp_p_at_hit_times
 
     @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
     def pexp_5d_templ_compr(
@@ -562,47 +1034,95 @@ def generate_pexp_5d_function(
             table_map,
             t_indep_table=empty_4d_array,
             t_indep_table_norm=empty_1d_array,
-            t_indep_table_map=empty_2d_array
+            t_indep_table_map=empty_2d_array,
+            counters=empty_counters,
+            src_geom=empty_src_geom
         ):
-        # Initialize accumulators (using double precision)
-        exp_p_at_all_times = np.float64(0.0)
-        exp_p_at_hit_times = np.zeros_like(hit_times, dtype=np.float64)
+        # Initialize accumulators (in the compute precision), along with the
+        # running compensations used for Kahan summation in single precision
+        exp_p_at_all_times = zero
+        comp_at_all_times = zero
+        exp_p_at_hit_times = np.zeros(shape=hit_times.shape, dtype=ftype)
+        if compensate:
+            comp_at_hit_times = np.zeros(shape=hit_times.shape, dtype=ftype)
+        else:
+            comp_at_hit_times = np.zeros(shape=0, dtype=ftype)
+
+        # Work counters
+        num_pairs_computed = 0
+        num_pairs_culled = 0
+        num_lookups = 0
+        num_hits_evaluated = 0
+
+        use_t_hist = use_time_histogram(sources, hit_times)
+        num_hits = hit_times.shape[0]
+        # The histogram is kept in double precision regardless of `ftype`:
+        # contributions are added at one hit and subtracted at a later one,
+        # and in single precision the residual left by a large early
+        # contribution can swamp (or turn negative) the small expectations
+        # at later hits
+        if use_t_hist:
+            t_hist_diff = np.zeros(shape=num_hits + 1, dtype=np.float64)
+        else:
+            t_hist_diff = np.zeros(shape=0, dtype=np.float64)
 
         # Initialize "prev_*" vars
         prev_r_bin_idx = -1
         prev_costheta_bin_idx = -1
         if use_directionality:
-            prev_pdir_r = np.nan
+            prev_pdir_r = nan
         else:
-            pdir_r = 0.0
+            pdir_r = zero
             new_pdir_r = False
 
         # Initialize cached values to nan since it's a bug if these are not
         # computed at least the first time through and this will help ensure
         # that such a bug shows itself
-        r_t_bin_norm = np.nan
+        r_t_bin_norm = nan
 
         # Extract the components of the DOM coordinate
-        dom_x, dom_y, dom_z = dom_coord
+        dom_x = ftype(dom_coord[0])
+        dom_y = ftype(dom_coord[1])
+        dom_z = ftype(dom_coord[2])
+
+        # Geometry relative to the DOM's string can be passed in, having been
+        # computed once for all DOMs on the string
+        use_src_geom = src_geom.shape[0] > 0
+        dx = zero
+        dy = zero
 
         # Loop over the entries (one per row)
-        for source in sources:
-            dx = dom_x - source.x
-            dy = dom_y - source.y
+        for src_idx in range(sources.shape[0]):
+            source = sources[src_idx]
+            if use_src_geom:
+                rhosquared = ftype(src_geom[src_idx].rhosquared)
+            else:
+                dx = dom_x - source.x
+                dy = dom_y - source.y
+                rhosquared = dx*dx + dy*dy
             dz = dom_z - source.z
-
-            rhosquared = dx*dx + dy*dy
             rsquared = rhosquared + dz*dz
 
             # Continue if photon is outside the radial binning limits
             if rsquared >= rsquared_max:
+                num_pairs_culled += 1
                 continue
 
+            num_pairs_computed += 1
+            if compute_t_indep_exp:
+                num_lookups += 1
+
             source_photons = source.photons
 
             r = math.sqrt(rsquared)
+            # Rounding (especially in single precision) can put sources just
+            # inside r_max or at costheta = -1 past the last bin
             r_bin_idx = int(r**inv_r_power / table_dr_pwr)
-            costheta_bin_idx = int((1 - dz/r) / table_dcostheta)
+            if r_bin_idx > last_r_bin_idx:
+                r_bin_idx = last_r_bin_idx
+            costheta_bin_idx = int((one - dz/r) / table_dcostheta)
+            if costheta_bin_idx > last_costheta_bin_idx:
+                costheta_bin_idx = last_costheta_bin_idx
 
             if r_bin_idx == prev_r_bin_idx:
                 new_r_bin = False
@@ -649,39 +1169,44 @@ def generate_pexp_5d_function(
                 # Zenith angle is indep. of photon position relative to DOM
                 pdir_costheta = pdir_z / pdir_r
 
-                rho = math.sqrt(rhosquared)
-
-                # \Delta\phi depends on photon position relative to the DOM...
-
-                # Below is the projection of pdir into the (x, y) plane and the
-                # projection of that onto the vector in that plane connecting
-                # the photon source to the DOM. We get the cosine of the angle
-                # between these vectors by solving the identity
-                #   `a dot b = |a| |b| cos(deltaphi)`
-                # for cos(deltaphi).
-                #
-                if pdir_rho <= MACHINE_EPS or rho <= MACHINE_EPS:
-                    pdir_cosdeltaphi = 1.0
+                if use_src_geom:
+                    pdir_cosdeltaphi = ftype(src_geom[src_idx].cosdeltaphi)
+                    costhetadir_bin_idx = src_geom[src_idx].costhetadir_bin_idx
+                    deltaphidir_bin_idx = src_geom[src_idx].deltaphidir_bin_idx
                 else:
-                    pdir_cosdeltaphi = (
-                        pdir_x/pdir_rho * dx/rho + pdir_y/pdir_rho * dy/rho
-                    )
-                    # Note that the max and min here here in case numerical
-                    # precision issues cause the dot product to blow up.
-                    pdir_cosdeltaphi = min(1, max(-1, pdir_cosdeltaphi))
+                    rho = math.sqrt(rhosquared)
+
+                    # \Delta\phi depends on photon position relative to the DOM...
+
+                    # Below is the projection of pdir into the (x, y) plane and the
+                    # projection of that onto the vector in that plane connecting
+                    # the photon source to the DOM. We get the cosine of the angle
+                    # between these vectors by solving the identity
+                    #   `a dot b = |a| |b| cos(deltaphi)`
+                    # for cos(deltaphi).
+                    #
+                    if pdir_rho <= MACHINE_EPS or rho <= MACHINE_EPS:
+                        pdir_cosdeltaphi = one
+                    else:
+                        pdir_cosdeltaphi = (
+                            pdir_x/pdir_rho * dx/rho + pdir_y/pdir_rho * dy/rho
+                        )
+                        # Note that the max and min here here in case numerical
+                        # precision issues cause the dot product to blow up.
+                        pdir_cosdeltaphi = min(one, max(-one, pdir_cosdeltaphi))
 
-                costhetadir_bin_idx = int((pdir_costheta + 1) / table_dcosthetadir)
+                    costhetadir_bin_idx = int((pdir_costheta + one) / table_dcosthetadir)
 
-                # Make upper edge inclusive
-                if costhetadir_bin_idx > last_costhetadir_bin_idx:
-                    costhetadir_bin_idx = last_costhetadir_bin_idx
+                    # Make upper edge inclusive
+                    if costhetadir_bin_idx > last_costhetadir_bin_idx:
+                        costhetadir_bin_idx = last_costhetadir_bin_idx
 
-                pdir_deltaphi = math.acos(pdir_cosdeltaphi)
-                deltaphidir_bin_idx = int(pdir_deltaphi / table_dphidir)
+                    pdir_deltaphi = math.acos(pdir_cosdeltaphi)
+                    deltaphidir_bin_idx = int(pdir_deltaphi / table_dphidir)
 
-                # Make upper edge inclusive
-                if deltaphidir_bin_idx > last_deltaphidir_bin_idx:
-                    deltaphidir_bin_idx = last_deltaphidir_bin_idx
+                    # Make upper edge inclusive
+                    if deltaphidir_bin_idx > last_deltaphidir_bin_idx:
+                        deltaphidir_bin_idx = last_deltaphidir_bin_idx
 
                 ti_templ = t_indep_table_map[r_bin_idx, costheta_bin_idx]
                 t_indep_surv_prob = (
@@ -700,14 +1225,34 @@ def generate_pexp_5d_function(
                 raise ValueError('Gaussian emitter cannot be computed with ckv table')
 
             if compute_t_indep_exp:
-                exp_p_at_all_times += (
+                exp_p = ftype(
                     source_photons * t_indep_table_norm[r_bin_idx] * t_indep_surv_prob
                 )
+                if compensate:
+                    exp_p_at_all_times, comp_at_all_times = kahan_add(
+                        exp_p_at_all_times, comp_at_all_times, exp_p
+                    )
+                else:
+                    exp_p_at_all_times += exp_p
+
+            # Hits are sorted in time, so only visit those in the window
+            # [source_t, source_t + t_max] (NaN hit times sort to the end)
+            source_t = source.t
+            hit_start = np.searchsorted(hit_times, source_t)
+            hit_stop = np.searchsorted(
+                hit_times, source_t + t_max_window, side='right'
+            )
+            group_stop = hit_start
+            for hit_t_idx in range(hit_start, hit_stop):
+                # In time-histogram mode, skip hits already accounted for as
+                # sharing a time bin with an earlier hit
+                if hit_t_idx < group_stop:
+                    continue
+
+                hit_t = hit_times[hit_t_idx]
 
-            for hit_t_idx, hit_t in enumerate(hit_times):
                 # Causally impossible? (Note the comparison is written such that it
                 # will evaluate to True if hit_time is NaN.)
-                source_t = source.t
                 if not source_t <= hit_t:
                     continue
 
@@ -723,6 +1268,19 @@ def generate_pexp_5d_function(
 
                 t_bin_idx = int(dt / table_dt)
 
+                # All hits in the same time bin (relative to the source) get
+                # the same expectation
+                if use_t_hist:
+                    group_stop = hit_t_idx + np.searchsorted(
+                        hit_times[hit_t_idx:hit_stop],
+                        source_t + (t_bin_idx + 1) * table_dt
+                    )
+                    group_stop = max(group_stop, hit_t_idx + 1)
+                    num_hits_evaluated += group_stop - hit_t_idx
+                else:
+                    num_hits_evaluated += 1
+                num_lookups += 1
+
                 r_t_bin_norm = table_norm[r_bin_idx, t_bin_idx]
 
                 if pdir_r == 0.0: # isotropic emitter
@@ -756,14 +1314,44 @@ def generate_pexp_5d_function(
                         'Gaussian emitter cannot be computed with ckv table'
                     )
 
-                exp_p_at_hit_times[hit_t_idx] += (
+                exp_p_at_t_bin = ftype(
                     source_photons * r_t_bin_norm * surv_prob_at_hit_t
                 )
+                if use_t_hist:
+                    t_hist_diff[hit_t_idx] += exp_p_at_t_bin
+                    t_hist_diff[group_stop] -= exp_p_at_t_bin
+                elif compensate:
+                    exp_p_at_hit_times[hit_t_idx], comp_at_hit_times[hit_t_idx] = kahan_add(
+                        exp_p_at_hit_times[hit_t_idx],
+                        comp_at_hit_times[hit_t_idx],
+                        exp_p_at_t_bin
+                    )
+                else:
+                    exp_p_at_hit_times[hit_t_idx] += exp_p_at_t_bin
+
+        if use_t_hist:
+            exp_p_at_t_hist = 0.0
+            for hit_t_idx in range(num_hits):
+                exp_p_at_t_hist += t_hist_diff[hit_t_idx]
+                # A sum of non-negative contributions; clamp away the
+                # rounding residual of contributions that have ended
+                exp_p_at_hit_times[hit_t_idx] = ftype(max(exp_p_at_t_hist, 0.0))
+
+        # Results are returned in double precision regardless
+        qe_exp_p_at_hit_times = (
+            quantum_efficiency * exp_p_at_hit_times.astype(np.float64)
+        )
+        qe_exp_p_at_all_times = (
+            quantum_efficiency * np.float64(exp_p_at_all_times)
+        )
 
-        exp_p_at_hit_times = quantum_efficiency * exp_p_at_hit_times
-        exp_p_at_all_times = quantum_efficiency * exp_p_at_all_times
+        if counters.shape[0] > 0:
+            counters[CNT_SRC_DOM_PAIRS_COMPUTED] += num_pairs_computed
+            counters[CNT_SRC_DOM_PAIRS_CULLED] += num_pairs_culled
+            counters[CNT_TABLE_LOOKUPS] += num_lookups
+            counters[CNT_HITS_EVALUATED] += num_hits_evaluated
 
-        return exp_p_at_all_times, exp_p_at_hit_times
+        return qe_exp_p_at_all_times, qe_exp_p_at_hit_times
 
     if tbl_is_templ_compr:
         pexp_5d = pexp_5d_templ_compr
@@ -773,3 +1361,862 @@ def generate_pexp_5d_function(
     pexp_5d.__doc__ = docstr
 
     return pexp_5d, meta
+
+
+@numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+def no_src_geometry(sources, dom_x, dom_y, src_geom): # pylint: disable=unused-argument
+    """Placeholder for `src_geometry` (see `generate_src_geometry_function`)
+    in compiled code generated without one; does nothing"""
+    pass
+
+
+def generate_src_geometry_function(
+        table_kind, use_directionality, binning_info, cone_lookup=False
+    ):
+    """Generate a numba-compiled function for computing the parts of the
+    source-DOM geometry that depend only on the DOM's x and y coordinates.
+    These are shared by all DOMs on a (vertical) string, so they can be
+    computed once per string rather than once per DOM and passed to the
+    `pexp_5d` function via its `src_geom` argument.
+
+    Parameters
+    ----------
+    table_kind, use_directionality
+        As passed to `generate_pexp_5d_function`
+
+    binning_info : mapping
+        As found in the `meta` returned by `generate_pexp_5d_function`
+
+    cone_lookup : bool
+        Whether the `pexp_5d` function looks up cone maps by directional bin
+        (see `generate_pexp_5d_function`), in which case the directional bin
+        indices are needed for raw tables as well
+
+    Returns
+    -------
+    src_geometry : callable
+
+    """
+    tbl_is_raw = table_kind in ['raw_uncompr', 'raw_templ_compr']
+    skip_dir_bins = tbl_is_raw and not cone_lookup
+
+    r_max = binning_info['r_max']
+    rsquared_max = r_max*r_max
+
+    n_costhetadir_bins = binning_info['n_costhetadir_bins']
+    table_dcosthetadir = np.float64(2 / n_costhetadir_bins)
+    last_costhetadir_bin_idx = n_costhetadir_bins - 1
+
+    n_deltaphidir_bins = binning_info['n_deltaphidir_bins']
+    table_dphidir = np.float64(PI / n_deltaphidir_bins)
+    last_deltaphidir_bin_idx = n_deltaphidir_bins - 1
+
+    @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+    def src_geometry(sources, dom_x, dom_y, src_geom):
+        """Compute the geometry of each source relative to the vertical line
+        through (`dom_x`, `dom_y`).
+
+        Parameters
+        ----------
+        sources : shape (num_sources,) array of dtype SRC_DTYPE
+
+        dom_x, dom_y : float
+
+        src_geom : shape (num_sources,) array of dtype SRC_GEOM_DTYPE
+            Filled in place. The directional fields are only filled for
+            Cherenkov emitters within the table's radial range of the line, as
+            they are not used otherwise.
+
+        """
+        for src_idx in range(sources.shape[0]):
+            source = sources[src_idx]
+            geom = src_geom[src_idx]
+
+            dx = dom_x - source.x
+            dy = dom_y - source.y
+            rhosquared = dx*dx + dy*dy
+            geom.rhosquared = rhosquared
+
+            if not use_directionality or rhosquared >= rsquared_max:
+                continue
+
+            pdir_x = source.dir_x
+            pdir_y = source.dir_y
+            pdir_z = source.dir_z
+            pdir_rhosquared = pdir_x*pdir_x + pdir_y*pdir_y
+            pdir_rsquared = pdir_rhosquared + pdir_z*pdir_z
+            if not 0.0 < pdir_rsquared < 1.0:
+                continue
+
+            # See `pexp_5d` for the derivation of the following
+            pdir_rho = math.sqrt(pdir_rhosquared)
+            rho = math.sqrt(rhosquared)
+            if pdir_rho <= MACHINE_EPS or rho <= MACHINE_EPS:
+                pdir_cosdeltaphi = 1.0
+                pdir_sindeltaphi = 0.0
+            else:
+                pdir_cosdeltaphi = (
+                    pdir_x/pdir_rho * dx/rho + pdir_y/pdir_rho * dy/rho
+                )
+                pdir_cosdeltaphi = min(1.0, max(-1.0, pdir_cosdeltaphi))
+                pdir_sindeltaphi = math.sqrt(1 - pdir_cosdeltaphi*pdir_cosdeltaphi)
+            geom.cosdeltaphi = pdir_cosdeltaphi
+            geom.sindeltaphi = pdir_sindeltaphi
+
+            if skip_dir_bins:
+                continue
+
+            pdir_r = math.sqrt(pdir_rsquared)
+            pdir_costheta = pdir_z / pdir_r
+            costhetadir_bin_idx = int((pdir_costheta + 1.0) / table_dcosthetadir)
+            if costhetadir_bin_idx > last_costhetadir_bin_idx:
+                costhetadir_bin_idx = last_costhetadir_bin_idx
+            geom.costhetadir_bin_idx = costhetadir_bin_idx
+
+            deltaphidir_bin_idx = int(math.acos(pdir_cosdeltaphi) / table_dphidir)
+            if deltaphidir_bin_idx > last_deltaphidir_bin_idx:
+                deltaphidir_bin_idx = last_deltaphidir_bin_idx
+            geom.deltaphidir_bin_idx = deltaphidir_bin_idx
+
+    return src_geometry
+
+
+def generate_pexp_5d_dom_functions(pexp_5d, r_max, src_geometry=None):
+    """Generate numba-compiled functions for computing expected photon counts
+    at one DOM at a time, using tables stacked along a new leading axis (see
+    `Retro5DTables.stack_tables`) and sources prepared once per hypothesis.
+
+    Parameters
+    ----------
+    pexp_5d : callable
+        As returned by `generate_pexp_5d_function`
+
+    r_max : float
+        Radial extent of the tables used by `pexp_5d`. DOMs farther than this
+        from the bounding box of all sources are skipped, as they can receive
+        no light, and each remaining DOM is only passed sources within this
+        distance of it along the axis of the sources' largest extent.
+
+    src_geometry : callable, optional
+        As returned by `generate_src_geometry_function`. If provided,
+        `pexp_5d_dom` computes the sources' geometry relative to the DOM's
+        string when passed a DOM with different x and y coordinates than the
+        previous DOM, and reuses it otherwise.
+
+    Returns
+    -------
+    prepare_sources : callable
+
+    pexp_5d_dom : callable
+
+    """
+    # Add a little margin so culling can never differ from `pexp_5d`'s own
+    # radial cut due to rounding
+    cull_r = r_max * (1 + 1e-6)
+    cull_rsquared = cull_r * cull_r
+
+    use_src_geometry = src_geometry is not None
+    if not use_src_geometry:
+        src_geometry = no_src_geometry
+
+    # Select the row of each stacked table component used by the DOM
+    @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+    def pexp_5d_stacked(
+            sources,
+            hit_times,
+            dom_coord,
+            quantum_efficiency,
+            table_idx,
+            table,
+            table_norm,
+            table_map,
+            t_indep_table,
+            t_indep_table_norm,
+            t_indep_table_map,
+            counters,
+            src_geom
+        ):
+        return pexp_5d(
+            sources,
+            hit_times,
+            dom_coord,
+            quantum_efficiency,
+            table[table_idx],
+            table_norm[table_idx],
+            table_map[table_idx],
+            t_indep_table[table_idx],
+            t_indep_table_norm[table_idx],
+            t_indep_table_map[table_idx],
+            counters,
+            src_geom
+        )
+
+    @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+    def prepare_sources(sources):
+        """Sort sources along the axis of their largest extent (i.e., roughly
+        along a track) so each DOM need only visit the contiguous slab of
+        sources within `r_max` of it along that axis.
+
+        Parameters
+        ----------
+        sources : shape (num_sources,) array of dtype SRC_DTYPE
+
+        Returns
+        -------
+        sorted_sources : shape (num_sources,) array of dtype SRC_DTYPE
+
+        sorted_src_keys : shape (num_sources,) array of float64
+            Coordinate of each sorted source along `sort_axis`
+
+        sort_axis : int in {0, 1, 2}
+
+        src_bbox : shape (6,) array of float64
+            Axis-aligned bounding box of all sources, (x_min, x_max, y_min,
+            y_max, z_min, z_max); empty (min > max) if there are no sources,
+            such that all DOMs are culled
+
+        """
+        src_bbox = np.empty(shape=6, dtype=np.float64)
+        src_bbox[0::2] = np.inf
+        src_bbox[1::2] = -np.inf
+        for source in sources:
+            src_bbox[0] = min(src_bbox[0], source.x)
+            src_bbox[1] = max(src_bbox[1], source.x)
+            src_bbox[2] = min(src_bbox[2], source.y)
+            src_bbox[3] = max(src_bbox[3], source.y)
+            src_bbox[4] = min(src_bbox[4], source.z)
+            src_bbox[5] = max(src_bbox[5], source.z)
+
+        x_extent = src_bbox[1] - src_bbox[0]
+        y_extent = src_bbox[3] - src_bbox[2]
+        z_extent = src_bbox[5] - src_bbox[4]
+        if x_extent >= y_extent and x_extent >= z_extent:
+            sort_axis = 0
+        elif y_extent >= z_extent:
+            sort_axis = 1
+        else:
+            sort_axis = 2
+
+        num_sources = sources.shape[0]
+        src_keys = np.empty(shape=num_sources, dtype=np.float64)
+        for src_idx in range(num_sources):
+            if sort_axis == 0:
+                src_keys[src_idx] = sources[src_idx].x
+            elif sort_axis == 1:
+                src_keys[src_idx] = sources[src_idx].y
+            else:
+                src_keys[src_idx] = sources[src_idx].z
+        src_order = np.argsort(src_keys, kind='mergesort')
+
+        return sources[src_order], src_keys[src_order], sort_axis, src_bbox
+
+    @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+    def pexp_5d_dom(
+            sorted_sources,
+            sorted_src_keys,
+            sort_axis,
+            src_bbox,
+            hit_times,
+            string_idx,
+            dom_idx,
+            time_window,
+            dom_coords,
+            dom_quantum_efficiency,
+            dom_noise_rate_per_ns,
+            dom_table_idx,
+            table,
+            table_norm,
+            table_map,
+            t_indep_table,
+            t_indep_table_norm,
+            t_indep_table_map,
+            exp_p_at_hit_times,
+            counters,
+            src_geom,
+            src_geom_xy
+        ):
+        """Compute the expected photons (including noise) at one DOM.
+
+        Parameters
+        ----------
+        sorted_sources, sorted_src_keys, sort_axis, src_bbox
+            As returned by `prepare_sources`
+
+        hit_times : shape (num_dom_hits,) array of float32, units of ns
+            Sorted in ascending order
+
+        string_idx, dom_idx : int
+            Zero-based indices of the DOM
+
+        time_window, dom_coords, dom_quantum_efficiency, dom_noise_rate_per_ns, dom_table_idx, table, table_norm, table_map, t_indep_table, t_indep_table_norm, t_indep_table_map
+            See `pexp_5d_all_doms`
+
+        exp_p_at_hit_times : shape (num_dom_hits,) array of float64
+            Filled with expected photons at `hit_times`
+
+        counters : shape (len(PEXP_COUNTERS),) or (0,) array of int64
+            Work done is added to these counters unless empty
+
+        src_geom : shape (num_sources,) or (0,) array of dtype SRC_GEOM_DTYPE
+            Geometry of `sorted_sources` relative to the DOM's string, if
+            `src_geometry` was provided (unused otherwise). Computed in place
+            unless `src_geom_xy` shows it is already up to date.
+
+        src_geom_xy : shape (2,) array of float64
+            (x, y) coordinates for which `src_geom` was last computed; updated
+            when it is recomputed. Initialize with NaN.
+
+        Returns
+        -------
+        exp_p_at_all_times : float64
+
+        """
+        table_idx = dom_table_idx[string_idx, dom_idx]
+        if table_idx < 0:
+            exp_p_at_hit_times[:] = 0
+            return 0.0
+
+        noise_rate_per_ns = dom_noise_rate_per_ns[string_idx, dom_idx]
+
+        # Squared distance from the DOM to the sources' bounding box; if no
+        # source can be within range, only noise is expected
+        dom_x = dom_coords[string_idx, dom_idx, 0]
+        dom_y = dom_coords[string_idx, dom_idx, 1]
+        dom_z = dom_coords[string_idx, dom_idx, 2]
+        dx = max(src_bbox[0] - dom_x, 0, dom_x - src_bbox[1])
+        dy = max(src_bbox[2] - dom_y, 0, dom_y - src_bbox[3])
+        dz = max(src_bbox[4] - dom_z, 0, dom_z - src_bbox[5])
+        if dx*dx + dy*dy + dz*dz < cull_rsquared:
+            if sort_axis == 0:
+                dom_key = dom_x
+            elif sort_axis == 1:
+                dom_key = dom_y
+            else:
+                dom_key = dom_z
+            src_start = np.searchsorted(sorted_src_keys, dom_key - cull_r)
+            src_stop = np.searchsorted(
+                sorted_src_keys, dom_key + cull_r, side='right'
+            )
+        else:
+            src_start = src_stop = 0
+
+        if counters.shape[0] > 0:
+            counters[CNT_SRC_DOM_PAIRS_CULLED] += (
+                sorted_sources.shape[0] - (src_stop - src_start)
+            )
+
+        if src_start == src_stop:
+            exp_p_at_hit_times[:] = noise_rate_per_ns
+            return noise_rate_per_ns * time_window
+
+        if use_src_geometry:
+            if dom_x != src_geom_xy[0] or dom_y != src_geom_xy[1]:
+                src_geometry(sorted_sources, dom_x, dom_y, src_geom)
+                src_geom_xy[0] = dom_x
+                src_geom_xy[1] = dom_y
+            dom_src_geom = src_geom[src_start:src_stop]
+        else:
+            dom_src_geom = src_geom[:0]
+
+        dom_exp_p_at_all_times, dom_exp_p_at_hit_times = pexp_5d_stacked(
+            sorted_sources[src_start:src_stop],
+            hit_times,
+            dom_coords[string_idx, dom_idx],
+            dom_quantum_efficiency[string_idx, dom_idx],
+            table_idx,
+            table,
+            table_norm,
+            table_map,
+            t_indep_table,
+            t_indep_table_norm,
+            t_indep_table_map,
+            counters,
+            dom_src_geom
+        )
+
+        for hit_idx in range(hit_times.shape[0]):
+            exp_p_at_hit_times[hit_idx] = (
+                dom_exp_p_at_hit_times[hit_idx] + noise_rate_per_ns
+            )
+
+        return dom_exp_p_at_all_times + noise_rate_per_ns * time_window
+
+    return prepare_sources, pexp_5d_dom
+
+
+def generate_pexp_5d_all_doms_function(pexp_5d, r_max, src_geometry=None):
+    """Generate a numba-compiled function for computing expected photon counts
+    at many DOMs in a single call, using tables stacked along a new leading
+    axis (see `Retro5DTables.stack_tables`).
+
+    Parameters
+    ----------
+    pexp_5d, r_max, src_geometry
+        See `generate_pexp_5d_dom_functions`. The source geometry relative to
+        a string is computed once for all consecutive DOMs on the string (DOMs
+        are ordered by string if `str_dom_idxs` is sorted).
+
+    Returns
+    -------
+    pexp_5d_all_doms : callable
+
+    """
+    prepare_sources, pexp_5d_dom = generate_pexp_5d_dom_functions(
+        pexp_5d=pexp_5d, r_max=r_max, src_geometry=src_geometry
+    )
+    use_src_geometry = src_geometry is not None
+    empty_counters = np.zeros(shape=0, dtype=np.int64)
+
+    @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+    def pexp_5d_all_doms(
+            sources,
+            hit_times,
+            dom_hits_start,
+            str_dom_idxs,
+            time_window,
+            dom_coords,
+            dom_quantum_efficiency,
+            dom_noise_rate_per_ns,
+            dom_table_idx,
+            table,
+            table_norm,
+            table_map,
+            t_indep_table,
+            t_indep_table_norm,
+            t_indep_table_map,
+            counters=empty_counters
+        ):
+        """For a set of generated photons `sources`, compute the expected
+        photons in each of a set of DOMs (including noise) at the times those
+        DOMs were hit, and the total expected photons in each DOM independent
+        of time.
+
+        Parameters
+        ----------
+        sources : shape (num_sources,) array of dtype SRC_DTYPE
+
+        hit_times : shape (num_hits,) array of float32, units of ns
+            Hit times of all DOMs, concatenated in the order of `str_dom_idxs`
+            and sorted in ascending order within each DOM
+
+        dom_hits_start : shape (num_doms + 1,) array of int
+            Hits for the DOM at `str_dom_idxs[i]` are
+            ``hit_times[dom_hits_start[i]:dom_hits_start[i+1]]``
+
+        str_dom_idxs : shape (num_doms, 2) array of int
+            Zero-based (string_idx, dom_idx) of each DOM to compute
+
+        time_window : float, units of ns
+            Time window for computing the "time-independent" noise expectation
+
+        dom_coords : shape (n_strings, n_doms, 3) array
+
+        dom_quantum_efficiency : shape (n_strings, n_doms) array
+
+        dom_noise_rate_per_ns : shape (n_strings, n_doms) array
+
+        dom_table_idx : shape (n_strings, n_doms) array of int
+            Index into the stacked tables for each DOM; DOMs with negative
+            index are considered non-operational and expect 0 photons
+
+        table, table_norm, table_map, t_indep_table, t_indep_table_norm, t_indep_table_map : arrays
+            Tables stacked along a new leading axis
+
+        counters : shape (len(PEXP_COUNTERS),) array of int64, optional
+            If provided, work done is added to these counters
+
+        Returns
+        -------
+        exp_p_at_all_times : shape (num_doms,) array of float64
+
+        exp_p_at_hit_times : shape (num_hits,) array of float64
+
+        """
+        num_doms = str_dom_idxs.shape[0]
+        exp_p_at_all_times = np.zeros(shape=(num_doms,), dtype=np.float64)
+        exp_p_at_hit_times = np.zeros(shape=hit_times.shape, dtype=np.float64)
+
+        sorted_sources, sorted_src_keys, sort_axis, src_bbox = (
+            prepare_sources(sources)
+        )
+        if use_src_geometry:
+            src_geom = np.empty(
+                shape=sorted_sources.shape[0], dtype=SRC_GEOM_DTYPE
+            )
+        else:
+            src_geom = np.empty(shape=0, dtype=SRC_GEOM_DTYPE)
+        src_geom_xy = np.full(shape=2, fill_value=np.nan, dtype=np.float64)
+
+        for i in range(num_doms):
+            start = dom_hits_start[i]
+            stop = dom_hits_start[i + 1]
+            exp_p_at_all_times[i] = pexp_5d_dom(
+                sorted_sources,
+                sorted_src_keys,
+                sort_axis,
+                src_bbox,
+                hit_times[start:stop],
+                str_dom_idxs[i, 0],
+                str_dom_idxs[i, 1],
+                time_window,
+                dom_coords,
+                dom_quantum_efficiency,
+                dom_noise_rate_per_ns,
+                dom_table_idx,
+                table,
+                table_norm,
+                table_map,
+                t_indep_table,
+                t_indep_table_norm,
+                t_indep_table_map,
+                exp_p_at_hit_times[start:stop],
+                counters,
+                src_geom,
+                src_geom_xy
+            )
+
+        return exp_p_at_all_times, exp_p_at_hit_times
+
+    return pexp_5d_all_doms
+
+
+def generate_neg_llh_bounded_function(pexp_5d, binning_info):
+    """Generate a numba-compiled function for computing the negative log
+    likelihood DOM by DOM, aborting as soon as a lower bound on the final
+    value exceeds a threshold.
+
+    Parameters
+    ----------
+    pexp_5d : callable
+        See `generate_pexp_5d_dom_functions`
+
+    binning_info : mapping
+        As in the `meta` returned along with `pexp_5d`
+
+    Returns
+    -------
+    neg_llh_bounded : callable
+
+    """
+    r_max = binning_info['r_max']
+    prepare_sources, pexp_5d_dom = generate_pexp_5d_dom_functions(
+        pexp_5d=pexp_5d, r_max=r_max
+    )
+    empty_counters = np.zeros(shape=0, dtype=np.int64)
+
+    # Radial binning, as in `generate_pexp_5d_function`
+    assert binning_info['r_min'] == 0
+    inv_r_power = 1 / binning_info['r_power']
+    n_r_bins = binning_info['n_r_bins']
+    table_dr_pwr = r_max**inv_r_power / n_r_bins
+    last_r_bin_idx = n_r_bins - 1
+
+    @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+    def neg_llh_bounded(
+            sources,
+            hit_times,
+            hit_charges,
+            dom_hits_start,
+            str_dom_idxs,
+            time_window,
+            dom_order,
+            threshold,
+            neg_llh_offset,
+            count_exp_p_at_all_times,
+            max_exp_p_per_photon_by_r,
+            dom_coords,
+            dom_quantum_efficiency,
+            dom_noise_rate_per_ns,
+            dom_table_idx,
+            table,
+            table_norm,
+            table_map,
+            t_indep_table,
+            t_indep_table_norm,
+            t_indep_table_map,
+            counters=empty_counters
+        ):
+        """Compute the negative log likelihood, visiting DOMs in `dom_order`
+        and stopping once it is guaranteed to exceed `threshold`.
+
+        A DOM not yet computed contributes at least its noise expectation
+        (if `count_exp_p_at_all_times`) minus, for each hit, the charge times
+        the log of the largest expectation possible: noise plus quantum
+        efficiency times all photons times the largest expectation per photon
+        in any radial bin at or beyond the DOM's distance to the sources'
+        bounding box (nothing beyond noise if that distance exceeds the
+        tables' extent).
+
+        Parameters
+        ----------
+        sources, hit_times, dom_hits_start, str_dom_idxs, time_window
+            See `pexp_5d_all_doms`
+
+        hit_charges : shape (num_hits,) array of float32
+
+        dom_order : shape (num_doms,) array of int
+            Order in which to compute DOMs (indices into `str_dom_idxs`)
+
+        threshold : float
+            Stop once the lower bound on the negative log likelihood exceeds
+            this
+
+        neg_llh_offset : float
+            Added to the negative log likelihood (e.g. a time- and
+            DOM-independent expectation computed elsewhere)
+
+        count_exp_p_at_all_times : bool
+            Whether to add each DOM's expectation at all times
+
+        max_exp_p_per_photon_by_r : shape (n_r_bins,) array of float64
+            Upper bound on the expected photons at a hit time per source
+            photon (before quantum efficiency) for sources in each radial bin
+            or any farther bin (i.e., non-increasing)
+
+        dom_coords, dom_quantum_efficiency, dom_noise_rate_per_ns, dom_table_idx, table, table_norm, table_map, t_indep_table, t_indep_table_norm, t_indep_table_map, counters
+            See `pexp_5d_all_doms`
+
+        Returns
+        -------
+        neg_llh : float64
+            Negative log likelihood if `complete`, otherwise a lower bound on
+            it that exceeds `threshold`
+
+        complete : bool
+
+        num_doms_computed : int
+
+        """
+        num_doms = str_dom_idxs.shape[0]
+
+        total_photons = 0.0
+        for source in sources:
+            total_photons += source.photons
+
+        sorted_sources, sorted_src_keys, sort_axis, src_bbox = (
+            prepare_sources(sources)
+        )
+
+        # Lower bound on each DOM's contribution, summed over the DOMs not
+        # yet computed (in `dom_order`)
+        remaining_bound = np.zeros(shape=num_doms + 1, dtype=np.float64)
+        for n in range(num_doms - 1, -1, -1):
+            i = dom_order[n]
+            string_idx = str_dom_idxs[i, 0]
+            dom_idx = str_dom_idxs[i, 1]
+            if dom_table_idx[string_idx, dom_idx] < 0:
+                noise_rate_per_ns = 0.0
+                max_exp_p = 0.0
+            else:
+                noise_rate_per_ns = dom_noise_rate_per_ns[string_idx, dom_idx]
+                max_exp_p = noise_rate_per_ns
+
+                # No source is closer to the DOM than the sources' bounding
+                # box, so only radial bins from there outwards are reachable
+                dom_x = dom_coords[string_idx, dom_idx, 0]
+                dom_y = dom_coords[string_idx, dom_idx, 1]
+                dom_z = dom_coords[string_idx, dom_idx, 2]
+                dx = max(src_bbox[0] - dom_x, 0, dom_x - src_bbox[1])
+                dy = max(src_bbox[2] - dom_y, 0, dom_y - src_bbox[3])
+                dz = max(src_bbox[4] - dom_z, 0, dom_z - src_bbox[5])
+                # Margin so rounding in `pexp_5d` (possibly in single
+                # precision) cannot yield a closer bin
+                min_r = math.sqrt(dx*dx + dy*dy + dz*dz) * (1 - 1e-5)
+                if min_r < r_max:
+                    r_bin_idx = int(min_r**inv_r_power / table_dr_pwr)
+                    if r_bin_idx > last_r_bin_idx:
+                        r_bin_idx = last_r_bin_idx
+                    max_exp_p += (
+                        dom_quantum_efficiency[string_idx, dom_idx]
+                        * max_exp_p_per_photon_by_r[r_bin_idx] * total_photons
+                    )
+            bound = 0.0
+            if count_exp_p_at_all_times:
+                bound += noise_rate_per_ns * time_window
+            for hit_idx in range(dom_hits_start[i], dom_hits_start[i + 1]):
+                bound -= hit_charges[hit_idx] * np.log(max_exp_p)
+            remaining_bound[n] = remaining_bound[n + 1] + bound
+
+        neg_llh = neg_llh_offset
+        if neg_llh + remaining_bound[0] > threshold:
+            return neg_llh + remaining_bound[0], False, 0
+
+        exp_p_at_hit_times = np.empty(shape=hit_times.shape, dtype=np.float64)
+
+        # DOMs are visited in order of their bounds rather than by string, so
+        # the source geometry is not shared between them
+        src_geom = np.empty(shape=0, dtype=SRC_GEOM_DTYPE)
+        src_geom_xy = np.full(shape=2, fill_value=np.nan, dtype=np.float64)
+
+        for n in range(num_doms):
+            i = dom_order[n]
+            start = dom_hits_start[i]
+            stop = dom_hits_start[i + 1]
+            exp_p_at_all_times = pexp_5d_dom(
+                sorted_sources,
+                sorted_src_keys,
+                sort_axis,
+                src_bbox,
+                hit_times[start:stop],
+                str_dom_idxs[i, 0],
+                str_dom_idxs[i, 1],
+                time_window,
+                dom_coords,
+                dom_quantum_efficiency,
+                dom_noise_rate_per_ns,
+                dom_table_idx,
+                table,
+                table_norm,
+                table_map,
+                t_indep_table,
+                t_indep_table_norm,
+                t_indep_table_map,
+                exp_p_at_hit_times[start:stop],
+                counters,
+                src_geom,
+                src_geom_xy
+            )
+            if count_exp_p_at_all_times:
+                neg_llh += exp_p_at_all_times
+            for hit_idx in range(start, stop):
+                neg_llh -= (
+                    hit_charges[hit_idx] * np.log(exp_p_at_hit_times[hit_idx])
+                )
+
+            if n + 1 < num_doms and neg_llh + remaining_bound[n + 1] > threshold:
+                return neg_llh + remaining_bound[n + 1], False, n + 1
+
+        return neg_llh, True, num_doms
+
+    return neg_llh_bounded
+
+
+def generate_pexp_5d_batch_function(pexp_5d_all_doms, precision='double'):
+    """Generate a numba-compiled function for computing, for each of a batch
+    of hypotheses, the sums over DOMs and hits that enter the likelihood.
+
+    Parameters
+    ----------
+    pexp_5d_all_doms : callable
+        As returned by `generate_pexp_5d_all_doms_function`
+
+    precision : str in PRECISIONS
+        Precision in which the sums are accumulated (using Kahan summation if
+        "single")
+
+    Returns
+    -------
+    pexp_5d_batch : callable
+
+    """
+    if precision == 'double':
+        ftype = np.float64
+        compensate = False
+    elif precision == 'single':
+        ftype = np.float32
+        compensate = True
+    else:
+        raise ValueError('Unhandled precision "{}"; must be one of {}'
+                         .format(precision, PRECISIONS))
+    zero = ftype(0)
+
+    @numba_jit(**DFLT_NUMBA_JIT_KWARGS)
+    def pexp_5d_batch(
+            sources,
+            hypo_sources_start,
+            hit_times,
+            hit_charges,
+            dom_hits_start,
+            str_dom_idxs,
+            time_window,
+            dom_coords,
+            dom_quantum_efficiency,
+            dom_noise_rate_per_ns,
+            dom_table_idx,
+            table,
+            table_norm,
+            table_map,
+            t_indep_table,
+            t_indep_table_norm,
+            t_indep_table_map
+        ):
+        """For each hypothesis in a batch, compute the total expected photons
+        (including noise) summed over DOMs and the charge-weighted sum of the
+        log of expected photons at the hit times.
+
+        Parameters
+        ----------
+        sources : shape (num_sources,) array of dtype SRC_DTYPE
+            Sources of all hypotheses, concatenated
+
+        hypo_sources_start : shape (num_hypos + 1,) array of int
+            Sources for hypothesis `i` are
+            ``sources[hypo_sources_start[i]:hypo_sources_start[i+1]]``
+
+        hit_times : shape (num_hits,) array of float32, units of ns
+
+        hit_charges : shape (num_hits,) array of float32
+
+        dom_hits_start, str_dom_idxs, time_window, dom_coords, dom_quantum_efficiency, dom_noise_rate_per_ns, dom_table_idx, table, table_norm, table_map, t_indep_table, t_indep_table_norm, t_indep_table_map
+            See `pexp_5d_all_doms`
+
+        Returns
+        -------
+        sum_exp_p_at_all_times : shape (num_hypos,) array of float64
+
+        sum_log_exp_p_at_hit_times : shape (num_hypos,) array of float64
+
+        """
+        num_hypos = hypo_sources_start.shape[0] - 1
+        sum_exp_p_at_all_times = np.zeros(shape=num_hypos, dtype=np.float64)
+        sum_log_exp_p_at_hit_times = np.zeros(
+            shape=num_hypos, dtype=np.float64
+        )
+
+        for hypo_idx in range(num_hypos):
+            exp_p_at_all_times, exp_p_at_hit_times = pexp_5d_all_doms(
+                sources[hypo_sources_start[hypo_idx]:
+                        hypo_sources_start[hypo_idx + 1]],
+                hit_times,
+                dom_hits_start,
+                str_dom_idxs,
+                time_window,
+                dom_coords,
+                dom_quantum_efficiency,
+                dom_noise_rate_per_ns,
+                dom_table_idx,
+                table,
+                table_norm,
+                table_map,
+                t_indep_table,
+                t_indep_table_norm,
+                t_indep_table_map
+            )
+
+            if compensate:
+                sum_all = zero
+                comp_all = zero
+                for dom_idx in range(exp_p_at_all_times.shape[0]):
+                    sum_all, comp_all = kahan_add(
+                        sum_all, comp_all, ftype(exp_p_at_all_times[dom_idx])
+                    )
+                sum_exp_p_at_all_times[hypo_idx] = sum_all
+            else:
+                sum_exp_p_at_all_times[hypo_idx] = np.sum(exp_p_at_all_times)
+
+            sum_log = zero
+            comp_log = zero
+            for hit_idx in range(hit_times.shape[0]):
+                log_term = ftype(
+                    hit_charges[hit_idx]
+                    * math.log(ftype(exp_p_at_hit_times[hit_idx]))
+                )
+                if compensate:
+                    sum_log, comp_log = kahan_add(sum_log, comp_log, log_term)
+                else:
+                    sum_log += log_term
+            sum_log_exp_p_at_hit_times[hypo_idx] = sum_log
+
+        return sum_exp_p_at_all_times, sum_log_exp_p_at_hit_times
+
+    return pexp_5d_batch
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position, redefined-outer-name
+
+"""
+Quantize a Cherenkov table (and its time-independent counterpart) to 8- or
+16-bit codes (see `retro.utils.quant.QUANT_ENCODINGS`), shrinking it by a
+factor of 2 or 4 relative to float32 and correspondingly reducing the memory
+traffic of table lookups.
+
+The quantized table is written in .npy-files-in-a-directory format along with
+a "quantization.json" file recording the encoding, its dynamic range, and each
+table's scale; `load_ckv_table` reads this so that `Retro5DTables` decodes the
+codes within the compiled functions, with each table's scale folded into its
+normalization. Use `retro/validate_quantization.py` to check the resulting
+likelihoods against those from the original table.
+
+The table is quantized one radial bin at a time into a memory-mapped output
+file, so tables larger than the available memory can be quantized.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = [
+    'quantize_table',
+    'parse_args'
+]
+
+__author__ = 'J.L. Lanfranchi'
+__license__ = '''Copyright 2017 Justin L. Lanfranchi
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.'''
+
+from argparse import ArgumentParser
+from collections import Mapping, OrderedDict
+import json
+from os.path import abspath, dirname, join
+import sys
+import time
+
+import numpy as np
+
+if __name__ == '__main__' and __package__ is None:
+    RETRO_DIR = dirname(dirname(dirname(abspath(__file__))))
+    if RETRO_DIR not in sys.path:
+        sys.path.append(RETRO_DIR)
+from retro.tables.ckv_tables import CKV_TABLE_KEYS, load_ckv_table
+from retro.utils.misc import expand, mkdir
+from retro.utils.quant import (
+    DFLT_DYNAMIC_RANGE, QUANT_ENCODINGS, QUANT_INFO_FNAME, get_quant_dtype,
+    get_quant_scale, quantize
+)
+
+QUANTIZED_TABLE_NAMES = ['ckv_table', 't_indep_ckv_table']
+
+
+def quantize_table(
+        table, encoding, outdir, dynamic_range=DFLT_DYNAMIC_RANGE,
+        mmap_src=True
+    ):
+    """Write a Cherenkov table to disk with its tables quantized.
+
+    Parameters
+    ----------
+    table : string or mapping
+        If string, path to Cherenkov table directory. A mapping is assumed to
+        be a table loaded as by `load_ckv_table`.
+
+    encoding : string in QUANT_ENCODINGS
+
+    outdir : string
+        Directory to which the quantized table is written
+
+    dynamic_range : float in (0, 1)
+        Smallest non-zero value, relative to each table's maximum, that log
+        encodings represent
+
+    mmap_src : bool
+        Whether to memory map the source table
+
+    Returns
+    -------
+    outdir : string
+
+    """
+    if encoding not in QUANT_ENCODINGS:
+        raise ValueError('Unhandled encoding "{}"; must be one of {}'
+                         .format(encoding, QUANT_ENCODINGS))
+
+    if not isinstance(table, Mapping):
+        table = load_ckv_table(fpath=expand(table), mmap=mmap_src)
+
+    if 'quantization' in table:
+        raise ValueError('Table is already quantized')
+
+    outdir = expand(outdir)
+    mkdir(outdir)
+    print('Quantizing table with encoding "{}" in "{}"'
+          .format(encoding, outdir))
+    t0 = time.time()
+
+    dtype = get_quant_dtype(encoding)
+    scales = OrderedDict()
+    for table_name in QUANTIZED_TABLE_NAMES:
+        if table_name not in table:
+            continue
+        src = table[table_name]
+        scale = get_quant_scale(src)
+        scales[table_name] = scale
+        dst = np.lib.format.open_memmap(
+            join(outdir, table_name + '.npy'), mode='w+', dtype=dtype,
+            shape=src.shape
+        )
+        for r_idx in range(src.shape[0]):
+            dst[r_idx] = quantize(
+                src[r_idx], encoding=encoding, scale=scale,
+                dynamic_range=dynamic_range
+            )
+        dst.flush()
+        del dst
+
+    for key in CKV_TABLE_KEYS:
+        if key in QUANTIZED_TABLE_NAMES or key not in table:
+            continue
+        np.save(join(outdir, key + '.npy'), table[key])
+    if 'table_layout' in table:
+        np.save(
+            join(outdir, 'table_layout.npy'), np.array(table['table_layout'])
+        )
+
+    quant_info = OrderedDict([
+        ('encoding', encoding),
+        ('dynamic_range', dynamic_range),
+        ('scales', scales),
+    ])
+    with open(join(outdir, QUANT_INFO_FNAME), 'w') as fobj:
+        json.dump(quant_info, fobj, indent=2)
+
+    print('  -> {:.3f} s'.format(time.time() - t0))
+
+    return outdir
+
+
+def parse_args(description=__doc__):
+    """Parse command line arguments"""
+    parser = ArgumentParser(description=description)
+    parser.add_argument(
+        '--table', required=True,
+        help='''Cherenkov npy-table directory'''
+    )
+    parser.add_argument(
+        '--encoding', choices=QUANT_ENCODINGS, required=True,
+        help='''Encoding of the quantized table.'''
+    )
+    parser.add_argument(
+        '--dynamic-range', type=float, default=DFLT_DYNAMIC_RANGE,
+        help='''Smallest non-zero value, relative to each table's maximum,
+        representable by log encodings; smaller values are stored as zero.'''
+    )
+    parser.add_argument(
+        '--outdir', required=True,
+        help='''Directory in which to store the quantized table.'''
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    outdir = quantize_table(**vars(parse_args())) # pylint: disable=invalid-name
@@ -12,7 +12,11 @@ __all__ = [
     'TABLE_NORM_KEYS',
     'TABLE_KINDS',
     'NORM_VERSIONS',
+    'PYRAMID_LEVEL_DIR_PROTO',
+    'PYRAMID_INFO_FNAME',
     'Retro5DTables',
+    'get_dir_avg_table',
+    'get_pyramid_level_fpath',
     'get_table_norm',
 ]
 
@@ -31,7 +35,10 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.'''
 
-from os.path import abspath, dirname
+import json
+from multiprocessing.pool import ThreadPool
+from os.path import abspath, dirname, isfile, join
+import re
 import sys
 
 import numpy as np
@@ -45,8 +52,15 @@ from retro.const import (
     SPEED_OF_LIGHT_M_PER_NS, PI, TWO_PI
 )
 from retro.i3info.angsens_model import load_angsens_model
-from retro.tables.pexp_5d import generate_pexp_5d_function
+from retro.tables.pexp_5d import (
+    DFLT_TABLE_LAYOUT, PRECISIONS, TABLE_LAYOUTS,
+    generate_neg_llh_bounded_function, generate_pexp_5d_function,
+    generate_pexp_5d_all_doms_function, generate_pexp_5d_batch_function,
+    generate_src_geometry_function
+)
 from retro.utils.geom import spherical_volume
+from retro.utils.misc import expand
+from retro.utils.quant import get_dequant_lut
 
 
 TABLE_NORM_KEYS = [
@@ -64,6 +78,13 @@ NORM_VERSIONS = [
     'binvol6', 'binvol7', 'pde', 'wtf', 'wtf2'
 ]
 
+PYRAMID_LEVEL_DIR_PROTO = 'pyramid_level{level:d}'
+"""Name of the directory (within a table's directory) holding a downsampled
+version of the table; see `retro/tables/table_pyramid.py`"""
+
+PYRAMID_INFO_FNAME = 'pyramid_info.json'
+"""File within a pyramid level directory recording how it was generated"""
+
 
 class Retro5DTables(object):
     """
@@ -113,11 +134,49 @@ class Retro5DTables(object):
         `ckv_sigma_deg` could necessitate higher `num_phi_samples` to get an
         accurate "smearing."
 
+    pyramid_level : int >= 0
+        Load this level of each table's coarse-to-fine pyramid (generated by
+        `retro/tables/table_pyramid.py`) rather than the table itself. Level 0
+        is the full-resolution table. Likelihoods at different levels are
+        computed with separate `Retro5DTables` objects.
+
+    precision : str in PRECISIONS
+        Precision of the arithmetic in the compiled pexp and likelihood-sum
+        functions. In "single" mode, table norms are stored as float32 and
+        sums use Kahan compensated summation; see
+        `retro/validate_precision.py` for checking the resulting likelihoods
+        against "double".
+
+    cone_lookup : bool
+        If using directionality with raw tables, precompute the Cherenkov cone
+        map for each (costhetadir, deltaphidir) bin of the cone axis when the
+        first table is loaded, and look it up rather than sampling the cone
+        for every source and hit.
+
+    cone_lookup_oversample : int > 0
+        Number of cone axes per dimension averaged within each directional
+        bin when generating the cone lookup.
+
+    dir_avg : bool
+        When loading each uncompressed table, also compute it (and its
+        time-independent counterpart) averaged over the directional
+        dimensions, so that expectations from isotropic sources take a single
+        lookup rather than a mean over all directional bins. These are stored
+        in place of the template maps used by template-compressed tables.
+
+    Notes
+    -----
+    Cherenkov tables quantized by `retro/tables/quantize_table.py` are loaded
+    as-is (as 8- or 16-bit codes) and decoded within the compiled functions;
+    each table's scale is folded into its normalization.
+
     """
     def __init__(
             self, table_kind, geom, rde, noise_rate_hz, angsens_model,
             compute_t_indep_exp, use_directionality, norm_version,
-            num_phi_samples=None, ckv_sigma_deg=None
+            num_phi_samples=None, ckv_sigma_deg=None, pyramid_level=0,
+            precision='double', cone_lookup=False, cone_lookup_oversample=1,
+            dir_avg=False
         ):
         self.angsens_poly, self.avg_angsens = load_angsens_model(angsens_model)
         self.angsens_model = angsens_model
@@ -151,6 +210,21 @@ class Retro5DTables(object):
         self.ckv_sigma_deg = ckv_sigma_deg
         self.norm_version = norm_version
 
+        if pyramid_level > 0 and self.tbl_is_templ_compr:
+            raise NotImplementedError(
+                'Table pyramids are not implemented for template-compressed'
+                ' tables'
+            )
+        self.pyramid_level = pyramid_level
+
+        if precision not in PRECISIONS:
+            raise ValueError('Unhandled precision "{}"; must be one of {}'
+                             .format(precision, PRECISIONS))
+        self.precision = precision
+        self.cone_lookup = cone_lookup
+        self.cone_lookup_oversample = cone_lookup_oversample
+        self.dir_avg = dir_avg
+
         zero_mask = rde == 0
         nan_mask = np.isnan(rde)
         inf_mask = np.isinf(rde)
@@ -180,6 +254,17 @@ class Retro5DTables(object):
         self.pexp_func = None
         self.pexp_meta = None
 
+        self.table_stack = None
+        self.dom_table_idx = None
+        self.dom_params = None
+        self.pexp_all_doms_func = None
+        self.pexp_batch_func = None
+        self.neg_llh_bounded_func = None
+        self.max_exp_p_per_photon_by_r = None
+        self.dequant_lut = None
+        self.thread_pool = None
+        self.thread_pool_size = 0
+
     def load_table(self, fpath, string, dom, mmap, step_length=None):
         """Load a table into the set of tables.
 
@@ -187,7 +272,9 @@ class Retro5DTables(object):
         ----------
         fpath : string
             Path to the table .fits file or table directory (in the case of the
-            Retro-formatted directory with .npy files).
+            Retro-formatted directory with .npy files). If `pyramid_level` is
+            nonzero, the corresponding pyramid level of this table is loaded
+            instead.
 
         string : int in [1, 86] or str in {'ic', 'dc', or 'all'}
 
@@ -252,7 +339,22 @@ class Retro5DTables(object):
             )
             return
 
+        if self.pyramid_level > 0:
+            fpath = get_pyramid_level_fpath(fpath, self.pyramid_level)
+            with open(join(fpath, PYRAMID_INFO_FNAME), 'r') as pyr_info_file:
+                pyramid_info = json.load(pyr_info_file)
+            if pyramid_info['norm_version'] != self.norm_version:
+                raise ValueError(
+                    'Pyramid level at "{}" was generated for norm version "{}"'
+                    ' but norm version "{}" is in use'.format(
+                        fpath, pyramid_info['norm_version'], self.norm_version
+                    )
+                )
+            if step_length is None:
+                step_length = pyramid_info['step_length']
+
         table = self.table_loader_func(fpath=fpath, mmap=mmap)
+        quantization = table.get('quantization', None)
         if 'step_length' in table:
             if step_length is None:
                 step_length = table['step_length']
@@ -268,20 +370,50 @@ class Retro5DTables(object):
             norm_version=self.norm_version,
             **{k: table[k] for k in TABLE_NORM_KEYS}
         )
+        if quantization is not None:
+            # Codes decode to values relative to each table's scale
+            table_norm = table_norm * quantization['scales'][self.table_name]
+            if self.t_indep_table_name in quantization['scales']:
+                t_indep_table_norm = (
+                    t_indep_table_norm
+                    * quantization['scales'][self.t_indep_table_name]
+                )
+            quant_encoding = quantization['encoding']
+            quant_dynamic_range = quantization['dynamic_range']
+        else:
+            quant_encoding = None
+            quant_dynamic_range = None
+        if self.precision == 'single':
+            table_norm = table_norm.astype(np.float32)
+            t_indep_table_norm = t_indep_table_norm.astype(np.float32)
         table['table_norm'] = table_norm
         table['t_indep_table_norm'] = t_indep_table_norm
 
+        # Tables transformed by `retro/tables/transform_table_layout.py`
+        # record their axis order; the compiled functions must match it
+        table_layout = table.get('table_layout', DFLT_TABLE_LAYOUT)
+
         pexp_5d, pexp_meta = generate_pexp_5d_function(
             table=table,
             table_kind=self.table_kind,
             compute_t_indep_exp=self.compute_t_indep_exp,
             use_directionality=self.use_directionality,
             num_phi_samples=self.num_phi_samples,
-            ckv_sigma_deg=self.ckv_sigma_deg
+            ckv_sigma_deg=self.ckv_sigma_deg,
+            precision=self.precision,
+            cone_lookup=self.cone_lookup,
+            cone_lookup_oversample=self.cone_lookup_oversample,
+            table_layout=table_layout,
+            quant_encoding=quant_encoding,
+            quant_dynamic_range=quant_dynamic_range
         )
         if self.pexp_func is None:
             self.pexp_func = pexp_5d
             self.pexp_meta = pexp_meta
+            if quant_encoding is not None:
+                self.dequant_lut = get_dequant_lut(
+                    quant_encoding, quant_dynamic_range
+                )
         elif pexp_meta != self.pexp_meta:
             raise ValueError(
                 'All binnings and table parameters currently must be equal to'
@@ -293,22 +425,454 @@ class Retro5DTables(object):
             table['table_norm'],
         )
 
+        # Uncompressed tables take direction-averaged tables (or empty
+        # placeholders) where template-compressed tables take their maps
         if self.tbl_is_templ_compr:
             table_tup += (table['table_map'],)
-
-        if self.compute_t_indep_exp:
+        elif self.dir_avg:
+            dir_axes = tuple(
+                TABLE_LAYOUTS[table_layout].index(axis)
+                for axis in ('costhetadir', 'deltaphidir')
+            )
             table_tup += (
-                table[self.t_indep_table_name],
-                table['t_indep_table_norm']
+                get_dir_avg_table(table_tup[0], dir_axes, self.dequant_lut),
             )
+        else:
+            table_tup += (np.empty(shape=(0, 0, 0), dtype=np.float32),)
+
+        if self.compute_t_indep_exp:
+            t_indep_table = table[self.t_indep_table_name]
+            table_tup += (t_indep_table, table['t_indep_table_norm'])
             if self.tbl_is_templ_compr:
                 table_tup += (table['t_indep_table_map'],)
+            elif self.dir_avg:
+                table_tup += (
+                    get_dir_avg_table(
+                        t_indep_table, dequant_lut=self.dequant_lut
+                    ),
+                )
+            else:
+                table_tup += (np.empty(shape=(0, 0), dtype=np.float32),)
 
         self.tables[(string, dom)] = table_tup
 
+    def _get_max_exp_p_per_photon_by_r(self):
+        """Get an upper bound on the expected photons at a hit time per source
+        photon (before quantum efficiency) for a source in each radial bin or
+        any farther bin, over all stacked tables.
+
+        Returns
+        -------
+        max_exp_p_per_photon_by_r : shape (n_r_bins,) array of float64
+            Non-increasing
+
+        """
+        table, table_norm, table_map = self.table_stack[:3]
+        # Stacked tables have the table index first and r second
+        max_norm = np.max(table_norm, axis=(0, 2)).astype(np.float64)
+        if self.tbl_is_templ_compr:
+            # Isotropic sources use the template weight alone
+            max_table = np.max(table_map['weight'], axis=(0, 2, 3)) * max(
+                1.0, np.max(table)
+            )
+        else:
+            # Reduce one r bin at a time to bound memory use; codes of
+            # non-negative values are monotonic in value
+            max_table = np.array([
+                self._dequantize(np.max(table[:, r_idx]))
+                for r_idx in range(table.shape[1])
+            ])
+        max_exp_p_per_photon = max_norm * max_table
+        # Maximum over each bin and all farther bins, with a margin for
+        # rounding in the compiled code
+        return (
+            np.maximum.accumulate(max_exp_p_per_photon[::-1])[::-1]
+            * (1 + 1e-6)
+        ).astype(np.float64)
+
+    def _dequantize(self, table):
+        """Decode `table` if tables are quantized, otherwise return it as-is"""
+        if self.dequant_lut is None:
+            return table
+        return self.dequant_lut[table]
+
+    def get_table_key(self, string, dom):
+        """Get the key into `tables` for the table used by a DOM, accounting
+        for any string and depth aggregation.
+
+        Parameters
+        ----------
+        string : int in [1, 86]
+
+        dom : int in [1, 60]
+
+        Returns
+        -------
+        key : tuple of two ints
+
+        """
+        if self.string_aggregation is AGG_STR_ALL:
+            string = STR_ALL
+        elif self.string_aggregation is AGG_STR_SUBDET:
+            if string < 79:
+                string = STR_IC
+            else:
+                string = STR_DC
+
+        if self.depth_aggregation:
+            dom = DOM_ALL
+
+        return (string, dom)
+
+    def stack_tables(self):
+        """Stack all loaded tables along a new leading axis so that the
+        expectations at many DOMs can be computed in a single call to compiled
+        code (see `get_expected_det_all_doms`).
+
+        Entries in `tables` are replaced by views into the stacked arrays, so
+        memory is not duplicated. Note that memory-mapped tables are read into
+        memory by this operation. Call this once, after all tables have been
+        loaded.
+
+        """
+        if not self.tables:
+            raise ValueError('No tables have been loaded')
+
+        keys = sorted(self.tables.keys())
+        n_tables = len(keys)
+        n_components = len(self.tables[keys[0]])
+
+        components = []
+        for component_idx in range(n_components):
+            arrays = [self.tables[key][component_idx] for key in keys]
+            shapes = set(a.shape for a in arrays)
+            if len(shapes) != 1:
+                raise ValueError(
+                    'Cannot stack tables with differing shapes {}'
+                    .format(sorted(shapes))
+                )
+            components.append(np.stack(arrays, axis=0))
+
+        for table_idx, key in enumerate(keys):
+            self.tables[key] = tuple(c[table_idx] for c in components)
+
+        # Insert placeholders for components not computed so the stack always
+        # has the same layout
+        table, table_norm, table_map = components[:3]
+        if self.compute_t_indep_exp:
+            t_indep_table, t_indep_table_norm, t_indep_table_map = components[3:]
+        else:
+            if self.tbl_is_templ_compr:
+                t_indep_table_shape = (n_tables, 0, 0, 0)
+            else:
+                t_indep_table_shape = (n_tables, 0, 0, 0, 0)
+            t_indep_table = np.empty(
+                shape=t_indep_table_shape, dtype=np.float32
+            )
+            t_indep_table_norm = np.empty(
+                shape=(n_tables, 0), dtype=np.float32
+            )
+            t_indep_table_map = np.empty(
+                shape=(n_tables, 0, 0), dtype=np.float32
+            )
+
+        self.table_stack = (
+            table, table_norm, table_map, t_indep_table, t_indep_table_norm,
+            t_indep_table_map
+        )
+
+        key_to_idx = {key: idx for idx, key in enumerate(keys)}
+        n_strings, n_doms = self.operational_doms.shape
+        dom_table_idx = np.full(
+            shape=(n_strings, n_doms), fill_value=-1, dtype=np.int32
+        )
+        for string_idx in range(n_strings):
+            for dom_idx in range(n_doms):
+                if not self.operational_doms[string_idx, dom_idx]:
+                    continue
+                key = self.get_table_key(string=string_idx + 1, dom=dom_idx + 1)
+                dom_table_idx[string_idx, dom_idx] = key_to_idx.get(key, -1)
+        self.dom_table_idx = dom_table_idx
+
+        # Plain (non-masked) arrays for use in compiled code; masked values
+        # are never accessed since those DOMs have negative table index
+        self.dom_params = (
+            self.geom,
+            self.quantum_efficiency.filled(0),
+            self.noise_rate_per_ns.filled(0),
+            self.dom_table_idx
+        )
+
+        src_geometry = generate_src_geometry_function(
+            table_kind=self.table_kind,
+            use_directionality=self.use_directionality,
+            binning_info=self.pexp_meta['binning_info'],
+            cone_lookup=self.pexp_meta['cone_lookup']
+        )
+        self.pexp_all_doms_func = generate_pexp_5d_all_doms_function(
+            pexp_5d=self.pexp_func,
+            r_max=self.pexp_meta['binning_info']['r_max'],
+            src_geometry=src_geometry
+        )
+        self.pexp_batch_func = generate_pexp_5d_batch_function(
+            pexp_5d_all_doms=self.pexp_all_doms_func,
+            precision=self.precision
+        )
+        self.neg_llh_bounded_func = generate_neg_llh_bounded_function(
+            pexp_5d=self.pexp_func,
+            binning_info=self.pexp_meta['binning_info']
+        )
+
+    def get_thread_pool(self, num_threads):
+        """Get a thread pool with `num_threads` threads, (re)creating it only
+        if the number of threads changed since the last call."""
+        if self.thread_pool_size != num_threads:
+            if self.thread_pool is not None:
+                self.thread_pool.close()
+            self.thread_pool = ThreadPool(processes=num_threads)
+            self.thread_pool_size = num_threads
+        return self.thread_pool
+
+    def get_expected_det_all_doms(
+            self, sources, hits, time_window, num_threads=1, include_noise=True,
+            counters=None
+        ):
+        """Compute photon expectations at many DOMs in a single call to
+        compiled code. `stack_tables` must have been called first.
+
+        Parameters
+        ----------
+        sources : shape (num_sources,) array of dtype SRC_DTYPE
+
+        hits : retro_types.EventHits
+            Expectations are computed for DOMs in ``hits.str_dom_idxs`` (each
+            of which must either be non-operational or have a loaded table)
+            at the times in ``hits.times``
+
+        time_window : float in units of ns
+            Time window for computing the "time-independent" noise
+            expectation.
+
+        num_threads : int >= 1
+            Split the DOMs into chunks that are computed concurrently by this
+            many threads (the compiled code releases the GIL). Results do not
+            depend on `num_threads`.
+
+        include_noise : bool
+            Include noise in the photon expectations (both at hit time and
+            time-independent)
+
+        counters : shape (len(PEXP_COUNTERS),) array of int64, optional
+            If provided, work done is added to these counters
+
+        Returns
+        -------
+        exp_p_at_all_times : shape (num_doms,) array of float64
+
+        exp_p_at_hit_times : shape (num_hits,) array of float64
+
+        """
+        dom_params = self.dom_params
+        if not include_noise:
+            dom_params = dom_params[:2] + (
+                np.zeros_like(dom_params[2]),
+            ) + dom_params[3:]
+        tables_args = dom_params + self.table_stack
+
+        if num_threads <= 1:
+            if counters is not None:
+                tables_args += (counters,)
+            return self.pexp_all_doms_func(
+                sources,
+                hits.times,
+                hits.dom_hits_start,
+                hits.str_dom_idxs,
+                time_window,
+                *tables_args
+            )
+
+        # Use more chunks than threads since the cost per DOM varies greatly
+        # (e.g. with distance from the sources and with number of hits)
+        num_doms = len(hits.str_dom_idxs)
+        chunk_bounds = np.linspace(
+            0, num_doms, min(num_doms, 4*num_threads) + 1
+        ).astype(int)
+
+        # Each chunk gets its own counters, summed once all are done
+        num_chunks = len(chunk_bounds) - 1
+        if counters is not None:
+            chunk_counters = np.zeros(
+                shape=(num_chunks, len(counters)), dtype=np.int64
+            )
+
+        def get_chunk(chunk_idx):
+            """Compute expectations for DOMs in one chunk"""
+            dom_start = chunk_bounds[chunk_idx]
+            dom_stop = chunk_bounds[chunk_idx + 1]
+            dom_hits_start = hits.dom_hits_start[dom_start:dom_stop + 1]
+            hit_start = dom_hits_start[0]
+            hit_stop = dom_hits_start[-1]
+            chunk_args = tables_args
+            if counters is not None:
+                chunk_args += (chunk_counters[chunk_idx],)
+            return self.pexp_all_doms_func(
+                sources,
+                hits.times[hit_start:hit_stop],
+                dom_hits_start - hit_start,
+                hits.str_dom_idxs[dom_start:dom_stop],
+                time_window,
+                *chunk_args
+            )
+
+        # `map` returns chunks in order, so concatenating (and any subsequent
+        # reduction) is deterministic
+        chunks = self.get_thread_pool(num_threads).map(
+            get_chunk, range(num_chunks), chunksize=1
+        )
+        exp_p_at_all_times = np.concatenate([c[0] for c in chunks])
+        exp_p_at_hit_times = np.concatenate([c[1] for c in chunks])
+        if counters is not None:
+            counters += np.sum(chunk_counters, axis=0)
+
+        return exp_p_at_all_times, exp_p_at_hit_times
+
+    def get_expected_det_batch(
+            self, sources, hypo_sources_start, hits, time_window,
+            num_threads=1
+        ):
+        """For each of a batch of hypotheses, compute the sums over DOMs and
+        hits that enter the likelihood in a single call to compiled code.
+        `stack_tables` must have been called first.
+
+        Parameters
+        ----------
+        sources : shape (num_sources,) array of dtype SRC_DTYPE
+            Sources of all hypotheses, concatenated
+
+        hypo_sources_start : shape (num_hypos + 1,) array of int
+            Sources for hypothesis `i` are
+            ``sources[hypo_sources_start[i]:hypo_sources_start[i+1]]``
+
+        hits : retro_types.EventHits
+
+        time_window : float in units of ns
+
+        num_threads : int >= 1
+            Split the hypotheses into chunks that are computed concurrently by
+            this many threads. Results do not depend on `num_threads`.
+
+        Returns
+        -------
+        sum_exp_p_at_all_times : shape (num_hypos,) array of float64
+            Total expected photons (including noise) in the DOMs of `hits`
+
+        sum_log_exp_p_at_hit_times : shape (num_hypos,) array of float64
+            Charge-weighted sum of the log of expected photons (including
+            noise) at the hit times
+
+        """
+        hits_args = (
+            hits.times,
+            hits.charges,
+            hits.dom_hits_start,
+            hits.str_dom_idxs,
+            time_window
+        ) + self.dom_params + self.table_stack
+
+        num_hypos = len(hypo_sources_start) - 1
+        if num_threads <= 1 or num_hypos <= 1:
+            return self.pexp_batch_func(
+                sources, hypo_sources_start, *hits_args
+            )
+
+        hypo_bounds = np.linspace(
+            0, num_hypos, min(num_hypos, num_threads) + 1
+        ).astype(int)
+
+        def get_chunk(chunk_idx):
+            """Compute sums for hypotheses in one chunk"""
+            chunk_sources_start = hypo_sources_start[
+                hypo_bounds[chunk_idx]:hypo_bounds[chunk_idx + 1] + 1
+            ]
+            src_start = chunk_sources_start[0]
+            src_stop = chunk_sources_start[-1]
+            return self.pexp_batch_func(
+                sources[src_start:src_stop],
+                chunk_sources_start - src_start,
+                *hits_args
+            )
+
+        chunks = self.get_thread_pool(num_threads).map(
+            get_chunk, range(len(hypo_bounds) - 1), chunksize=1
+        )
+        sum_exp_p_at_all_times = np.concatenate([c[0] for c in chunks])
+        sum_log_exp_p_at_hit_times = np.concatenate([c[1] for c in chunks])
+
+        return sum_exp_p_at_all_times, sum_log_exp_p_at_hit_times
+
+    def get_neg_llh_bounded(
+            self, sources, hits, time_window, dom_order, threshold,
+            neg_llh_offset=0.0, count_exp_p_at_all_times=True
+        ):
+        """Compute the negative log likelihood DOM by DOM, stopping as soon as
+        a lower bound on it exceeds `threshold`. `stack_tables` must have been
+        called first.
+
+        Parameters
+        ----------
+        sources : shape (num_sources,) array of dtype SRC_DTYPE
+
+        hits : retro_types.EventHits
+
+        time_window : float in units of ns
+
+        dom_order : shape (num_doms,) array of int
+            Order in which to compute the DOMs of `hits`; DOMs expected to
+            contribute most should come first
+
+        threshold : float
+
+        neg_llh_offset : float
+            Added to the negative log likelihood
+
+        count_exp_p_at_all_times : bool
+            Whether to include each DOM's expectation at all times (set to
+            False if this is accounted for in `neg_llh_offset`)
+
+        Returns
+        -------
+        neg_llh : float64
+            Negative log likelihood if `complete`, otherwise a lower bound on
+            it that exceeds `threshold`
+
+        complete : bool
+
+        num_doms_computed : int
+
+        """
+        if self.max_exp_p_per_photon_by_r is None:
+            self.max_exp_p_per_photon_by_r = (
+                self._get_max_exp_p_per_photon_by_r()
+            )
+
+        return self.neg_llh_bounded_func(
+            sources,
+            hits.times,
+            hits.charges,
+            hits.dom_hits_start,
+            hits.str_dom_idxs,
+            time_window,
+            np.asarray(dom_order, dtype=np.int64),
+            threshold,
+            neg_llh_offset,
+            count_exp_p_at_all_times,
+            self.max_exp_p_per_photon_by_r,
+            *(self.dom_params + self.table_stack)
+        )
+
     def get_expected_det(
             self, sources, hit_times, string, dom, include_noise=False,
-            time_window=None
+            time_window=None, counters=None
         ):
         """
         Parameters
@@ -317,6 +881,7 @@ class Retro5DTables(object):
             Info about photons generated photons by the event hypothesis.
 
         hit_times : shape (num_hits,) array of floats, units of ns
+            Need not be sorted (though sorted input avoids a copy)
 
         string : int in [1, 86]
 
@@ -330,6 +895,9 @@ class Retro5DTables(object):
             Time window for computing the "time-independent" noise expectation.
             Used (and required) if `include_noise` is True.
 
+        counters : shape (len(PEXP_COUNTERS),) array of int64, optional
+            If provided, work done is added to these counters
+
         Returns
         -------
         exp_p_at_all_times : float64
@@ -346,33 +914,152 @@ class Retro5DTables(object):
         dom_coord = self.geom[string_idx, dom_idx]
         dom_quantum_efficiency = self.quantum_efficiency[string_idx, dom_idx]
 
-        if self.string_aggregation is AGG_STR_ALL:
-            string = STR_ALL
-        elif self.string_aggregation is AGG_STR_SUBDET:
-            if string < 79:
-                string = STR_IC
-            else:
-                string = STR_DC
+        table_tup = self.tables[self.get_table_key(string=string, dom=dom)]
 
-        if self.depth_aggregation:
-            dom = DOM_ALL
+        # `pexp_func` requires hit times sorted in ascending order
+        hit_times = np.asarray(hit_times)
+        if np.all(hit_times[1:] >= hit_times[:-1]):
+            order = None
+        else:
+            order = np.argsort(hit_times, kind='mergesort')
+            hit_times = hit_times[order]
+
+        exp_p_at_all_times, exp_p_at_hit_times = self.get_expected_det_dom(
+            sources=sources,
+            hit_times=hit_times,
+            dom_coord=dom_coord,
+            dom_quantum_efficiency=dom_quantum_efficiency,
+            table_tup=table_tup,
+            counters=counters
+        )
+
+        if order is not None:
+            unsorted_exp_p_at_hit_times = np.empty_like(exp_p_at_hit_times)
+            unsorted_exp_p_at_hit_times[order] = exp_p_at_hit_times
+            exp_p_at_hit_times = unsorted_exp_p_at_hit_times
+
+        if include_noise:
+            dom_noise_rate_per_ns = self.noise_rate_per_ns[string_idx, dom_idx]
+            exp_p_at_hit_times += dom_noise_rate_per_ns
+            exp_p_at_all_times += dom_noise_rate_per_ns * time_window
+
+        return exp_p_at_all_times, exp_p_at_hit_times
+
+    def get_expected_det_dom(
+            self, sources, hit_times, dom_coord, dom_quantum_efficiency,
+            table_tup, counters=None
+        ):
+        """Compute expectations at one (operational) DOM whose parameters
+        have already been looked up, e.g. as stored in an
+        `retro_types.EventContext`. Noise is not included.
 
-        table_tup = self.tables[(string, dom)]
+        Parameters
+        ----------
+        sources : shape (num_sources,) array of dtype SRC_DTYPE
+        hit_times : shape (num_hits,) array of floats, units of ns
+            Must be sorted in ascending order
+        dom_coord : shape (3,) array
+        dom_quantum_efficiency : float
+        table_tup : tuple
+            The DOM's entry in `tables`
+        counters : shape (len(PEXP_COUNTERS),) array of int64, optional
+
+        Returns
+        -------
+        exp_p_at_all_times : float64
+        exp_p_at_hit_times : shape (num_hits,) array of float64
 
-        exp_p_at_all_times, exp_p_at_hit_times = self.pexp_func(
+        """
+        if counters is None:
+            return self.pexp_func(
+                sources,
+                hit_times,
+                dom_coord,
+                dom_quantum_efficiency,
+                *table_tup
+            )
+        return self.pexp_func(
             sources,
             hit_times,
             dom_coord,
             dom_quantum_efficiency,
-            *table_tup
+            *(table_tup + (counters,))
         )
 
-        if include_noise:
-            dom_noise_rate_per_ns = self.noise_rate_per_ns[string_idx, dom_idx]
-            exp_p_at_hit_times += dom_noise_rate_per_ns
-            exp_p_at_all_times += dom_noise_rate_per_ns * time_window
 
-        return exp_p_at_all_times, exp_p_at_hit_times
+def get_dir_avg_table(table, dir_axes=(-2, -1), dequant_lut=None):
+    """Average a table over its (costhetadir, deltaphidir) dimensions, as
+    used for isotropic sources.
+
+    The table is processed one radial bin at a time, so a memory-mapped table
+    is never read into memory (or decoded) in its entirety.
+
+    Parameters
+    ----------
+    table : array
+        Radial dimension first
+
+    dir_axes : tuple of two ints
+        Axes of `table` holding the costhetadir and deltaphidir dimensions
+
+    dequant_lut : array, optional
+        If `table` is quantized, the lookup table for decoding it (see
+        `retro.utils.quant.get_dequant_lut`)
+
+    Returns
+    -------
+    dir_avg_table : array
+        `table` with `dir_axes` removed, same dtype as `table` (or as
+        `dequant_lut` if specified)
+
+    """
+    dir_axes = tuple(axis % table.ndim for axis in dir_axes)
+    assert 0 not in dir_axes
+    slab_dir_axes = tuple(axis - 1 for axis in dir_axes)
+    dir_avg_table = np.empty(
+        shape=tuple(
+            n for axis, n in enumerate(table.shape) if axis not in dir_axes
+        ),
+        dtype=table.dtype if dequant_lut is None else dequant_lut.dtype
+    )
+    for r_idx in range(table.shape[0]):
+        slab = table[r_idx]
+        if dequant_lut is not None:
+            slab = dequant_lut[slab]
+        dir_avg_table[r_idx] = np.mean(
+            slab, axis=slab_dir_axes, dtype=np.float64
+        )
+    return dir_avg_table
+
+
+def get_pyramid_level_fpath(fpath, level):
+    """Get the path to a level of a table's coarse-to-fine pyramid.
+
+    Parameters
+    ----------
+    fpath : string
+        Path to the full-resolution table: a .npy-files directory, a .npy file
+        within such a directory, or a (possibly compressed) .fits file
+        (whose pyramid levels are in the directory of the same name with the
+        extension(s) removed)
+
+    level : int >= 0
+        Level 0 is the full-resolution table, i.e. `fpath` is returned
+
+    Returns
+    -------
+    level_fpath : string
+
+    """
+    if level == 0:
+        return fpath
+    fpath = expand(fpath)
+    if isfile(fpath):
+        if fpath.endswith('.npy'):
+            fpath = dirname(fpath)
+        else:
+            fpath = re.sub(r'\.fits(\.[^./]*)?$', '', fpath)
+    return join(fpath, PYRAMID_LEVEL_DIR_PROTO.format(level=level))
 
 
 def get_table_norm(
@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position, redefined-outer-name
+
+"""
+Generate a coarse-to-fine pyramid of a raw or Cherenkov 5D table, i.e.
+versions of the table with coarser (r, costheta, t, costhetadir, deltaphidir)
+binning. A likelihood computed with a coarse level is cheaper and can be used
+to screen out obviously-poor hypotheses before refining at full resolution.
+
+Each level is downsampled directly from the full-resolution table. Counts are
+converted to survival probabilities using the table normalization (hence the
+norm version must be specified), averaged over the fine bins making up each
+coarse bin (weighting by bin volume in r and width in t), and converted back
+to counts using the normalization of the coarse binning. Probabilities are
+thus preserved for whichever norm version is used with the tables.
+
+Levels are written in .npy-files-in-a-directory format to a directory named
+by `PYRAMID_LEVEL_DIR_PROTO` within the table's directory; load them by
+passing `pyramid_level` to `Retro5DTables`. The table is downsampled one block
+of radial bins at a time into memory-mapped output files, so tables larger
+than the available memory can be downsampled.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = [
+    'PYRAMID_AXES',
+    'downsample_table',
+    'generate_table_pyramid',
+    'parse_args'
+]
+
+__author__ = 'J.L. Lanfranchi'
+__license__ = '''Copyright 2017 Justin L. Lanfranchi
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.'''
+
+from argparse import ArgumentParser
+from collections import Mapping, OrderedDict
+import json
+from os.path import abspath, dirname, join
+import sys
+import time
+
+import numpy as np
+
+if __name__ == '__main__' and __package__ is None:
+    RETRO_DIR = dirname(dirname(dirname(abspath(__file__))))
+    if RETRO_DIR not in sys.path:
+        sys.path.append(RETRO_DIR)
+from retro.tables.ckv_tables import CKV_TABLE_KEYS, load_ckv_table
+from retro.tables.clsim_tables import (
+    MY_CLSIM_TABLE_KEYS, load_clsim_table_minimal
+)
+from retro.tables.pexp_5d import DFLT_TABLE_LAYOUT
+from retro.tables.retro_5d_tables import (
+    NORM_VERSIONS, PYRAMID_INFO_FNAME, PYRAMID_LEVEL_DIR_PROTO,
+    TABLE_NORM_KEYS, get_pyramid_level_fpath, get_table_norm
+)
+from retro.utils.misc import expand, mkdir
+
+
+PYRAMID_AXES = ('r', 'costheta', 't', 'costhetadir', 'deltaphidir')
+"""Table axes, in order, to which downsampling factors apply"""
+
+
+def _weighted_block_mean(array, axis, factor, weights):
+    """Average each `factor` consecutive bins of `array` along `axis`,
+    weighting bins by `weights` (1D, one entry per bin along `axis`)."""
+    if factor == 1:
+        return array
+    num_bins = array.shape[axis]
+    bcast_shape = [1] * array.ndim
+    bcast_shape[axis] = num_bins
+    block_shape = (
+        array.shape[:axis] + (num_bins // factor, factor)
+        + array.shape[axis + 1:]
+    )
+    summed = (array * weights.reshape(bcast_shape)).reshape(block_shape).sum(
+        axis=axis + 1
+    )
+    bcast_shape[axis] = num_bins // factor
+    sum_of_weights = weights.reshape(num_bins // factor, factor).sum(axis=1)
+    return summed / sum_of_weights.reshape(bcast_shape)
+
+
+def _downsample_r_blocks(
+        fine, fine_norm, coarse_norm, factors, weights, coarse
+    ):
+    """Downsample `fine` into `coarse` one block of ``factors[0]`` radial
+    bins at a time, so that only one block of `fine` is in memory (in float64)
+    at once.
+
+    Parameters
+    ----------
+    fine : array
+        Fine table, radial dimension first
+    fine_norm, coarse_norm : arrays
+        Normalizations broadcastable against the fine and coarse tables,
+        respectively
+    factors : sequence of ints
+        One per dimension of `fine`
+    weights : sequence of 1D arrays or None
+        Per-bin weights along each dimension of `fine`; None for uniform
+    coarse : array
+        Filled with the downsampled table
+
+    """
+    r_factor = factors[0]
+    for coarse_r_idx in range(coarse.shape[0]):
+        r_slice = slice(coarse_r_idx * r_factor, (coarse_r_idx + 1) * r_factor)
+        surv_prob = fine[r_slice].astype(np.float64) * fine_norm[r_slice]
+        for axis, (factor, axis_weights) in enumerate(zip(factors, weights)):
+            if axis_weights is None:
+                axis_weights = np.ones(surv_prob.shape[axis])
+            elif axis == 0:
+                axis_weights = axis_weights[r_slice]
+            surv_prob = _weighted_block_mean(
+                surv_prob, axis, factor, axis_weights
+            )
+        norm = coarse_norm[coarse_r_idx:coarse_r_idx + 1]
+        coarse[coarse_r_idx] = np.where(
+            norm > 0, surv_prob / np.where(norm > 0, norm, 1), 0
+        )[0]
+
+
+def downsample_table(
+        table, factors, norm_version, step_length=None, outdir=None
+    ):
+    """Downsample a raw or Cherenkov table to coarser binning.
+
+    Parameters
+    ----------
+    table : mapping
+        As returned by `load_clsim_table_minimal` or `load_ckv_table`. Only
+        uncompressed tables are supported.
+
+    factors : sequence of 5 ints >= 1
+        Number of fine bins merged into one coarse bin along each of the axes
+        in `PYRAMID_AXES`; each must divide the number of bins along its axis
+
+    norm_version : string in NORM_VERSIONS
+        Norm version the downsampled table will be used with
+
+    step_length : float > 0, optional
+        Required if `table` does not contain 'step_length'
+
+    outdir : string, optional
+        If specified, the downsampled time-dependent and time-independent
+        tables are written directly to memory-mapped .npy files in this
+        directory rather than held in memory. Either way, the table is
+        processed one block of radial bins at a time.
+
+    Returns
+    -------
+    coarse_table : OrderedDict
+        Same keys as `table`, with bin edges and tables replaced by their
+        downsampled versions
+
+    """
+    if len(factors) != len(PYRAMID_AXES):
+        raise ValueError(
+            'Need one downsampling factor per axis in {}, got {}'
+            .format(PYRAMID_AXES, factors)
+        )
+    factors = tuple(int(f) for f in factors)
+
+    if table.get('table_layout', DFLT_TABLE_LAYOUT) != DFLT_TABLE_LAYOUT:
+        raise NotImplementedError(
+            'Only tables with layout "{}" can be downsampled'
+            .format(DFLT_TABLE_LAYOUT)
+        )
+
+    if 'quantization' in table:
+        raise NotImplementedError(
+            'Quantized tables cannot be downsampled; downsample the original'
+            ' table and quantize each level instead'
+        )
+
+    if 'ckv_table' in table:
+        table_name = 'ckv_table'
+        t_indep_table_name = 't_indep_ckv_table'
+        table_slice = (slice(None),) * 5
+    elif 'table' in table:
+        table_name = 'table'
+        t_indep_table_name = 't_indep_table'
+        # Raw tables have under/overflow bins, which are excluded here and
+        # re-added (empty) below
+        table_slice = (slice(1, -1),) * 5
+    else:
+        raise NotImplementedError(
+            'Only uncompressed raw or Cherenkov tables can be downsampled'
+        )
+
+    if step_length is None:
+        step_length = table['step_length']
+
+    coarse_table = OrderedDict(table)
+
+    for axis_name, factor in zip(PYRAMID_AXES, factors):
+        key = axis_name + '_bin_edges'
+        edges = np.asarray(table[key])
+        if factor < 1 or (len(edges) - 1) % factor != 0:
+            raise ValueError(
+                'Downsampling factor {} does not divide the {} bins along'
+                ' axis "{}"'.format(factor, len(edges) - 1, axis_name)
+            )
+        coarse_table[key] = edges[::factor]
+
+    norm_kw = dict(
+        quantum_efficiency=1,
+        avg_angsens=1,
+        norm_version=norm_version
+    )
+    fine_norm_kw = {k: table[k] for k in TABLE_NORM_KEYS if k in table}
+    fine_norm_kw['step_length'] = step_length
+    coarse_norm_kw = {k: coarse_table[k] for k in TABLE_NORM_KEYS if k in table}
+    coarse_norm_kw['step_length'] = step_length
+    fine_norm, fine_t_indep_norm = get_table_norm(
+        **dict(norm_kw, **fine_norm_kw)
+    )
+    coarse_norm, coarse_t_indep_norm = get_table_norm(
+        **dict(norm_kw, **coarse_norm_kw)
+    )
+
+    r_bin_edges = np.asarray(table['r_bin_edges'], dtype=np.float64)
+    r_weights = np.diff(r_bin_edges**3)
+    t_weights = np.diff(np.asarray(table['t_bin_edges'], dtype=np.float64))
+
+    def get_output_array(name, shape, dtype):
+        """Allocate a coarse table, in memory or memory-mapped to a file"""
+        if outdir is None:
+            return np.zeros(shape=shape, dtype=dtype)
+        # New .npy files are zero-filled
+        return np.lib.format.open_memmap(
+            join(outdir, name + '.npy'), mode='w+', dtype=dtype, shape=shape
+        )
+
+    fine_table = table[table_name][table_slice]
+    coarse_shape = tuple(n // f for n, f in zip(fine_table.shape, factors))
+    if table_name == 'table':
+        coarse_table['table_shape'] = tuple(n + 2 for n in coarse_shape)
+        coarse_padded = get_output_array(
+            table_name, coarse_table['table_shape'], fine_table.dtype
+        )
+        coarse = coarse_padded[table_slice]
+    else:
+        coarse_padded = coarse = get_output_array(
+            table_name, coarse_shape, fine_table.dtype
+        )
+    _downsample_r_blocks(
+        fine=fine_table,
+        fine_norm=fine_norm[:, np.newaxis, :, np.newaxis, np.newaxis],
+        coarse_norm=coarse_norm[:, np.newaxis, :, np.newaxis, np.newaxis],
+        factors=factors,
+        weights=[r_weights, None, t_weights, None, None],
+        coarse=coarse
+    )
+    coarse_table[table_name] = coarse_padded
+
+    if t_indep_table_name in table:
+        # Time-independent tables have no t axis (nor under/overflow bins)
+        fine_t_indep = table[t_indep_table_name]
+        t_indep_factors = factors[:2] + factors[3:]
+        coarse_t_indep = get_output_array(
+            t_indep_table_name,
+            tuple(n // f for n, f in zip(fine_t_indep.shape, t_indep_factors)),
+            fine_t_indep.dtype
+        )
+        _downsample_r_blocks(
+            fine=fine_t_indep,
+            fine_norm=fine_t_indep_norm[:, np.newaxis, np.newaxis, np.newaxis],
+            coarse_norm=coarse_t_indep_norm[
+                :, np.newaxis, np.newaxis, np.newaxis
+            ],
+            factors=t_indep_factors,
+            weights=[r_weights, None, None, None],
+            coarse=coarse_t_indep
+        )
+        coarse_table[t_indep_table_name] = coarse_t_indep
+
+    return coarse_table
+
+
+def generate_table_pyramid(
+        table, kind, level_factors, norm_version, step_length=None,
+        outdir=None, mmap_src=True
+    ):
+    """Generate and save to disk the levels of a table's coarse-to-fine
+    pyramid.
+
+    Parameters
+    ----------
+    table : string or mapping
+        If string, path to table file or directory (of kind `kind`). A mapping
+        is assumed to be a table loaded as by `load_clsim_table_minimal` or
+        `load_ckv_table`.
+
+    kind : string in {'raw', 'ckv'}
+
+    level_factors : sequence of sequences of 5 ints
+        Downsampling factors (see `downsample_table`) for pyramid levels 1, 2,
+        ...; each level is downsampled from the full-resolution table
+
+    norm_version : string in NORM_VERSIONS
+
+    step_length : float > 0, optional
+        Required if the table does not record its step length
+
+    outdir : string, optional
+        Directory in which to place the pyramid level directories. Defaults to
+        the table's directory (see `get_pyramid_level_fpath`); required if
+        `table` is a mapping.
+
+    mmap_src : bool
+        Whether to memory map the source table
+
+    Returns
+    -------
+    level_dirs : list of strings
+        Directories to which levels 1, 2, ... were written
+
+    """
+    if kind == 'raw':
+        table_names = ['table', 't_indep_table']
+        table_keys = MY_CLSIM_TABLE_KEYS + ['t_indep_table']
+        loader_func = load_clsim_table_minimal
+    elif kind == 'ckv':
+        table_names = ['ckv_table', 't_indep_ckv_table']
+        table_keys = CKV_TABLE_KEYS + ['t_indep_ckv_table']
+        loader_func = load_ckv_table
+    else:
+        raise ValueError('Unhandled table kind "{}"'.format(kind))
+
+    source = None
+    if isinstance(table, Mapping):
+        if outdir is None:
+            raise ValueError('You must provide an `outdir` if `table` is a'
+                             ' python object (i.e. not a file or directory'
+                             ' path).')
+    else:
+        source = expand(table)
+        table = loader_func(fpath=source, mmap=mmap_src)
+
+    if step_length is None:
+        step_length = table['step_length']
+
+    level_dirs = []
+    for level, factors in enumerate(level_factors, start=1):
+        if outdir is None:
+            level_dir = get_pyramid_level_fpath(source, level)
+        else:
+            level_dir = join(
+                expand(outdir), PYRAMID_LEVEL_DIR_PROTO.format(level=level)
+            )
+        print('Generating pyramid level {} with factors {} in "{}"'
+              .format(level, tuple(factors), level_dir))
+        t0 = time.time()
+
+        mkdir(level_dir)
+        coarse_table = downsample_table(
+            table=table,
+            factors=factors,
+            norm_version=norm_version,
+            step_length=step_length,
+            outdir=level_dir
+        )
+
+        # Tables themselves were written by `downsample_table`
+        for key in table_keys:
+            if key in coarse_table and key not in table_names:
+                np.save(join(level_dir, key + '.npy'), coarse_table[key])
+        for key in table_names:
+            if key in coarse_table:
+                coarse_table[key].flush()
+        del coarse_table
+
+        pyramid_info = OrderedDict([
+            ('level', level),
+            ('factors', OrderedDict(zip(PYRAMID_AXES, map(int, factors)))),
+            ('norm_version', norm_version),
+            ('step_length', float(step_length)),
+            ('source', source)
+        ])
+        with open(join(level_dir, PYRAMID_INFO_FNAME), 'w') as info_file:
+            json.dump(pyramid_info, info_file, indent=2)
+
+        print('  -> {:.3f} s'.format(time.time() - t0))
+        level_dirs.append(level_dir)
+
+    return level_dirs
+
+
+def parse_args(description=__doc__):
+    """Parse command line arguments"""
+    parser = ArgumentParser(description=description)
+    parser.add_argument(
+        '--table', required=True,
+        help='''npy-table directory or .fits table file'''
+    )
+    parser.add_argument(
+        '--kind', choices=['raw', 'ckv'], required=True,
+        help='''Kind of table to downsample.'''
+    )
+    parser.add_argument(
+        '--level-factors', nargs='+', required=True,
+        help='''Downsampling factors for each pyramid level (starting with
+        level 1) as comma-separated integers for the axes r, costheta, t,
+        costhetadir, and deltaphidir; e.g. "2,2,2,1,1 4,4,4,2,2"'''
+    )
+    parser.add_argument(
+        '--norm-version', choices=NORM_VERSIONS, required=True,
+        help='''Norm version the tables will be used with.'''
+    )
+    parser.add_argument(
+        '--step-length', type=float, default=None,
+        help='''Step length used in the CLSim table generator; required if
+        not recorded in the table.'''
+    )
+    parser.add_argument(
+        '--outdir', default=None,
+        help='''Directory in which to store the pyramid level directories;
+        defaults to the table's directory.'''
+    )
+    args = parser.parse_args()
+    args.level_factors = [
+        [int(f) for f in level.split(',')] for level in args.level_factors
+    ]
+    return args
+
+
+if __name__ == '__main__':
+    level_dirs = generate_table_pyramid(**vars(parse_args())) # pylint: disable=invalid-name
@@ -228,7 +228,7 @@ class TDICartTable(object):
 
         """
         fname = basename(fpath)
-        match = TDI_TABLE_FNAME_RE[-1].match(fname)
+        match = TDI_TABLE_FNAME_RE.match(fname)
         if match is None:
             return None
         meta = match.groupdict()
@@ -488,6 +488,21 @@ class TDICartTable(object):
             use_directionality=self.use_directionality
         )
 
+    def get_expected_det(self, sources):
+        """Get the total expectation in the detector, as used by the
+        likelihood functions in `retro.likelihood`.
+
+        Parameters
+        ----------
+        sources : shape (N,) numpy ndarray, dtype SRC_DTYPE
+
+        Returns
+        -------
+        expected_det : float
+
+        """
+        return self.get_photon_expectation(sources=sources)
+
     #def plot_slices(self, x_slice=slice(None), y_slice=slice(None),
     #                z_slice=slice(None)):
     #    # Formulate a slice through the table to look at
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position, redefined-outer-name
+
+"""
+Transform a raw or Cherenkov 5D table to a different memory layout (axis
+order), e.g. with the time axis innermost so that the entries looked up for a
+source at successive hit times are adjacent in memory. See
+`retro.tables.pexp_5d.TABLE_LAYOUTS` for the layouts available.
+
+The transformed table is written in .npy-files-in-a-directory format along
+with a "table_layout.npy" file recording its layout, which the table loaders
+read so that `Retro5DTables` generates functions indexing the table
+accordingly. Time-independent tables have no time axis and are copied as-is.
+
+The table is transformed one radial bin at a time into a memory-mapped output
+file, so tables larger than the available memory can be transformed.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = [
+    'transform_table_layout',
+    'parse_args'
+]
+
+__author__ = 'J.L. Lanfranchi'
+__license__ = '''Copyright 2017 Justin L. Lanfranchi
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.'''
+
+from argparse import ArgumentParser
+from collections import Mapping
+import json
+from os.path import abspath, dirname, join
+import sys
+import time
+
+import numpy as np
+
+if __name__ == '__main__' and __package__ is None:
+    RETRO_DIR = dirname(dirname(dirname(abspath(__file__))))
+    if RETRO_DIR not in sys.path:
+        sys.path.append(RETRO_DIR)
+from retro.tables.ckv_tables import CKV_TABLE_KEYS, load_ckv_table
+from retro.tables.clsim_tables import (
+    MY_CLSIM_TABLE_KEYS, load_clsim_table_minimal
+)
+from retro.tables.pexp_5d import DFLT_TABLE_LAYOUT, TABLE_LAYOUTS
+from retro.utils.misc import expand, mkdir
+from retro.utils.quant import QUANT_INFO_FNAME
+
+
+def transform_table_layout(table, kind, layout, outdir, mmap_src=True):
+    """Write a table to disk with its time-dependent table's axes reordered
+    to `layout`.
+
+    Parameters
+    ----------
+    table : string or mapping
+        If string, path to table file or directory (of kind `kind`). A mapping
+        is assumed to be a table loaded as by `load_clsim_table_minimal` or
+        `load_ckv_table`.
+
+    kind : string in {'raw', 'ckv'}
+
+    layout : string in TABLE_LAYOUTS
+
+    outdir : string
+        Directory to which the transformed table is written
+
+    mmap_src : bool
+        Whether to memory map the source table
+
+    Returns
+    -------
+    outdir : string
+
+    """
+    if kind == 'raw':
+        table_keys = MY_CLSIM_TABLE_KEYS + ['t_indep_table']
+        table_name = 'table'
+        loader_func = load_clsim_table_minimal
+    elif kind == 'ckv':
+        table_keys = CKV_TABLE_KEYS + ['t_indep_ckv_table']
+        table_name = 'ckv_table'
+        loader_func = load_ckv_table
+    else:
+        raise ValueError('Unhandled table kind "{}"'.format(kind))
+
+    if layout not in TABLE_LAYOUTS:
+        raise ValueError('Unhandled table layout "{}"; must be one of {}'
+                         .format(layout, list(TABLE_LAYOUTS.keys())))
+
+    if not isinstance(table, Mapping):
+        table = loader_func(fpath=expand(table), mmap=mmap_src)
+
+    src_layout = table.get('table_layout', DFLT_TABLE_LAYOUT)
+    src_axes = TABLE_LAYOUTS[src_layout]
+    dst_axes = TABLE_LAYOUTS[layout]
+
+    # Both layouts keep r as the outermost axis, so the table can be
+    # transformed one r bin at a time
+    assert src_axes[0] == dst_axes[0] == 'r'
+    axis_order = tuple(src_axes.index(axis) for axis in dst_axes)
+
+    outdir = expand(outdir)
+    mkdir(outdir)
+    print('Transforming table from layout "{}" to "{}" in "{}"'
+          .format(src_layout, layout, outdir))
+    t0 = time.time()
+
+    src = table[table_name]
+    dst_shape = tuple(src.shape[i] for i in axis_order)
+    dst = np.lib.format.open_memmap(
+        join(outdir, table_name + '.npy'), mode='w+', dtype=src.dtype,
+        shape=dst_shape
+    )
+    slab_axis_order = tuple(i - 1 for i in axis_order[1:])
+    for r_idx in range(src.shape[0]):
+        dst[r_idx] = np.transpose(src[r_idx], slab_axis_order)
+    dst.flush()
+    del dst
+
+    for key in table_keys:
+        if key == table_name or key not in table:
+            continue
+        value = table[key]
+        if key == 'table_shape':
+            value = dst_shape
+        np.save(join(outdir, key + '.npy'), value)
+    np.save(join(outdir, 'table_layout.npy'), np.array(layout))
+    if 'quantization' in table:
+        with open(join(outdir, QUANT_INFO_FNAME), 'w') as fobj:
+            json.dump(table['quantization'], fobj, indent=2)
+
+    print('  -> {:.3f} s'.format(time.time() - t0))
+
+    return outdir
+
+
+def parse_args(description=__doc__):
+    """Parse command line arguments"""
+    parser = ArgumentParser(description=description)
+    parser.add_argument(
+        '--table', required=True,
+        help='''npy-table directory or .fits table file'''
+    )
+    parser.add_argument(
+        '--kind', choices=['raw', 'ckv'], required=True,
+        help='''Kind of table to transform.'''
+    )
+    parser.add_argument(
+        '--layout', choices=list(TABLE_LAYOUTS.keys()), required=True,
+        help='''Layout (axis order) of the transformed table.'''
+    )
+    parser.add_argument(
+        '--outdir', required=True,
+        help='''Directory in which to store the transformed table.'''
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    outdir = transform_table_layout(**vars(parse_args())) # pylint: disable=invalid-name
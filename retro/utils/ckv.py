@@ -14,6 +14,7 @@ from __future__ import absolute_import, division, print_function
 
 __all__ = '''
     get_cone_map
+    get_cone_lookup
     convolve_table
     survival_prob_from_smeared_cone
     survival_prob_from_cone
@@ -239,6 +240,125 @@ def get_cone_map(
     return costheta_indices, deltaphi_indices, weights
 
 
+def get_cone_lookup(
+        ckv_costheta, num_phi, num_costheta_bins, num_deltaphi_bins,
+        oversample=1, delta_thetas=None
+    ):
+    """Get the bin indices and weights for sampling a Cherenkov cone in the
+    binned (costhetadir, deltaphidir) space, for cone axes in every
+    (costhetadir, deltaphidir) bin. This allows looking up (rather than
+    re-deriving) the cone map for each source in a raw table.
+
+    Parameters
+    ----------
+    ckv_costheta : scalar float
+        Cosine of Cherenkov angle (half the cone's opening angle)
+
+    num_phi : scalar int
+        Number of azimuth samples of the circle where the cone intersects the
+        unit sphere. Increase `num_phi` for for higher accuracy.
+
+    num_costheta_bins, num_deltaphi_bins : int
+        Number of bins in costheta and deltaphi dimensions. cosetheta is
+        assumed to be binned from -1 to 1, inclusive, and deltaphi is assumed
+        to be binned from 0 to pi, inclusive.
+
+    oversample : int > 0
+        Average the cone maps of `oversample` x `oversample` cone axes evenly
+        spaced within each (costhetadir, deltaphidir) bin
+
+    delta_thetas : sequence of length >= num_phi, optional
+        Offsets to apply to the Cherenkov angle for each azimuth sample to
+        achieve smearing (as in `survival_prob_from_smeared_cone`)
+
+    Returns
+    -------
+    offsets : shape (num_costheta_bins*num_deltaphi_bins + 1,) array of int64
+        Entries for the cone axis in bin (costhetadir_idx, deltaphidir_idx)
+        are at ``offsets[i]:offsets[i+1]`` in the below arrays, where
+        ``i = costhetadir_idx*num_deltaphi_bins + deltaphidir_idx``
+
+    costheta_indices, deltaphi_indices : arrays of uint32
+
+    weights : array of float64
+        Weights sum to 1 for each cone axis bin
+
+    """
+    costheta_bin_width = 2 / float(num_costheta_bins)
+    deltaphi_bin_width = PI / float(num_deltaphi_bins)
+    num_dir_bins = num_costheta_bins * num_deltaphi_bins
+
+    # Azimuth samples around the cone, with (optionally smeared) cone angle
+    p_phi = TWO_PI * np.arange(num_phi) / float(num_phi)
+    sin_p_phi = np.sin(p_phi)
+    cos_p_phi = np.cos(p_phi)
+    theta = np.full(shape=num_phi, fill_value=math.acos(ckv_costheta))
+    if delta_thetas is not None:
+        theta += np.asarray(delta_thetas)[:num_phi]
+    costheta = np.cos(theta)
+    sintheta = np.sin(theta)
+
+    # Cone axes sampled within each bin; dimensions are
+    # (deltaphi bin, deltaphi subsample, costheta subsample, phi sample)
+    subsamples = (np.arange(oversample) + 0.5) / oversample
+    ax_dp = (
+        (np.arange(num_deltaphi_bins)[:, None] + subsamples[None, :])
+        * deltaphi_bin_width
+    )[:, :, None, None]
+    ax_cp = np.cos(ax_dp)
+    ax_sp = np.sin(ax_dp)
+
+    offsets = [0]
+    costheta_indices = []
+    deltaphi_indices = []
+    weights = []
+    for costheta_bin in range(num_costheta_bins):
+        ax_ct = (
+            -1 + (costheta_bin + subsamples) * costheta_bin_width
+        )[None, None, :, None]
+        ax_st = np.sqrt(1 - ax_ct*ax_ct)
+
+        q_costheta = (-sintheta * ax_st * cos_p_phi) + (costheta * ax_ct)
+        abs_q_phi = np.abs(np.arctan2(
+            (sin_p_phi * sintheta * ax_cp) + (sintheta * ax_sp * cos_p_phi * ax_ct) + (ax_sp * ax_st * costheta),
+            (-sin_p_phi * sintheta * ax_sp) + (sintheta * cos_p_phi * ax_cp * ax_ct) + (ax_st * costheta * ax_cp)
+        ))
+
+        q_costheta_bins = np.clip(
+            ((q_costheta + 1) // costheta_bin_width).astype(np.int64),
+            0, num_costheta_bins - 1
+        )
+        q_deltaphi_bins = np.clip(
+            (abs_q_phi // deltaphi_bin_width).astype(np.int64),
+            0, num_deltaphi_bins - 1
+        )
+
+        # Histogram the samples of each cone axis bin over the direction bins
+        axis_idx = np.arange(num_deltaphi_bins)[:, None, None, None]
+        flat_idx = (
+            axis_idx * num_dir_bins
+            + q_costheta_bins * num_deltaphi_bins + q_deltaphi_bins
+        )
+        counts = np.bincount(
+            flat_idx.ravel(), minlength=num_deltaphi_bins*num_dir_bins
+        ).reshape(num_deltaphi_bins, num_dir_bins)
+        counts_total = oversample * oversample * num_phi
+
+        for deltaphi_bin in range(num_deltaphi_bins):
+            dir_idx = np.flatnonzero(counts[deltaphi_bin])
+            costheta_indices.append(dir_idx // num_deltaphi_bins)
+            deltaphi_indices.append(dir_idx % num_deltaphi_bins)
+            weights.append(counts[deltaphi_bin, dir_idx] / float(counts_total))
+            offsets.append(offsets[-1] + len(dir_idx))
+
+    offsets = np.array(offsets, dtype=np.int64)
+    costheta_indices = np.concatenate(costheta_indices).astype(np.uint32)
+    deltaphi_indices = np.concatenate(deltaphi_indices).astype(np.uint32)
+    weights = np.concatenate(weights).astype(np.float64)
+
+    return offsets, costheta_indices, deltaphi_indices, weights
+
+
 @numba_jit(parallel=False, nogil=True, cache=True) #**DFLT_NUMBA_JIT_KWARGS)
 def convolve_table(
         src, dst, cos_ckv, sin_ckv, r_bin_edges, ct_bin_edges, t_bin_edges,
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+
+"""
+Encode tables of non-negative values (e.g. Cherenkov tables) with 8 or 16 bits
+per entry, and decode them via a lookup table.
+
+Values are first divided by a per-table scale (the table's maximum), and the
+scaled values in [0, 1] are encoded as either the bits of a float16 or as the
+index of a logarithmically-spaced level (with 0 reserved for zero) spanning
+`dynamic_range` below 1. Either way, decoding a code is a lookup into a table
+that depends only on the encoding and dynamic range, so the same lookup table
+serves all tables; the per-table scale can be applied separately (e.g. folded
+into a table's normalization).
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = '''
+    QUANT_ENCODINGS
+    DFLT_DYNAMIC_RANGE
+    QUANT_INFO_FNAME
+    get_quant_dtype
+    get_quant_scale
+    quantize
+    get_dequant_lut
+'''.split()
+
+__author__ = 'J.L. Lanfranchi'
+__license__ = '''Copyright 2017 Justin L. Lanfranchi
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.'''
+
+import math
+from os.path import abspath, dirname
+import sys
+
+import numpy as np
+
+if __name__ == '__main__' and __package__ is None:
+    RETRO_DIR = dirname(dirname(abspath(__file__)))
+    if RETRO_DIR not in sys.path:
+        sys.path.append(RETRO_DIR)
+
+
+QUANT_ENCODINGS = ('float16', 'log_uint16', 'log_uint8')
+"""Encodings: float16 (stored as its bits in a uint16) or logarithmically
+spaced levels indexed by a uint16 or uint8"""
+
+DFLT_DYNAMIC_RANGE = 1e-12
+"""Smallest non-zero value (relative to the table's scale) representable by
+the log encodings; smaller values are encoded as zero"""
+
+QUANT_INFO_FNAME = 'quantization.json'
+"""File within a quantized table's directory recording the encoding, dynamic
+range, and per-table scales"""
+
+
+def get_quant_dtype(encoding):
+    """Get the integer dtype codes of `encoding` are stored as"""
+    if encoding in ('float16', 'log_uint16'):
+        return np.dtype(np.uint16)
+    if encoding == 'log_uint8':
+        return np.dtype(np.uint8)
+    raise ValueError('Unhandled encoding "{}"; must be one of {}'
+                     .format(encoding, QUANT_ENCODINGS))
+
+
+def _get_log_step(encoding, dynamic_range):
+    """Natural-log spacing between levels of a log encoding, such that code
+    ``max_code`` represents 1 and code 1 represents `dynamic_range`"""
+    max_code = np.iinfo(get_quant_dtype(encoding)).max
+    return -math.log(dynamic_range) / (max_code - 1)
+
+
+def get_quant_scale(table):
+    """Get the scale by which `table` is divided before encoding.
+
+    Parameters
+    ----------
+    table : array of non-negative values
+
+    Returns
+    -------
+    scale : float > 0
+
+    """
+    scale = float(np.max(table))
+    if scale > 0:
+        return scale
+    return 1.0
+
+
+def quantize(values, encoding, scale, dynamic_range=DFLT_DYNAMIC_RANGE):
+    """Encode values.
+
+    Parameters
+    ----------
+    values : array of non-negative values <= `scale`
+    encoding : str in QUANT_ENCODINGS
+    scale : float > 0
+        As returned by `get_quant_scale` for the whole table
+    dynamic_range : float in (0, 1)
+        Only used by log encodings
+
+    Returns
+    -------
+    codes : array of uint16 or uint8, same shape as `values`
+
+    """
+    dtype = get_quant_dtype(encoding)
+    scaled = np.asarray(values, dtype=np.float64) / scale
+    if encoding == 'float16':
+        return scaled.astype(np.float16).view(dtype)
+
+    max_code = np.iinfo(dtype).max
+    log_step = _get_log_step(encoding, dynamic_range)
+    with np.errstate(divide='ignore'):
+        codes = max_code + np.round(np.log(scaled) / log_step)
+    # Zero and values too small to represent (including log(0) = -inf)
+    codes[~(codes >= 1)] = 0
+    return np.minimum(codes, max_code).astype(dtype)
+
+
+def get_dequant_lut(encoding, dynamic_range=DFLT_DYNAMIC_RANGE):
+    """Get the lookup table for decoding values encoded by `quantize`.
+
+    Parameters
+    ----------
+    encoding : str in QUANT_ENCODINGS
+    dynamic_range : float in (0, 1)
+
+    Returns
+    -------
+    lut : shape (2**n_bits,) array of float32
+        ``lut[code]`` is the decoded value, relative to the table's scale
+
+    """
+    dtype = get_quant_dtype(encoding)
+    codes = np.arange(np.iinfo(dtype).max + 1, dtype=np.int64)
+    if encoding == 'float16':
+        return codes.astype(dtype).view(np.float16).astype(np.float32)
+
+    log_step = _get_log_step(encoding, dynamic_range)
+    lut = np.exp((codes - codes[-1]) * log_step)
+    lut[0] = 0
+    return lut.astype(np.float32)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+
+"""
+Compare negative log-likelihoods computed incrementally (see
+`retro.likelihood.IncrementalNegLLH`) against those computed from scratch by
+`get_neg_llh_fused` over multi-step energy scans of sample events, to check
+that the rounding error accumulated by incremental updates stays negligible.
+
+For each event and reference hypothesis, track energy is scanned up through
+the given energies and back down again (so muons both lengthen and shorten),
+followed by the same for cascade energy, all with one `IncrementalNegLLH`.
+
+Tables are loaded and stacked with the same hypo- and table-related arguments
+as `scan_neg_llh.py` (--fused is implied).
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = ['compare_incremental', 'parse_args', 'main']
+
+__author__ = 'J.L. Lanfranchi'
+__license__ = '''Copyright 2017 Justin L. Lanfranchi
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.'''
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from os.path import abspath, dirname
+import pickle
+import sys
+import time
+
+import numpy as np
+
+if __name__ == '__main__' and __package__ is None:
+    RETRO_DIR = dirname(dirname(abspath(__file__)))
+    if RETRO_DIR not in sys.path:
+        sys.path.append(RETRO_DIR)
+from retro import HYPO_PARAMS_T
+from retro.likelihood import (
+    INCREMENTAL_REFRESH_INTERVAL, IncrementalNegLLH, get_event_context,
+    get_neg_llh_fused
+)
+from retro.scan_neg_llh import (
+    add_setup_args, photons_to_hits, setup_dom_tables, setup_hypo_handler
+)
+from retro.utils.misc import expand
+
+
+def compare_incremental(
+        hits, time_window, hypos, hypo_handler, dom_tables, tdi_table=None,
+        num_threads=1, refresh_interval=INCREMENTAL_REFRESH_INTERVAL
+    ):
+    """Evaluate a sequence of hypotheses for one event incrementally and from
+    scratch and report the differences in negative log-likelihood.
+
+    Parameters
+    ----------
+    hits, time_window, hypo_handler, dom_tables, tdi_table, num_threads
+        See `get_neg_llh_fused`; `dom_tables` must have been stacked
+    hypos : sequence of HYPO_PARAMS_T
+        Evaluated in order by a single `IncrementalNegLLH`
+    refresh_interval : int >= 1
+        See `IncrementalNegLLH`
+
+    Returns
+    -------
+    info : OrderedDict
+        Keys are "neg_llh_full" and "neg_llh_incremental" (arrays of float64,
+        one entry per hypothesis) and "max_abs_diff" and "max_rel_diff"
+        (floats)
+
+    """
+    metric_kw = dict(
+        hits=get_event_context(
+            hits=hits, time_window=time_window, dom_tables=dom_tables
+        ),
+        time_window=time_window,
+        hypo_handler=hypo_handler,
+        dom_tables=dom_tables,
+        tdi_table=tdi_table,
+        num_threads=num_threads
+    )
+    incremental_neg_llh = IncrementalNegLLH(
+        refresh_interval=refresh_interval, **metric_kw
+    )
+    neg_llh_incremental = np.array(
+        [incremental_neg_llh.get_neg_llh(hypo) for hypo in hypos],
+        dtype=np.float64
+    )
+    neg_llh_full = np.array(
+        [get_neg_llh_fused(hypo, **metric_kw) for hypo in hypos],
+        dtype=np.float64
+    )
+    abs_diff = np.abs(neg_llh_incremental - neg_llh_full)
+    rel_diff = abs_diff / np.abs(neg_llh_full)
+
+    return OrderedDict([
+        ('neg_llh_full', neg_llh_full),
+        ('neg_llh_incremental', neg_llh_incremental),
+        ('max_abs_diff', np.max(abs_diff)),
+        ('max_rel_diff', np.max(rel_diff))
+    ])
+
+
+def parse_args(description=__doc__):
+    """Parse command-line arguments"""
+    parser = ArgumentParser(description=description)
+    parser.add_argument(
+        '--hits', required=True,
+        help='''Pickle file containing a sequence of events' hits'''
+    )
+    parser.add_argument(
+        '--hits-are-photons', action='store_true',
+    )
+    parser.add_argument(
+        '--time-window', type=float, required=True,
+    )
+    parser.add_argument(
+        '--n-events', type=int, default=None
+    )
+    parser.add_argument(
+        '--start-event-idx', type=int, default=0
+    )
+    parser.add_argument(
+        '--hypos', required=True,
+        help='''.npy file containing an array of shape (n_hypos, {}), one
+        row per reference hypothesis with columns {}; energies of each are
+        scanned for every event'''.format(
+            len(HYPO_PARAMS_T._fields), HYPO_PARAMS_T._fields
+        )
+    )
+    parser.add_argument(
+        '--energies', type=float, nargs='+',
+        default=list(np.linspace(1, 100, 100)),
+        help='''Energies (GeV) to scan, in order'''
+    )
+    parser.add_argument(
+        '--refresh-interval', type=int, default=INCREMENTAL_REFRESH_INTERVAL,
+        help='''See IncrementalNegLLH'''
+    )
+    add_setup_args(parser)
+    return parser.parse_args()
+
+
+def main():
+    """Script "main" function"""
+    kwargs = vars(parse_args())
+    time_window = kwargs.pop('time_window')
+    hits_are_photons = kwargs.pop('hits_are_photons')
+    kwargs.pop('fused')
+    num_threads = kwargs.pop('num_threads')
+    energies = kwargs.pop('energies')
+    refresh_interval = kwargs.pop('refresh_interval')
+
+    ref_hypos = [
+        HYPO_PARAMS_T(*hypo)
+        for hypo in np.load(expand(kwargs.pop('hypos'))).tolist()
+    ]
+    hypos = []
+    for ref_hypo in ref_hypos:
+        for param in ('track_energy', 'cascade_energy'):
+            for energy in list(energies) + list(energies[::-1]):
+                hypos.append(ref_hypo._replace(**{param: energy}))
+
+    with open(expand(kwargs.pop('hits')), 'rb') as hits_file:
+        hits = pickle.load(hits_file)
+    start_event_idx = kwargs.pop('start_event_idx')
+    n_events = kwargs.pop('n_events')
+    stop_event_idx = None if n_events is None else start_event_idx + n_events
+
+    print('Loading hypo kernels and tables')
+    t0 = time.time()
+    hypo_handler = setup_hypo_handler(kwargs)
+    dom_tables, tdi_table = setup_dom_tables(kwargs)
+    dom_tables.stack_tables()
+    print('  -> {:.3f} s\n'.format(time.time() - t0))
+
+    max_abs_diff = 0.0
+    max_rel_diff = 0.0
+    for event_ofst, event_hits in enumerate(
+            hits[start_event_idx:stop_event_idx]
+        ):
+        if hits_are_photons:
+            event_hits = photons_to_hits(event_hits, dom_tables.angsens_poly)
+        info = compare_incremental(
+            hits=event_hits,
+            time_window=time_window,
+            hypos=hypos,
+            hypo_handler=hypo_handler,
+            dom_tables=dom_tables,
+            tdi_table=tdi_table,
+            num_threads=num_threads,
+            refresh_interval=refresh_interval
+        )
+        print('event {:d}: max |diff| = {:.3e}, max |diff|/|neg_llh| = {:.3e}'
+              .format(start_event_idx + event_ofst, info['max_abs_diff'],
+                      info['max_rel_diff']))
+        max_abs_diff = max(max_abs_diff, info['max_abs_diff'])
+        max_rel_diff = max(max_rel_diff, info['max_rel_diff'])
+
+    print('\nAll events: max |diff| = {:.3e}, max |diff|/|neg_llh| = {:.3e}'
+          .format(max_abs_diff, max_rel_diff))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+
+"""
+Compare negative log-likelihoods computed in single precision against those
+computed in double precision (see `retro.tables.pexp_5d.PRECISIONS`) for a set
+of hypotheses on sample events, to check that the single-precision mode is
+accurate enough for the tables and events at hand.
+
+Tables are loaded once per precision, with the same hypo- and table-related
+arguments as `scan_neg_llh.py` (--precision and --fused are ignored). Events
+are evaluated first with the per-DOM tables and then again after stacking the
+tables, so that both the per-DOM and the fused (stacked) code paths are
+checked.
+
+The number of "busy" DOMs in each event (those with at least
+`retro.tables.pexp_5d.T_HIST_MIN_HITS` hits, the candidates for the
+time-histogram strategy) is reported alongside its differences; use
+--min-busy-doms to restrict the comparison to events that exercise that
+strategy.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = [
+    'count_busy_doms', 'compare_neg_llh', 'compare_precision', 'parse_args',
+    'main'
+]
+
+__author__ = 'J.L. Lanfranchi'
+__license__ = '''Copyright 2017 Justin L. Lanfranchi
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.'''
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from copy import deepcopy
+from os.path import abspath, dirname
+import pickle
+import sys
+import time
+
+import numpy as np
+
+if __name__ == '__main__' and __package__ is None:
+    RETRO_DIR = dirname(dirname(abspath(__file__)))
+    if RETRO_DIR not in sys.path:
+        sys.path.append(RETRO_DIR)
+from retro import HYPO_PARAMS_T
+from retro.likelihood import (
+    get_event_context, get_neg_llh, get_neg_llh_batch, prepare_hits
+)
+from retro.scan_neg_llh import (
+    add_setup_args, photons_to_hits, setup_dom_tables, setup_hypo_handler
+)
+from retro.tables.pexp_5d import T_HIST_MIN_HITS
+from retro.utils.misc import expand
+
+
+def count_busy_doms(hits):
+    """Count the DOMs with enough hits to be candidates for the
+    time-histogram strategy of the pexp_5d functions.
+
+    Parameters
+    ----------
+    hits : mapping or retro_types.EventHits
+        Anything accepted by `retro.likelihood.prepare_hits`
+
+    Returns
+    -------
+    num_busy_doms : int
+
+    """
+    dom_num_hits = np.diff(prepare_hits(hits).dom_hits_start)
+    return int(np.count_nonzero(dom_num_hits >= T_HIST_MIN_HITS))
+
+
+def compare_neg_llh(
+        hits, time_window, hypos, hypo_handler, ref_dom_tables,
+        test_dom_tables, tdi_table=None, num_threads=1
+    ):
+    """Evaluate hypotheses for one event with two sets of tables and report
+    the differences in negative log-likelihood.
+
+    Parameters
+    ----------
+    hits : mapping or retro_types.EventHits
+        Anything accepted by `retro.likelihood.prepare_hits`
+    time_window : float
+    hypos : sequence of HYPO_PARAMS_T
+    hypo_handler : hypo.discrete_hypo.DiscreteHypo
+    ref_dom_tables, test_dom_tables : tables.retro_5d_tables.Retro5DTables
+        Reference tables and the tables checked against them. If tables have
+        been stacked, `get_neg_llh_batch` is used, otherwise `get_neg_llh`.
+    tdi_table : optional
+    num_threads : int >= 1
+
+    Returns
+    -------
+    info : OrderedDict
+        Keys are "neg_llh_ref" and "neg_llh_test" (arrays of float64, one
+        entry per hypothesis) and "max_abs_diff", "mean_abs_diff", and
+        "max_rel_diff" (floats)
+
+    """
+    hits = prepare_hits(hits)
+    neg_llhs = []
+    for dom_tables in [ref_dom_tables, test_dom_tables]:
+        metric_kw = dict(
+            hits=get_event_context(
+                hits=hits, time_window=time_window, dom_tables=dom_tables
+            ),
+            time_window=time_window,
+            hypo_handler=hypo_handler,
+            dom_tables=dom_tables,
+            tdi_table=tdi_table
+        )
+        if dom_tables.table_stack is None:
+            neg_llh = np.array(
+                [get_neg_llh(hypo, **metric_kw) for hypo in hypos],
+                dtype=np.float64
+            )
+        else:
+            neg_llh = get_neg_llh_batch(
+                hypos, num_threads=num_threads, **metric_kw
+            )
+        neg_llhs.append(neg_llh)
+
+    neg_llh_ref, neg_llh_test = neg_llhs
+    abs_diff = np.abs(neg_llh_test - neg_llh_ref)
+    rel_diff = abs_diff / np.abs(neg_llh_ref)
+
+    return OrderedDict([
+        ('neg_llh_ref', neg_llh_ref),
+        ('neg_llh_test', neg_llh_test),
+        ('max_abs_diff', np.max(abs_diff)),
+        ('mean_abs_diff', np.mean(abs_diff)),
+        ('max_rel_diff', np.max(rel_diff))
+    ])
+
+
+def compare_precision(
+        hits, time_window, hypos, hypo_handler, double_dom_tables,
+        single_dom_tables, tdi_table=None, num_threads=1
+    ):
+    """Evaluate hypotheses for one event with double- and single-precision
+    tables and report the differences in negative log-likelihood.
+
+    Parameters
+    ----------
+    hits : mapping or retro_types.EventHits
+        Anything accepted by `retro.likelihood.prepare_hits`
+    time_window : float
+    hypos : sequence of HYPO_PARAMS_T
+    hypo_handler : hypo.discrete_hypo.DiscreteHypo
+    double_dom_tables, single_dom_tables : tables.retro_5d_tables.Retro5DTables
+        Tables loaded with precision "double" and "single", respectively. If
+        tables have been stacked, `get_neg_llh_batch` is used, otherwise
+        `get_neg_llh`.
+    tdi_table : optional
+    num_threads : int >= 1
+
+    Returns
+    -------
+    info : OrderedDict
+        Keys are "neg_llh_double" and "neg_llh_single" (arrays of float64,
+        one entry per hypothesis) and "max_abs_diff", "mean_abs_diff", and
+        "max_rel_diff" (floats)
+
+    """
+    info = compare_neg_llh(
+        hits=hits,
+        time_window=time_window,
+        hypos=hypos,
+        hypo_handler=hypo_handler,
+        ref_dom_tables=double_dom_tables,
+        test_dom_tables=single_dom_tables,
+        tdi_table=tdi_table,
+        num_threads=num_threads
+    )
+    return OrderedDict(
+        [('neg_llh_double', info.pop('neg_llh_ref')),
+         ('neg_llh_single', info.pop('neg_llh_test'))]
+        + list(info.items())
+    )
+
+
+def parse_args(description=__doc__):
+    """Parse command-line arguments"""
+    parser = ArgumentParser(description=description)
+    parser.add_argument(
+        '--hits', required=True,
+        help='''Pickle file containing a sequence of events' hits'''
+    )
+    parser.add_argument(
+        '--hits-are-photons', action='store_true',
+    )
+    parser.add_argument(
+        '--time-window', type=float, required=True,
+    )
+    parser.add_argument(
+        '--n-events', type=int, default=None
+    )
+    parser.add_argument(
+        '--start-event-idx', type=int, default=0
+    )
+    parser.add_argument(
+        '--hypos', required=True,
+        help='''.npy file containing an array of shape (n_hypos, {}), one
+        row per hypothesis with columns {}; each is evaluated for every
+        event'''.format(len(HYPO_PARAMS_T._fields), HYPO_PARAMS_T._fields)
+    )
+    parser.add_argument(
+        '--min-busy-doms', type=int, default=0,
+        help='''Skip events with fewer than this many DOMs having at least
+        {} hits (the candidates for the time-histogram strategy)'''
+        .format(T_HIST_MIN_HITS)
+    )
+    add_setup_args(parser)
+    return parser.parse_args()
+
+
+def main():
+    """Script "main" function"""
+    kwargs = vars(parse_args())
+    time_window = kwargs.pop('time_window')
+    hits_are_photons = kwargs.pop('hits_are_photons')
+    kwargs.pop('fused')
+    num_threads = kwargs.pop('num_threads')
+    kwargs.pop('precision')
+    min_busy_doms = kwargs.pop('min_busy_doms')
+
+    hypos = [
+        HYPO_PARAMS_T(*hypo)
+        for hypo in np.load(expand(kwargs.pop('hypos'))).tolist()
+    ]
+    with open(expand(kwargs.pop('hits')), 'rb') as hits_file:
+        hits = pickle.load(hits_file)
+    start_event_idx = kwargs.pop('start_event_idx')
+    n_events = kwargs.pop('n_events')
+    stop_event_idx = None if n_events is None else start_event_idx + n_events
+
+    print('Loading hypo kernels and tables')
+    t0 = time.time()
+    hypo_handler = setup_hypo_handler(kwargs)
+    dom_tables = OrderedDict()
+    for precision in ['double', 'single']:
+        dom_tables[precision], tdi_table = setup_dom_tables(
+            dict(deepcopy(kwargs), precision=precision)
+        )
+    print('  -> {:.3f} s\n'.format(time.time() - t0))
+
+    for path in ['per-DOM', 'fused']:
+        if path == 'fused':
+            for tables in dom_tables.values():
+                tables.stack_tables()
+        print('{} path:'.format(path))
+
+        max_abs_diff = 0.0
+        max_rel_diff = 0.0
+        for event_ofst, event_hits in enumerate(
+                hits[start_event_idx:stop_event_idx]
+            ):
+            if hits_are_photons:
+                event_hits = photons_to_hits(
+                    event_hits, dom_tables['double'].angsens_poly
+                )
+            num_busy_doms = count_busy_doms(event_hits)
+            if num_busy_doms < min_busy_doms:
+                continue
+            info = compare_precision(
+                hits=event_hits,
+                time_window=time_window,
+                hypos=hypos,
+                hypo_handler=hypo_handler,
+                double_dom_tables=dom_tables['double'],
+                single_dom_tables=dom_tables['single'],
+                tdi_table=tdi_table,
+                num_threads=num_threads
+            )
+            print('  event {:d} ({:d} busy DOMs): max |diff| = {:.3e},'
+                  ' mean |diff| = {:.3e}, max |diff|/|neg_llh| = {:.3e}'.format(
+                      start_event_idx + event_ofst, num_busy_doms,
+                      info['max_abs_diff'], info['mean_abs_diff'],
+                      info['max_rel_diff']
+                  ))
+            max_abs_diff = max(max_abs_diff, info['max_abs_diff'])
+            max_rel_diff = max(max_rel_diff, info['max_rel_diff'])
+
+        print('  All events: max |diff| = {:.3e}, max |diff|/|neg_llh| ='
+              ' {:.3e}\n'.format(max_abs_diff, max_rel_diff))
+
+if __name__ == '__main__':
+    main()
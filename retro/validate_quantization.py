@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=wrong-import-position
+
+"""
+Compare negative log-likelihoods computed with quantized Cherenkov tables (see
+`retro/tables/quantize_table.py`) against those computed with the original
+tables for a set of hypotheses on reference events, to check that the
+quantization is accurate enough for the tables and events at hand.
+
+The original tables are given by --dom-tables-fname-proto and the quantized
+tables by --quant-dom-tables-fname-proto; both are loaded with the same hypo-
+and table-related arguments as `scan_neg_llh.py`.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__all__ = ['parse_args', 'main']
+
+__author__ = 'J.L. Lanfranchi'
+__license__ = '''Copyright 2017 Justin L. Lanfranchi
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.'''
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from copy import deepcopy
+from os.path import abspath, dirname
+import pickle
+import sys
+import time
+
+import numpy as np
+
+if __name__ == '__main__' and __package__ is None:
+    RETRO_DIR = dirname(dirname(abspath(__file__)))
+    if RETRO_DIR not in sys.path:
+        sys.path.append(RETRO_DIR)
+from retro import HYPO_PARAMS_T
+from retro.scan_neg_llh import (
+    add_setup_args, photons_to_hits, setup_dom_tables, setup_hypo_handler
+)
+from retro.utils.misc import expand
+from retro.validate_precision import compare_neg_llh
+
+
+def parse_args(description=__doc__):
+    """Parse command-line arguments"""
+    parser = ArgumentParser(description=description)
+    parser.add_argument(
+        '--hits', required=True,
+        help='''Pickle file containing a sequence of events' hits'''
+    )
+    parser.add_argument(
+        '--hits-are-photons', action='store_true',
+    )
+    parser.add_argument(
+        '--time-window', type=float, required=True,
+    )
+    parser.add_argument(
+        '--n-events', type=int, default=None
+    )
+    parser.add_argument(
+        '--start-event-idx', type=int, default=0
+    )
+    parser.add_argument(
+        '--hypos', required=True,
+        help='''.npy file containing an array of shape (n_hypos, {}), one
+        row per hypothesis with columns {}; each is evaluated for every
+        event'''.format(len(HYPO_PARAMS_T._fields), HYPO_PARAMS_T._fields)
+    )
+    parser.add_argument(
+        '--quant-dom-tables-fname-proto', required=True,
+        help='''Like --dom-tables-fname-proto, but for the quantized
+        tables'''
+    )
+    add_setup_args(parser)
+    return parser.parse_args()
+
+
+def main():
+    """Script "main" function"""
+    kwargs = vars(parse_args())
+    time_window = kwargs.pop('time_window')
+    hits_are_photons = kwargs.pop('hits_are_photons')
+    fused = kwargs.pop('fused')
+    num_threads = kwargs.pop('num_threads')
+    quant_dom_tables_fname_proto = kwargs.pop('quant_dom_tables_fname_proto')
+
+    hypos = [
+        HYPO_PARAMS_T(*hypo)
+        for hypo in np.load(expand(kwargs.pop('hypos'))).tolist()
+    ]
+    with open(expand(kwargs.pop('hits')), 'rb') as hits_file:
+        hits = pickle.load(hits_file)
+    start_event_idx = kwargs.pop('start_event_idx')
+    n_events = kwargs.pop('n_events')
+    stop_event_idx = None if n_events is None else start_event_idx + n_events
+
+    print('Loading hypo kernels and tables')
+    t0 = time.time()
+    hypo_handler = setup_hypo_handler(kwargs)
+    dom_tables = OrderedDict()
+    for name, fname_proto in [
+            ('ref', kwargs['dom_tables_fname_proto']),
+            ('quant', quant_dom_tables_fname_proto)
+        ]:
+        dom_tables[name], tdi_table = setup_dom_tables(
+            dict(deepcopy(kwargs), dom_tables_fname_proto=fname_proto)
+        )
+        if fused:
+            dom_tables[name].stack_tables()
+    print('  -> {:.3f} s\n'.format(time.time() - t0))
+
+    max_abs_diff = 0.0
+    max_rel_diff = 0.0
+    for event_ofst, event_hits in enumerate(
+            hits[start_event_idx:stop_event_idx]
+        ):
+        if hits_are_photons:
+            event_hits = photons_to_hits(
+                event_hits, dom_tables['ref'].angsens_poly
+            )
+        info = compare_neg_llh(
+            hits=event_hits,
+            time_window=time_window,
+            hypos=hypos,
+            hypo_handler=hypo_handler,
+            ref_dom_tables=dom_tables['ref'],
+            test_dom_tables=dom_tables['quant'],
+            tdi_table=tdi_table,
+            num_threads=num_threads
+        )
+        print('event {:d}: max |diff| = {:.3e}, mean |diff| = {:.3e},'
+              ' max |diff|/|neg_llh| = {:.3e}'.format(
+                  start_event_idx + event_ofst, info['max_abs_diff'],
+                  info['mean_abs_diff'], info['max_rel_diff']
+              ))
+        max_abs_diff = max(max_abs_diff, info['max_abs_diff'])
+        max_rel_diff = max(max_rel_diff, info['max_rel_diff'])
+
+    print('\nAll events: max |diff| = {:.3e}, max |diff|/|neg_llh| = {:.3e}'
+          .format(max_abs_diff, max_rel_diff))
+
+
+if __name__ == '__main__':
+    main()